@@ -2,6 +2,8 @@
 // Global Variables
 let socket;
 let adminToken;
+let chatCursor = null;
+let chatEpoch = null;
 let currentRoomId;
 
 // DOM Elements
@@ -95,8 +97,9 @@ function initializeSocket() {
     socket.on('connect', () => {
         console.log('Admin connected to server');
         
-        // Authenticate as admin
-        socket.emit('admin_auth', { token: adminToken });
+        // Authenticate as admin; with a cursor only the missed changes are sent.
+        // The epoch ties the cursor to the change log that issued it.
+        socket.emit('admin_auth', { token: adminToken, since: chatCursor, epoch: chatEpoch });
     });
     
     socket.on('disconnect', () => {
@@ -105,6 +108,23 @@ function initializeSocket() {
     
     socket.on('chat_list', (data) => {
         populateChatList(data.chats);
+        chatCursor = data.cursor;
+        chatEpoch = data.epoch;
+    });
+    
+    socket.on('chat_delta', (data) => {
+        // Latest summary per changed room since the previous delta
+        data.changes.forEach((chat) => {
+            if (document.querySelector(`.chat-row[data-room-id="${chat.roomId}"]`)) {
+                updateChatRoom(chat);
+            } else {
+                addChatRoom(chat);
+            }
+        });
+        // Deltas relayed from other workers carry their own cursors
+        if (data.epoch === chatEpoch) {
+            chatCursor = data.cursor;
+        }
     });
     
     socket.on('chat_transcript', (data) => {
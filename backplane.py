@@ -0,0 +1,284 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import asyncio
+import fcntl
+import os
+import uuid
+
+from codec import encode_bytes, loads
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+# Largest newline-delimited frame the Unix socket backplane carries. Chat
+# deltas, history pages and pending-request lists can run well past the
+# StreamReader default of 64 KiB; anything over this is dropped on its own.
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+
+# Routes events between workers and tracks which worker owns each room.
+# Messages are dicts with a "kind"; a worker never receives its own messages.
+class Backplane:
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or uuid.uuid4().hex[:8]
+        self.rooms: Dict[str, str] = {}
+        self._handler: Optional[Handler] = None
+
+    async def start(self, handler: Handler):
+        self._handler = handler
+
+    async def close(self):
+        pass
+
+    def publish(self, message: Dict[str, Any]):
+        raise NotImplementedError
+
+    def claim_room(self, room_id: str):
+        self.rooms[room_id] = self.worker_id
+
+    def release_room(self, room_id: str):
+        self.rooms.pop(room_id, None)
+
+    def room_owner(self, room_id: str) -> Optional[str]:
+        return self.rooms.get(room_id)
+
+    def is_remote(self, room_id: str) -> bool:
+        owner = self.rooms.get(room_id)
+        return owner is not None and owner != self.worker_id
+
+    @property
+    def is_leader(self) -> bool:
+        # One worker at a time does the shared chores, e.g. writing the
+        # search index snapshot
+        return True
+
+    async def _deliver(self, message: Dict[str, Any]):
+        if self._handler is None:
+            return
+        try:
+            await self._handler(message)
+        except Exception as e:
+            print(f"Backplane handler error: {e}")
+
+
+# Shared state for in-process backplanes
+class InProcessHub:
+    def __init__(self):
+        self.members: List["InProcessBackplane"] = []
+        self.rooms: Dict[str, str] = {}
+
+
+# Single process: one worker alone, or several managers sharing a hub
+class InProcessBackplane(Backplane):
+    def __init__(self, worker_id: str = None, hub: InProcessHub = None):
+        super().__init__(worker_id)
+        self.hub = hub or InProcessHub()
+        self.rooms = self.hub.rooms
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        if self not in self.hub.members:
+            self.hub.members.append(self)
+
+    async def close(self):
+        if self in self.hub.members:
+            self.hub.members.remove(self)
+
+    @property
+    def is_leader(self) -> bool:
+        return not self.hub.members or self.hub.members[0] is self
+
+    def publish(self, message: Dict[str, Any]):
+        for member in self.hub.members:
+            if member is not self:
+                asyncio.get_running_loop().create_task(member._deliver(message))
+
+
+# Relays newline-delimited JSON between workers over a Unix socket and keeps
+# the authoritative room ownership table. Each worker introduces itself with
+# a hello; when its last connection goes away its rooms are released.
+class UnixSocketHub:
+    def __init__(self, path: str):
+        self.path = path
+        self.rooms: Dict[str, str] = {}
+        self.writers: List[asyncio.StreamWriter] = []
+        self.peers: Dict[asyncio.StreamWriter, str] = {}
+        self._server = None
+
+    async def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._serve, path=self.path, limit=MAX_FRAME_BYTES)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in self.writers:
+                writer.close()
+            await self._server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # New workers start with the current ownership table
+        for room_id, owner in self.rooms.items():
+            writer.write(encode_bytes({"kind": "claim", "roomId": room_id, "owner": owner}) + b"\n")
+        self.writers.append(writer)
+
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    message = loads(line)
+                except ValueError as e:
+                    # One oversized or garbled frame, not a dead worker
+                    print(f"Backplane hub dropped a frame: {e}")
+                    continue
+
+                kind = message.get("kind")
+                if kind == "hello":
+                    self.peers[writer] = message["workerId"]
+                    continue
+                if kind == "claim":
+                    self.rooms[message["roomId"]] = message["owner"]
+                elif kind == "release":
+                    self.rooms.pop(message["roomId"], None)
+
+                self._relay(line, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.remove(writer)
+            writer.close()
+            worker_id = self.peers.pop(writer, None)
+            if worker_id is not None and worker_id not in self.peers.values():
+                self._release_worker(worker_id)
+
+    def _relay(self, line: bytes, sender: asyncio.StreamWriter = None):
+        for other in self.writers:
+            if other is not sender:
+                other.write(line)
+
+    def _release_worker(self, worker_id: str):
+        # A worker that went away no longer owns its rooms; the survivors
+        # are told so they stop forwarding to it
+        for room_id in [room_id for room_id, owner in self.rooms.items() if owner == worker_id]:
+            del self.rooms[room_id]
+            self._relay(encode_bytes({"kind": "release", "roomId": room_id}) + b"\n")
+
+
+# Multi-process backplane. Workers elect a hub through a lock file; the
+# holder serves the socket and every worker (including it) connects as a
+# client. If the hub's worker exits, the survivors re-elect.
+class UnixSocketBackplane(Backplane):
+    def __init__(self, path: str, worker_id: str = None, reconnect_delay: float = 0.2):
+        super().__init__(worker_id)
+        self.path = path
+        self.reconnect_delay = reconnect_delay
+        self.hub: Optional[UnixSocketHub] = None
+        self._lock_file = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._task = None
+        self._connected = asyncio.Event()
+        self._closing = False
+
+    async def start(self, handler: Handler):
+        await super().start(handler)
+        self._task = asyncio.create_task(self._run())
+        await self._connected.wait()
+
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+        if self.hub is not None:
+            await self.hub.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+    def _try_become_hub(self) -> bool:
+        lock_file = open(self.path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    async def _run(self):
+        while not self._closing:
+            if self.hub is None and self._try_become_hub():
+                self.hub = UnixSocketHub(self.path)
+                await self.hub.start()
+
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_BYTES)
+            except (FileNotFoundError, ConnectionError):
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+
+            self._writer = writer
+            # Forget other workers' rooms (the hub sends its current table)
+            # and re-announce ours in case the hub was re-elected
+            for room_id, owner in list(self.rooms.items()):
+                if owner != self.worker_id:
+                    del self.rooms[room_id]
+            self._write({"kind": "hello", "workerId": self.worker_id})
+            for room_id in list(self.rooms):
+                self._write({"kind": "claim", "roomId": room_id, "owner": self.worker_id})
+            self._connected.set()
+
+            try:
+                while True:
+                    try:
+                        line = await reader.readline()
+                        if not line:
+                            break
+                        message = loads(line)
+                    except ValueError as e:
+                        print(f"Backplane dropped a frame: {e}")
+                        continue
+                    kind = message.get("kind")
+                    if kind == "claim":
+                        self.rooms[message["roomId"]] = message["owner"]
+                    elif kind == "release":
+                        self.rooms.pop(message["roomId"], None)
+                    else:
+                        await self._deliver(message)
+            except ConnectionError:
+                pass
+
+            self._writer = None
+            writer.close()
+            if not self._closing:
+                await asyncio.sleep(self.reconnect_delay)
+
+    @property
+    def is_leader(self) -> bool:
+        # The hub's worker, holding the lock file
+        return self.hub is not None
+
+    def _write(self, message: Dict[str, Any]):
+        if self._writer is None:
+            return
+        frame = encode_bytes(message)
+        if len(frame) >= MAX_FRAME_BYTES:
+            print(f"Backplane frame too large to send: {message.get('kind')} ({len(frame)} bytes)")
+            return
+        self._writer.write(frame + b"\n")
+
+    def publish(self, message: Dict[str, Any]):
+        self._write(message)
+
+    def claim_room(self, room_id: str):
+        super().claim_room(room_id)
+        self._write({"kind": "claim", "roomId": room_id, "owner": self.worker_id})
+
+    def release_room(self, room_id: str):
+        super().release_room(room_id)
+        self._write({"kind": "release", "roomId": room_id})
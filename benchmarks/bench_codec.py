@@ -0,0 +1,80 @@
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import codec
+from codec import ADMIN_EVENTS, AGENT_EVENTS, USER_EVENTS
+
+ROOM = {
+    "roomId": "room_3f9a1c",
+    "userId": "5b0e8a52-2f5e-4d7a-9f0c-1f7c2a9d7e11",
+    "userName": "Jane Doe",
+    "userEmail": "jane@example.com",
+    "startTime": "2024-05-01T10:15:30.123456",
+    "lastActivity": "2024-05-01T10:20:02.654321",
+    "status": "active",
+    "agentName": "Agent Smith"
+}
+
+OUTGOING = {
+    "typing": {"type": "typing", "isTyping": True, "sender": "user", "roomId": "room_3f9a1c"},
+    "message": {
+        "type": "message",
+        "message": "Thanks for waiting, I have looked into your order and it ships tomorrow.",
+        "sender": "bot",
+        "timestamp": "2024-05-01T10:20:02.654321",
+        "messageId": "9c1d2e3f",
+        "roomId": "room_3f9a1c"
+    },
+    "chat_delta": {"type": "chat_delta", "worker": "a1b2c3d4", "since": 120, "cursor": 170, "changes": [ROOM] * 50},
+    "chat_list": {"type": "chat_list", "chats": [ROOM] * 100, "offset": 0, "total": 100, "cursor": 170},
+}
+
+INCOMING = {
+    "typing": (USER_EVENTS, {"type": "typing", "roomId": "room_3f9a1c", "isTyping": True}),
+    "message": (USER_EVENTS, {"type": "message", "roomId": "room_3f9a1c", "message": "Where is my order?", "sender": "user"}),
+    "join_room_agent": (AGENT_EVENTS, {"type": "join_room_agent", "roomId": "room_3f9a1c", "agentName": "Agent Smith"}),
+    "get_transcript": (ADMIN_EVENTS, {"type": "get_transcript", "roomId": "room_3f9a1c", "before": 200, "limit": 50}),
+}
+
+
+def rate(function, argument, seconds: float = 0.3) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for _ in range(100):
+            function(argument)
+        count += 100
+    return count / (time.perf_counter() - started)
+
+
+def reject(data: str):
+    try:
+        codec.decode(data, USER_EVENTS)
+    except codec.FrameError:
+        pass
+
+
+def main():
+    print(f"codec backend: {codec.BACKEND}")
+
+    print("encode (events/s)      json.dumps    codec.encode")
+    for name, event in OUTGOING.items():
+        print(f"  {name:<18} {rate(json.dumps, event):>12,.0f} {rate(codec.encode, event):>15,.0f}")
+
+    print("decode (events/s)      json.loads    codec.decode (with validation)")
+    for name, (schemas, event) in INCOMING.items():
+        frame = json.dumps(event)
+        print(f"  {name:<18} {rate(json.loads, frame):>12,.0f} {rate(lambda data: codec.decode(data, schemas), frame):>15,.0f}")
+
+    oversized = json.dumps({"type": "message", "message": "x" * (codec.MAX_FRAME_BYTES * 4)})
+    rejected = rate(reject, oversized)
+    print(f"oversized frame rejected: {rejected:,.0f}/s ({len(oversized):,} chars)")
+
+
+if __name__ == "__main__":
+    main()
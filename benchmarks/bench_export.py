@@ -0,0 +1,98 @@
+import asyncio
+import json
+import sys
+import time
+import tracemalloc
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from memory_db import MemoryDatabase
+from message_writer import MESSAGE_BUCKET_SIZE
+from transcript_export import after_room, export_query, export_transcripts, find_resume_point
+
+SENDERS = ["user", "bot", "user", "human"]
+
+
+async def populate(db: MemoryDatabase, rooms: int, messages_per_room: int):
+    await db.chat_rooms.create_index("roomId")
+    await db.chat_messages.create_index([("roomId", 1), ("bucket", 1)], unique=True)
+
+    started = datetime(2024, 1, 1)
+    room_documents, bucket_documents = [], []
+    for index in range(rooms):
+        room_id = f"room_{index:06x}"
+        start_time = started + timedelta(seconds=index * 30)
+        room_documents.append({
+            "roomId": room_id,
+            "userId": f"user-{index}",
+            "userName": f"User {index}",
+            "userEmail": f"user{index}@example.com",
+            "startTime": start_time.isoformat(),
+            "lastActivity": (start_time + timedelta(minutes=5)).isoformat(),
+            "status": "closed" if index % 10 else "active",
+            "agentName": f"Agent {index % 20}" if index % 3 == 0 else None,
+            "messageCount": messages_per_room
+        })
+        messages = [{
+            "seq": seq,
+            "message": f"Message {seq} about order #{index}",
+            "sender": SENDERS[seq % len(SENDERS)],
+            "timestamp": (start_time + timedelta(seconds=seq * 10)).isoformat(),
+            "agentName": None
+        } for seq in range(messages_per_room)]
+        for first in range(0, messages_per_room, MESSAGE_BUCKET_SIZE):
+            bucket_documents.append({"roomId": room_id, "bucket": first // MESSAGE_BUCKET_SIZE, "messages": messages[first:first + MESSAGE_BUCKET_SIZE]})
+    await db.chat_rooms.insert_many(room_documents)
+    await db.chat_messages.insert_many(bucket_documents)
+
+
+async def drain(db: MemoryDatabase, query, compress: bool = False):
+    size = 0
+    chunks = 0
+    largest = 0
+    async for chunk in export_transcripts(db.chat_rooms, db.chat_messages, query, compress=compress):
+        size += len(chunk)
+        chunks += 1
+        largest = max(largest, len(chunk))
+    return size, chunks, largest
+
+
+async def main(rooms: int = 100000, messages_per_room: int = 8):
+    db = MemoryDatabase()
+    await populate(db, rooms, messages_per_room)
+    query = export_query(status="closed")
+    expected = await db.chat_rooms.count_documents(query)
+    print(f"rooms={rooms} messages_per_room={messages_per_room} exported={expected}")
+
+    for compress in (False, True):
+        started = time.perf_counter()
+        size, chunks, largest = await drain(db, query, compress)
+        elapsed = time.perf_counter() - started
+        label = "ndjson.gz" if compress else "ndjson"
+        print(f"{label:<10} {expected / elapsed:>9,.0f} rooms/s  {size / elapsed / 1e6:6.1f} MB/s  {size / 1e6:7.1f} MB in {chunks} chunks (largest {largest / 1e3:.0f} KB)")
+
+    # Memory held by the export itself, on top of the stand-in store
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    await drain(db, query)
+    peak = tracemalloc.get_traced_memory()[1] - baseline
+    tracemalloc.stop()
+    print(f"export peak memory: {peak / 1e6:.1f} MB (the store's sorted result list alone is {expected * 8 / 1e6:.1f} MB)")
+
+    # A cut-off download resumes after the last complete line
+    export = export_transcripts(db.chat_rooms, db.chat_messages, query, compress=True)
+    lines = zlib.decompressobj(31).decompress(await export.__anext__()).splitlines()
+    await export.aclose()
+    last = json.loads(lines[-1])["roomId"]
+    start_time = await find_resume_point(db.chat_rooms, last)
+    resumed = 0
+    async for chunk in export_transcripts(db.chat_rooms, db.chat_messages, after_room(query, start_time, last)):
+        resumed += chunk.count(b"\n")
+    print(f"resume after {last}: {len(lines)} + {resumed} = {len(lines) + resumed} rooms ({'ok' if len(lines) + resumed == expected else 'MISMATCH'})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*(int(arg) for arg in sys.argv[1:])))
@@ -0,0 +1,54 @@
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from inference import create_engine
+
+PROMPTS = [
+    "How do I reset my password?",
+    "Where is my order?",
+    "Can I change my delivery address?",
+    "What payment methods do you accept?",
+]
+
+
+async def run_room(engine, prompt: str):
+    started = time.perf_counter()
+    first_token = None
+    tokens = 0
+    async for _ in engine.stream(prompt):
+        if first_token is None:
+            first_token = time.perf_counter() - started
+        tokens += 1
+    return first_token or 0.0, tokens
+
+
+async def main(model: str = "gpt2", max_batch_size: int = 32, max_wait_ms: float = 20):
+    engine = create_engine(model, max_batch_size=max_batch_size, max_wait=max_wait_ms / 1000, temperature=0)
+    await engine.start()
+
+    # Warm up (also waits for the model to load)
+    await run_room(engine, "Hello")
+
+    for rooms in (1, 8, 32):
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_room(engine, PROMPTS[i % len(PROMPTS)]) for i in range(rooms)))
+        elapsed = time.perf_counter() - started
+
+        first_tokens = sorted(r[0] for r in results)
+        total_tokens = sum(r[1] for r in results)
+        print(
+            f"rooms={rooms:>2} tokens/s={total_tokens / elapsed:8.1f} "
+            f"ttft_p50={statistics.median(first_tokens) * 1000:7.1f}ms "
+            f"ttft_max={first_tokens[-1] * 1000:7.1f}ms"
+        )
+
+    await engine.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(*sys.argv[1:2]))
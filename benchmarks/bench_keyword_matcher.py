@@ -0,0 +1,56 @@
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from keyword_matcher import KeywordMatcher
+
+
+def random_word(rng: random.Random, length: int) -> str:
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(length))
+
+
+def naive_first_category(categories, text: str):
+    text_lower = text.lower()
+    for category, keywords in categories.items():
+        for keyword in keywords:
+            if keyword in text_lower:
+                return category
+    return None
+
+
+def main(keyword_count: int = 10000, message_length: int = 20000, rounds: int = 20):
+    rng = random.Random(42)
+    categories = {}
+    for index in range(keyword_count):
+        category = f"category_{index % 50}"
+        categories.setdefault(category, []).append(random_word(rng, rng.randint(5, 12)))
+
+    words = [random_word(rng, rng.randint(2, 9)) for _ in range(message_length // 5)]
+    message = " ".join(words)[:message_length]
+
+    started = time.perf_counter()
+    matcher = KeywordMatcher(categories)
+    build_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        matcher.find_all(message)
+    matcher_time = (time.perf_counter() - started) / rounds
+
+    started = time.perf_counter()
+    naive_first_category(categories, message)
+    naive_time = time.perf_counter() - started
+
+    megabytes = len(message) / 1e6
+    print(f"keywords={keyword_count} message_chars={len(message)}")
+    print(f"build: {build_time * 1000:.1f} ms")
+    print(f"automaton: {matcher_time * 1000:.2f} ms/message ({megabytes / matcher_time:.2f} MB/s)")
+    print(f"nested loop: {naive_time * 1000:.2f} ms/message ({megabytes / naive_time:.2f} MB/s)")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,584 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import json
+import math
+import os
+import random
+import resource
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+# Boots server.app in a child process against the in-memory database and
+# drives simulated users, agents and admins over real websockets. Results go
+# to stdout as a table and, with --json, to a file that can be diffed
+# between releases. The child reports its own event-loop lag and RSS.
+#
+#   python benchmarks/bench_load.py --users 2000 --agents 40 --json load.json
+
+CHAT_MESSAGES = [
+    "Where is my order {order}?",
+    "How do I change my shipping address?",
+    "Can I get a refund for order {order}?",
+    "What are your opening hours?",
+    "My package {order} arrived damaged",
+    "How do I reset my account?",
+    "Do you ship internationally?",
+    "I want to cancel order {order}",
+    "Is there a discount for students?",
+    "The app keeps logging me out",
+]
+SENSITIVE_MESSAGES = [
+    "There is an unauthorized transaction on my card",
+    "I think my account was hacked",
+    "I want to report fraud on order {order}",
+    "Is this a fake refund email?",
+    "I have a payment dispute about order {order}",
+]
+NAMES = ["Jane", "John", "Priya", "Wei", "Carlos", "Amara", "Lena", "Omar"]
+
+TIMEOUT = 30.0
+TAKEOVER_TIMEOUT = 180.0
+
+
+def percentile(samples, fraction: float):
+    if not samples:
+        return None
+    return samples[max(0, math.ceil(fraction * len(samples)) - 1)]
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "p50": percentile(samples, 0.5),
+        "p99": percentile(samples, 0.99),
+        "max": samples[-1] if samples else None
+    }
+
+
+def rss_bytes():
+    # (current, peak) resident set size of this process
+    try:
+        fields = dict(line.split(":", 1) for line in Path("/proc/self/status").read_text().splitlines() if ":" in line)
+        return int(fields["VmRSS"].split()[0]) * 1024, int(fields["VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, peak
+
+
+class LoopMonitor:
+    # Samples how late a fixed sleep wakes up, and RSS while it runs
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.lags = []
+        self.rss_peak = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def reset(self):
+        self.lags = []
+        self.rss_peak = rss_bytes()[0]
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append((time.perf_counter() - started - self.interval) * 1000)
+            self.rss_peak = max(self.rss_peak, rss_bytes()[0])
+
+    def report(self):
+        return dict(summarize(self.lags), samples=len(self.lags))
+
+
+def serve(port: int, db_latency: float):
+    # Child process: the app as uvicorn would run it, on the in-memory database
+    import uvicorn
+
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("static", exist_ok=True)
+
+    import server
+    from memory_db import MemoryDatabase
+
+    server.use_database(MemoryDatabase(latency=db_latency))
+    monitor = LoopMonitor()
+    lifespan = server.app.router.lifespan_context
+
+    @contextlib.asynccontextmanager
+    async def monitored(app):
+        async with lifespan(app):
+            monitor.start()
+            try:
+                yield
+            finally:
+                monitor.stop()
+
+    server.app.router.lifespan_context = monitored
+
+    @server.app.get("/bench/probe")
+    async def probe(reset: bool = False):
+        if reset:
+            monitor.reset()
+        current, peak = rss_bytes()
+        return {
+            "loopLag": monitor.report(),
+            "rss": {"current": current, "peak": peak, "peakSinceReset": monitor.rss_peak},
+            "stats": await server.get_stats()
+        }
+
+    uvicorn.run(server.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096,
+                ws_max_size=server.MAX_FRAME_BYTES, ws_per_message_deflate=False)
+
+
+class SmtpSink:
+    # Accepts the notification emails so the outbox never leaves the host
+    def __init__(self):
+        self.received = 0
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _session(self, reader, writer):
+        writer.write(b"220 bench ESMTP\r\n")
+        try:
+            while line := await reader.readline():
+                command = line[:4].upper()
+                if command == b"DATA":
+                    writer.write(b"354 end with .\r\n")
+                    await reader.readuntil(b"\r\n.\r\n")
+                    self.received += 1
+                    writer.write(b"250 queued\r\n")
+                elif command == b"QUIT":
+                    writer.write(b"221 bye\r\n")
+                    break
+                else:
+                    writer.write(b"250 ok\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        writer.close()
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.counts = collections.Counter()
+
+    def record(self, event: str, started: float):
+        self.latencies[event].append((time.perf_counter() - started) * 1000)
+
+    def report(self, duration: float):
+        events = {}
+        for event in sorted(set(self.latencies) | set(self.counts)):
+            samples = self.latencies.get(event, [])
+            count = len(samples) or self.counts[event]
+            events[event] = dict(summarize(samples), count=count, perSecond=round(count / duration, 2))
+        return events
+
+
+class Client:
+    # One websocket; events are routed to whoever is waiting for their type
+    def __init__(self, websocket, recorder: Recorder, on_event=None):
+        self.websocket = websocket
+        self.recorder = recorder
+        self.on_event = on_event
+        self.waiters = []
+        self.reader = asyncio.create_task(self._read())
+
+    @classmethod
+    async def connect(cls, url: str, recorder: Recorder, on_event=None):
+        import websockets
+
+        websocket = await websockets.connect(url, max_size=None, compression=None, ping_interval=None, open_timeout=TIMEOUT)
+        return cls(websocket, recorder, on_event)
+
+    async def _read(self):
+        try:
+            async for frame in self.websocket:
+                event = json.loads(frame)
+                for item in event["events"] if event.get("type") == "batch" else [event]:
+                    self._dispatch(item)
+        except Exception:
+            pass
+        for _, _, future in self.waiters:
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed"))
+
+    def _dispatch(self, event):
+        if self.on_event is not None:
+            self.on_event(self, event)
+        for waiter in self.waiters:
+            event_type, predicate, future = waiter
+            if event["type"] == event_type and not future.done() and (predicate is None or predicate(event)):
+                self.waiters.remove(waiter)
+                future.set_result(event)
+                return
+
+    def expect(self, event_type: str, predicate=None):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((event_type, predicate, future))
+        return future
+
+    async def send(self, message):
+        await self.websocket.send(json.dumps(message))
+
+    async def request(self, label: str, message, event_type: str, predicate=None, timeout: float = TIMEOUT):
+        # Sends message and records the time until the matching event arrives
+        waiter = self.expect(event_type, predicate)
+        started = time.perf_counter()
+        await self.send(message)
+        try:
+            event = await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, ConnectionError) as e:
+            self.recorder.errors[f"{label}: {type(e).__name__}"] += 1
+            return None
+        self.recorder.record(label, started)
+        return event
+
+    async def close(self):
+        await self.websocket.close()
+        await self.reader
+
+
+class Scenario:
+    def __init__(self, args, base_url: str):
+        self.args = args
+        self.base_url = base_url
+        self.recorder = Recorder()
+        self.rooms = []
+        # Send times of agent-side events, matched up when the user receives them
+        self.agent_sent = collections.defaultdict(collections.deque)
+        self.typing_sent = {}
+        self.done = asyncio.Event()
+
+    def message(self, rng: random.Random, templates):
+        return rng.choice(templates).format(order=f"#{rng.randint(100000, 100000 + self.args.orders)}")
+
+    def on_user_event(self, client: Client, event):
+        if event["type"] == "message" and event.get("sender") == "human":
+            sent = self.agent_sent[(event["roomId"], "message")]
+            if sent:
+                self.recorder.record("agent_message", sent.popleft())
+        elif event["type"] == "chat_ended":
+            sent = self.agent_sent[(event["roomId"], "end_chat")]
+            if sent:
+                self.recorder.record("end_chat", sent.popleft())
+
+    async def user(self, index: int):
+        rng = random.Random(self.args.seed * 1000003 + index)
+        name = rng.choice(NAMES)
+        try:
+            client = await Client.connect(f"{self.base_url}/ws", self.recorder, self.on_user_event)
+        except Exception as e:
+            self.recorder.errors[f"connect /ws: {type(e).__name__}"] += 1
+            return
+        try:
+            created = await client.request("join_room", {
+                "type": "join_room",
+                "userName": f"{name} {index}",
+                "userEmail": f"{name.lower()}{index}@example.com"
+            }, "room_created")
+            if created is None:
+                return
+            room_id = created["roomId"]
+            self.rooms.append(room_id)
+
+            bot_reply = lambda event: event.get("sender") == "bot" and not event.get("partial")
+            for _ in range(self.args.messages):
+                await asyncio.sleep(rng.uniform(0, 2 * self.args.think))
+                await client.request("message", {
+                    "type": "message",
+                    "roomId": room_id,
+                    "message": self.message(rng, CHAT_MESSAGES),
+                    "sender": "user"
+                }, "message", bot_reply)
+
+            if rng.random() >= self.args.escalate:
+                return
+
+            await client.request("sensitive_message", {
+                "type": "message",
+                "roomId": room_id,
+                "message": self.message(rng, SENSITIVE_MESSAGES),
+                "sender": "user"
+            }, "message", bot_reply)
+            joined = client.expect("human_joined")
+            started = time.perf_counter()
+            await client.request("request_human", {
+                "type": "request_human",
+                "roomId": room_id,
+                "userName": f"{name} {index}",
+                "userEmail": f"{name.lower()}{index}@example.com",
+                "issue": "Escalated by the load benchmark"
+            }, "human_requested")
+            try:
+                await asyncio.wait_for(joined, TAKEOVER_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                self.recorder.errors[f"takeover: {type(e).__name__}"] += 1
+                return
+            self.recorder.record("takeover", started)
+
+            self.typing_sent[room_id] = time.perf_counter()
+            await client.send({"type": "typing", "roomId": room_id, "isTyping": True})
+            self.recorder.counts["typing_sent"] += 1
+            try:
+                await asyncio.wait_for(client.expect("chat_ended"), TAKEOVER_TIMEOUT)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                self.recorder.errors[f"chat_ended: {type(e).__name__}"] += 1
+        finally:
+            await client.close()
+
+    async def agent(self, index: int):
+        rng = random.Random(self.args.seed * 7919 + index)
+        agent_name = f"Agent {index}"
+        tasks = set()
+
+        def on_event(client: Client, event):
+            if event["type"] == "request_assigned":
+                task = asyncio.create_task(self.handle_room(client, rng, event["data"]["roomId"], agent_name))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            elif event["type"] == "typing" and event.get("sender") == "user":
+                sent = self.typing_sent.pop(event["roomId"], None)
+                if sent is not None:
+                    self.recorder.record("typing", sent)
+
+        try:
+            client = await Client.connect(f"{self.base_url}/agent", self.recorder, on_event)
+        except Exception as e:
+            self.recorder.errors[f"connect /agent: {type(e).__name__}"] += 1
+            return
+        await client.request("agent_auth", {"type": "agent_auth", "token": "bench", "agentName": agent_name}, "pending_requests")
+        await self.done.wait()
+        for task in list(tasks):
+            task.cancel()
+        await client.close()
+
+    async def handle_room(self, client: Client, rng: random.Random, room_id: str, agent_name: str):
+        await client.request("get_chat_history", {
+            "type": "get_chat_history",
+            "roomId": room_id,
+            "limit": 50
+        }, "chat_history", lambda event: event["data"]["roomId"] == room_id)
+        for i in range(self.args.agent_messages):
+            await asyncio.sleep(rng.uniform(0, 2 * self.args.think))
+            self.agent_sent[(room_id, "message")].append(time.perf_counter())
+            await client.send({
+                "type": "message",
+                "roomId": room_id,
+                "message": f"Let me look into that for you ({i + 1})",
+                "sender": "human",
+                "agentName": agent_name
+            })
+        self.agent_sent[(room_id, "end_chat")].append(time.perf_counter())
+        await client.send({"type": "end_chat", "roomId": room_id, "agentName": agent_name})
+
+    async def admin(self, index: int):
+        rng = random.Random(self.args.seed * 104729 + index)
+
+        def on_event(client: Client, event):
+            if event["type"] == "chat_delta":
+                self.recorder.counts["chat_delta"] += 1
+                self.recorder.counts["chat_delta_rooms"] += len(event["changes"])
+
+        try:
+            client = await Client.connect(f"{self.base_url}/admin", self.recorder, on_event)
+        except Exception as e:
+            self.recorder.errors[f"connect /admin: {type(e).__name__}"] += 1
+            return
+        await client.request("admin_auth", {"type": "admin_auth", "token": "bench"}, "chat_list")
+        while not self.done.is_set():
+            try:
+                await asyncio.wait_for(self.done.wait(), rng.uniform(0.5, 1.5) * self.args.admin_interval)
+            except asyncio.TimeoutError:
+                pass
+            await client.request("get_chat_list", {"type": "get_chat_list", "limit": 100}, "chat_list")
+            if self.rooms:
+                room_id = rng.choice(self.rooms)
+                await client.request("get_transcript", {
+                    "type": "get_transcript",
+                    "roomId": room_id,
+                    "limit": 50
+                }, "chat_transcript", lambda event: event["data"]["roomId"] == room_id)
+        await client.close()
+
+    async def run(self):
+        staff = [asyncio.create_task(self.agent(i)) for i in range(self.args.agents)]
+        staff += [asyncio.create_task(self.admin(i)) for i in range(self.args.admins)]
+        await asyncio.sleep(1)
+
+        # Users arrive at a fixed rate and each runs its scenario to the end
+        started = time.perf_counter()
+        users = []
+        for index in range(self.args.users):
+            users.append(asyncio.create_task(self.user(index)))
+            await asyncio.sleep(1 / self.args.rate)
+        await asyncio.gather(*users)
+        duration = time.perf_counter() - started
+
+        self.done.set()
+        await asyncio.gather(*staff)
+        return duration
+
+
+def fetch_json(url: str):
+    with urllib.request.urlopen(url, timeout=TIMEOUT) as response:
+        return json.load(response)
+
+
+async def wait_until_ready(url: str, process: subprocess.Popen, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with {process.returncode}")
+        try:
+            return await asyncio.to_thread(fetch_json, url)
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        pass
+
+
+async def bench(args):
+    raise_file_limit()
+    sink = SmtpSink()
+    await sink.start()
+    port = args.port or free_port()
+    env = dict(
+        os.environ,
+        BOT_ENGINE="simulated",
+        SEARCH_INDEX_PATH="",
+        SMTP_HOST="127.0.0.1",
+        SMTP_PORT=str(sink.port),
+        SMTP_STARTTLS="0",
+        AGENT_MAX_ROOMS=str(args.agent_rooms),
+        PYTHONHASHSEED=str(args.seed),
+    )
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(port), "--db-latency", str(args.db_latency)],
+        env=env,
+        preexec_fn=raise_file_limit,
+    )
+    try:
+        await wait_until_ready(f"http://127.0.0.1:{port}/ready", process)
+        await asyncio.to_thread(fetch_json, f"http://127.0.0.1:{port}/bench/probe?reset=true")
+
+        client_loop = LoopMonitor()
+        client_loop.start()
+        scenario = Scenario(args, f"ws://127.0.0.1:{port}")
+        duration = await scenario.run()
+        client_loop.stop()
+
+        # Let the outbox and admin sync catch up before sampling the server
+        await asyncio.sleep(3)
+        probe = await asyncio.to_thread(fetch_json, f"http://127.0.0.1:{port}/bench/probe")
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.to_thread(process.wait, 30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        await sink.close()
+
+    return {
+        "config": {key: value for key, value in vars(args).items() if key not in ("json", "serve")},
+        "duration": round(duration, 3),
+        "events": scenario.recorder.report(duration),
+        "errors": dict(sorted(scenario.recorder.errors.items())),
+        "emails": sink.received,
+        "server": {
+            "loopLag": probe["loopLag"],
+            "rss": probe["rss"],
+            "stats": probe["stats"]
+        },
+        "client": {"loopLag": client_loop.report()}
+    }
+
+
+def print_report(results):
+    print(f"users={results['config']['users']} agents={results['config']['agents']} admins={results['config']['admins']} "
+          f"duration={results['duration']:.1f}s emails={results['emails']}")
+    print(f"{'event':<20} {'count':>8} {'per s':>9} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for event, row in results["events"].items():
+        latency = " ".join(f"{row[key]:>9.2f}" if row[key] is not None else f"{'-':>9}" for key in ("p50", "p99", "max"))
+        print(f"{event:<20} {row['count']:>8} {row['perSecond']:>9.2f} {latency}")
+    for error, count in results["errors"].items():
+        print(f"error: {error} x{count}")
+    server, client = results["server"], results["client"]
+    print(f"server loop lag: p50 {server['loopLag']['p50']:.2f} ms, p99 {server['loopLag']['p99']:.2f} ms, max {server['loopLag']['max']:.2f} ms")
+    print(f"server rss: {server['rss']['current'] / 1e6:.0f} MB now, {server['rss']['peakSinceReset'] / 1e6:.0f} MB peak during run")
+    print(f"client loop lag: p99 {client['loopLag']['p99']:.2f} ms (high values mean the client, not the server, is saturated)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Websocket load test for server.py")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--agents", type=int, default=40)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=200, help="users arriving per second")
+    parser.add_argument("--messages", type=int, default=3, help="bot chat messages per user")
+    parser.add_argument("--escalate", type=float, default=0.2, help="fraction of users escalated to an agent")
+    parser.add_argument("--agent-messages", type=int, default=2)
+    parser.add_argument("--agent-rooms", type=int, default=4, help="AGENT_MAX_ROOMS on the server")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between messages")
+    parser.add_argument("--admin-interval", type=float, default=2.0)
+    parser.add_argument("--orders", type=int, default=500, help="distinct order numbers, which sets the bot cache hit ratio")
+    parser.add_argument("--db-latency", type=float, default=0.001, help="seconds per simulated Mongo round trip")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--json", help="write machine-readable results here")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.db_latency)
+        return
+
+    results = asyncio.run(bench(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import gc
+import sys
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import Message, Room, intern
+
+
+def fresh(text: str) -> str:
+    # A new string object, as json.loads hands out for every frame
+    return "".join(list(text))
+
+
+def dict_room(index: int):
+    return f"room_{index:06x}", {
+        "userId": str(uuid.uuid4()),
+        "userName": f"User {index}",
+        "userEmail": f"user{index}@example.com",
+        "startTime": datetime.now().isoformat(),
+        "lastActivity": datetime.now().isoformat(),
+        "status": fresh("active"),
+        "agentId": str(uuid.uuid4()),
+        "agentName": fresh("Agent Smith"),
+        "messageCount": 0,
+        "messages": []
+    }
+
+
+def dict_message(room, text: str, sender: str):
+    message_data = {
+        "seq": room["messageCount"],
+        "message": text,
+        "sender": fresh(sender),
+        "timestamp": datetime.now().isoformat(),
+        "agentName": fresh("Agent Smith") if sender == "human" else None
+    }
+    room["messageCount"] += 1
+    room["messages"].append(message_data)
+
+
+def slotted_room(index: int):
+    room = Room(f"room_{index:06x}", str(uuid.uuid4()), f"User {index}", f"user{index}@example.com")
+    room.status = intern(fresh("active"))
+    room.agent_id = str(uuid.uuid4())
+    room.agent_name = intern(fresh("Agent Smith"))
+    return room.room_id, room
+
+
+def slotted_message(room, text: str, sender: str):
+    entry = Message(room.message_count, text, fresh(sender), time.time(), fresh("Agent Smith") if sender == "human" else None)
+    room.message_count += 1
+    room.messages.append(entry)
+
+
+def measure(make_room, add_message, rooms: int, messages_per_room: int):
+    # Message texts are shared so only per-object overhead is counted
+    texts = [f"message text {i}" for i in range(messages_per_room)]
+    senders = ["user", "bot", "human"]
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    table = dict(make_room(i) for i in range(rooms))
+    after_rooms = tracemalloc.get_traced_memory()[0]
+    for room in table.values():
+        for i, text in enumerate(texts):
+            add_message(room, text, senders[i % 3])
+    after_messages = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    per_room = (after_rooms - before) / rooms
+    per_message = (after_messages - after_rooms) / (rooms * messages_per_room) if messages_per_room else 0.0
+    return per_room, per_message
+
+
+def main(rooms: int = 20000, messages_per_room: int = 20):
+    dict_room_bytes, dict_message_bytes = measure(dict_room, dict_message, rooms, messages_per_room)
+    slot_room_bytes, slot_message_bytes = measure(slotted_room, slotted_message, rooms, messages_per_room)
+
+    print(f"rooms={rooms} messages_per_room={messages_per_room}")
+    print(f"dict:    {dict_room_bytes:7.0f} B/room  {dict_message_bytes:6.0f} B/message")
+    print(f"slotted: {slot_room_bytes:7.0f} B/room  {slot_message_bytes:6.0f} B/message")
+    print(f"saved:   {1 - slot_room_bytes / dict_room_bytes:7.1%} per room  {1 - slot_message_bytes / dict_message_bytes:6.1%} per message")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
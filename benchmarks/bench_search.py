@@ -0,0 +1,105 @@
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import Room
+from search_index import SearchIndex
+
+# Zipf-like vocabulary: a few very common words and a long tail
+COMMON = "the to i my is a and for you it of on in can this order please help with have".split()
+TAIL = [f"word{i}" for i in range(20000)]
+NAMES = ["Jane", "John", "Priya", "Wei", "Carlos", "Amara", "Lena", "Omar"]
+
+
+def make_message(rng: random.Random, room_index: int) -> str:
+    words = [rng.choice(COMMON) if rng.random() < 0.6 else TAIL[int(rng.paretovariate(1.1)) % len(TAIL)] for _ in range(rng.randint(4, 16))]
+    if rng.random() < 0.05:
+        words += ["order", f"#{100000 + room_index}"]
+    if rng.random() < 0.01:
+        words += ["payment", "dispute"]
+    return " ".join(words)
+
+
+def build(messages: int, messages_per_room: int = 20) -> SearchIndex:
+    rng = random.Random(7)
+    index = SearchIndex()
+    rooms = messages // messages_per_room
+    now = time.time()
+    for room_index in range(rooms):
+        name = rng.choice(NAMES)
+        room = Room(f"room_{room_index:07x}", f"user-{room_index}", f"{name} {room_index}", f"{name.lower()}{room_index}@example.com",
+                    start_time=now - (rooms - room_index) * 60, status="closed" if room_index % 4 else "active")
+        index.update_room(room)
+        index.add_message(room.room_id, 0, f"Hi, I need help with order #{100000 + room_index}")
+        for seq in range(1, messages_per_room):
+            index.add_message(room.room_id, seq, make_message(rng, room_index))
+    return index
+
+
+def timings(index: SearchIndex, query: str, runs: int = 20, **filters):
+    samples = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        total, _ = index.search(query, **filters)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return total, statistics.median(samples), samples[int(len(samples) * 0.99) - 1 if len(samples) >= 100 else -1]
+
+
+def main(messages: int = 2000000):
+    started = time.perf_counter()
+    index = build(messages)
+    elapsed = time.perf_counter() - started
+    stats = index.stats()
+    print(f"messages={messages} rooms={stats['rooms']} terms={stats['terms']} postings={stats['postings']}")
+    print(f"build: {elapsed:.1f}s ({messages / elapsed:,.0f} messages/s)")
+
+    path = os.path.join(tempfile.mkdtemp(), "search_index.pkl")
+    started = time.perf_counter()
+    state = index.snapshot()
+    copied = time.perf_counter() - started
+    SearchIndex.write_snapshot(state, path)
+    saved = time.perf_counter() - started
+    del state
+    started = time.perf_counter()
+    index = SearchIndex.load(path)
+    loaded = time.perf_counter() - started
+    print(f"snapshot: {os.path.getsize(path) / 1e6:.0f} MB, copy {copied:.2f}s (on the event loop), save {saved:.2f}s, load {loaded:.2f}s")
+
+    # Later snapshots only copy what changed since the previous one
+    index.snapshot()
+    for number in range(1000):
+        room = index.rooms[number % len(index.rooms)]
+        index.add_message(room.room_id, room.message_count, f"follow up word{number} about the refund")
+    started = time.perf_counter()
+    state = index.snapshot()
+    copied = time.perf_counter() - started
+    SearchIndex.write_snapshot(state, path)
+    print(f"delta after 1000 messages: {os.path.getsize(path + '.delta') / 1e3:.0f} kB, copy {copied * 1000:.1f}ms (on the event loop)")
+    os.remove(path)
+    os.remove(path + ".delta")
+
+    queries = [
+        ("rare term", "word300", {}),
+        ("order number", f"#{100000 + len(index.rooms) // 2}", {}),
+        ("email", index.rooms[len(index.rooms) // 3].user_email, {}),
+        ("phrase", '"payment dispute"', {}),
+        ("two terms", "order word17", {}),
+        ("common term", "order", {}),
+        ("common term, filtered", "order", {"status": "active"}),
+        ("common phrase", '"help with"', {}),
+    ]
+    print(f"{'query':<24} {'rooms':>8} {'p50 ms':>9} {'max ms':>9}")
+    for label, query, filters in queries:
+        total, p50, worst = timings(index, query, **filters)
+        print(f"{label:<24} {total:>8} {p50:>9.2f} {worst:>9.2f}")
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:]))
@@ -0,0 +1,461 @@
+from typing import Any, Dict, List, Optional
+import asyncio
+import copy
+import itertools
+
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, UpdateMany, UpdateOne
+
+
+# In-memory stand-in for the parts of the motor API that server.py uses.
+# Every call yields to the event loop (optionally after a fixed latency) so
+# scheduling behaves like a real round trip.
+class MemoryDatabase:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections: Dict[str, "MemoryCollection"] = {}
+
+    def __getattr__(self, name: str) -> "MemoryCollection":
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> "MemoryCollection":
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = MemoryCollection(self, name)
+            self._collections[name] = collection
+        return collection
+
+    async def command(self, name: str, *args, **kwargs):
+        await self._round_trip()
+        return {"ok": 1}
+
+    async def _round_trip(self):
+        await asyncio.sleep(self.latency)
+
+
+class InsertResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, matched: int, modified: int, upserted_id=None):
+        self.matched_count = matched
+        self.modified_count = modified
+        self.upserted_id = upserted_id
+
+
+class DeleteResult:
+    def __init__(self, deleted: int):
+        self.deleted_count = deleted
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+
+
+_ids = itertools.count(1)
+
+
+def _get_path(document: Dict[str, Any], path: str):
+    value: Any = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return None
+    return value
+
+
+def _set_path(document: Dict[str, Any], path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document: Dict[str, Any], path: str):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part, {})
+    document.pop(parts[-1], None)
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$eq" and value != operand:
+                return False
+            if op == "$ne" and value == operand:
+                return False
+            if op == "$in" and value not in operand:
+                return False
+            if op == "$nin" and value in operand:
+                return False
+            if op == "$exists" and (value is not None) != bool(operand):
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if op == "$gt" and not value > operand:
+                    return False
+                if op == "$gte" and not value >= operand:
+                    return False
+                if op == "$lt" and not value < operand:
+                    return False
+                if op == "$lte" and not value <= operand:
+                    return False
+        return True
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches(document: Dict[str, Any], query: Optional[Dict[str, Any]]) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, q) for q in condition):
+                return False
+        elif not _matches_condition(_get_path(document, key), condition):
+            return False
+    return True
+
+
+def project(document: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return copy.deepcopy(document)
+
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        result = {}
+        for key in include:
+            value = _get_path(document, key)
+            if value is not None or key in document:
+                _set_path(result, key, copy.deepcopy(value))
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+
+    result = copy.deepcopy(document)
+    for key, value in projection.items():
+        if not value:
+            _unset_path(result, key)
+    return result
+
+
+def apply_update(document: Dict[str, Any], update: Dict[str, Any], inserting: bool = False):
+    for op, fields in update.items():
+        for path, value in fields.items():
+            if op == "$set":
+                _set_path(document, path, copy.deepcopy(value))
+            elif op == "$setOnInsert":
+                if inserting:
+                    _set_path(document, path, copy.deepcopy(value))
+            elif op == "$unset":
+                _unset_path(document, path)
+            elif op == "$inc":
+                _set_path(document, path, (_get_path(document, path) or 0) + value)
+            elif op == "$max":
+                current = _get_path(document, path)
+                if current is None or value > current:
+                    _set_path(document, path, value)
+            elif op == "$min":
+                current = _get_path(document, path)
+                if current is None or value < current:
+                    _set_path(document, path, value)
+            elif op == "$push":
+                target = _get_path(document, path)
+                if target is None:
+                    target = []
+                    _set_path(document, path, target)
+                if isinstance(value, dict) and "$each" in value:
+                    target.extend(copy.deepcopy(value["$each"]))
+                else:
+                    target.append(copy.deepcopy(value))
+            elif op == "$addToSet":
+                target = _get_path(document, path)
+                if target is None:
+                    target = []
+                    _set_path(document, path, target)
+                for item in value["$each"] if isinstance(value, dict) and "$each" in value else [value]:
+                    if item not in target:
+                        target.append(copy.deepcopy(item))
+            elif op == "$pull":
+                target = _get_path(document, path) or []
+                _set_path(document, path, [item for item in target if item != value])
+            else:
+                raise NotImplementedError(op)
+
+
+class MemoryCursor:
+    def __init__(self, collection: "MemoryCollection", query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort: List = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key, direction: int = 1):
+        self._sort = key if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, count: int):
+        self._skip = count
+        return self
+
+    def limit(self, count: int):
+        self._limit = count
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    def _matching(self) -> List[Dict[str, Any]]:
+        # Stored documents (not copies) in result order
+        documents = [d for d in self._collection._candidates(self._query) if matches(d, self._query)]
+        for key, direction in reversed(self._sort):
+            documents.sort(
+                key=lambda d: (_get_path(d, key) is not None, _get_path(d, key)),
+                reverse=direction < 0
+            )
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return documents
+
+    def _materialize(self):
+        return [project(d, self._projection) for d in self._matching()]
+
+    async def to_list(self, length: Optional[int] = None):
+        await self._collection._db._round_trip()
+        results = self._materialize()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        # Documents are copied as they are consumed, like a server-side cursor
+        if self._results is None:
+            await self._collection._db._round_trip()
+            self._results = iter(self._matching())
+        try:
+            return project(next(self._results), self._projection)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class MemoryCollection:
+    def __init__(self, db: MemoryDatabase, name: str):
+        self._db = db
+        self.name = name
+        self._documents: List[Dict[str, Any]] = []
+        self.indexes: List = []
+
+        # Leading field of each index -> {value: documents}, built on first use
+        self._lookups: Dict[str, Optional[Dict[Any, List[Dict[str, Any]]]]] = {}
+
+    async def create_index(self, keys, **kwargs):
+        await self._db._round_trip()
+        self.indexes.append((keys, kwargs))
+        self._add_lookup(keys)
+        return str(keys)
+
+    async def create_indexes(self, models):
+        await self._db._round_trip()
+        for model in models:
+            self.indexes.append((model.document["key"], dict(model.document)))
+            self._add_lookup(list(model.document["key"].items()))
+        return [str(m.document["key"]) for m in models]
+
+    def _add_lookup(self, keys):
+        field = keys if isinstance(keys, str) else keys[0][0]
+        self._lookups.setdefault(field, None)
+
+    def _lookup(self, field: str) -> Dict[Any, List[Dict[str, Any]]]:
+        lookup = self._lookups[field]
+        if lookup is None:
+            lookup = {}
+            for document in self._documents:
+                lookup.setdefault(_get_path(document, field), []).append(document)
+            self._lookups[field] = lookup
+        return lookup
+
+    def _candidates(self, query) -> List[Dict[str, Any]]:
+        # Narrows the scan through an indexed field the query pins to values
+        for field in self._lookups:
+            condition = (query or {}).get(field)
+            if isinstance(condition, dict):
+                if list(condition) != ["$in"]:
+                    continue
+                values = condition["$in"]
+            elif condition is None:
+                continue
+            else:
+                values = [condition]
+            try:
+                lookup = self._lookup(field)
+                found = [document for value in values for document in lookup.get(value, ())]
+            except TypeError:
+                continue
+            return found
+        return self._documents
+
+    def _reset_lookups(self, update=None):
+        # Rebuilt on next use when documents go away or an indexed field may change
+        for field in self._lookups:
+            if update is None or any(path.split(".")[0] == field.split(".")[0] for fields in update.values() for path in fields):
+                self._lookups[field] = None
+
+    def _insert(self, document: Dict[str, Any]):
+        if "_id" not in document:
+            document["_id"] = next(_ids)
+        stored = copy.deepcopy(document)
+        self._documents.append(stored)
+        for field, lookup in self._lookups.items():
+            if lookup is not None:
+                lookup.setdefault(_get_path(stored, field), []).append(stored)
+        return document["_id"]
+
+    def _update(self, query, update, upsert: bool, many: bool) -> UpdateResult:
+        if "$" not in next(iter(update), "$"):
+            raise ValueError("update only works with $ operators")
+        self._reset_lookups(update)
+        matched = 0
+        for document in self._documents:
+            if matches(document, query):
+                apply_update(document, update)
+                matched += 1
+                if not many:
+                    break
+        if matched == 0 and upsert:
+            document = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+            apply_update(document, update, inserting=True)
+            return UpdateResult(0, 0, self._insert(document))
+        return UpdateResult(matched, matched)
+
+    def _delete(self, query, many: bool) -> DeleteResult:
+        self._reset_lookups()
+        deleted = 0
+        kept = []
+        for document in self._documents:
+            if (many or deleted == 0) and matches(document, query):
+                deleted += 1
+            else:
+                kept.append(document)
+        self._documents = kept
+        return DeleteResult(deleted)
+
+    async def insert_one(self, document: Dict[str, Any]):
+        await self._db._round_trip()
+        return InsertResult(self._insert(document))
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True):
+        await self._db._round_trip()
+        return [self._insert(d) for d in documents]
+
+    async def update_one(self, query, update, upsert: bool = False):
+        await self._db._round_trip()
+        return self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert: bool = False):
+        await self._db._round_trip()
+        return self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query, replacement, upsert: bool = False):
+        await self._db._round_trip()
+        self._reset_lookups()
+        for index, document in enumerate(self._documents):
+            if matches(document, query):
+                replacement = dict(replacement, _id=document["_id"])
+                self._documents[index] = copy.deepcopy(replacement)
+                return UpdateResult(1, 1)
+        if upsert:
+            return UpdateResult(0, 0, self._insert(dict(replacement)))
+        return UpdateResult(0, 0)
+
+    async def delete_one(self, query):
+        await self._db._round_trip()
+        return self._delete(query, many=False)
+
+    async def delete_many(self, query):
+        await self._db._round_trip()
+        return self._delete(query, many=True)
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        await self._db._round_trip()
+        cursor = MemoryCursor(self, query, projection)
+        if sort:
+            cursor.sort(sort)
+        results = cursor.limit(1)._materialize()
+        return results[0] if results else None
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert: bool = False, return_document: bool = False):
+        await self._db._round_trip()
+        cursor = MemoryCursor(self, query, None)
+        if sort:
+            cursor.sort(sort)
+        found = cursor.limit(1)._materialize()
+        if not found:
+            if upsert:
+                self._update(query, update, True, many=False)
+            return None
+        target = next(d for d in self._documents if d["_id"] == found[0]["_id"])
+        self._reset_lookups(update)
+        apply_update(target, update)
+        return project(target if return_document else found[0], projection)
+
+    async def find_one_and_delete(self, query, projection=None, sort=None):
+        await self._db._round_trip()
+        cursor = MemoryCursor(self, query, None)
+        if sort:
+            cursor.sort(sort)
+        found = cursor.limit(1)._materialize()
+        if not found:
+            return None
+        self._reset_lookups()
+        self._documents = [d for d in self._documents if d["_id"] != found[0]["_id"]]
+        return project(found[0], projection)
+
+    def find(self, query=None, projection=None, sort=None, batch_size: int = 0):
+        cursor = MemoryCursor(self, query, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor
+
+    async def count_documents(self, query):
+        await self._db._round_trip()
+        return sum(1 for d in self._documents if matches(d, query))
+
+    async def bulk_write(self, operations, ordered: bool = True):
+        await self._db._round_trip()
+        result = BulkWriteResult()
+        for operation in operations:
+            if isinstance(operation, InsertOne):
+                self._insert(operation._doc)
+                result.inserted_count += 1
+            elif isinstance(operation, (UpdateOne, UpdateMany)):
+                outcome = self._update(operation._filter, operation._doc, bool(operation._upsert), isinstance(operation, UpdateMany))
+                result.matched_count += outcome.matched_count
+                result.modified_count += outcome.modified_count
+                result.upserted_count += outcome.upserted_id is not None
+            elif isinstance(operation, ReplaceOne):
+                await self.replace_one(operation._filter, operation._doc, bool(operation._upsert))
+            elif isinstance(operation, (DeleteOne, DeleteMany)):
+                result.deleted_count += self._delete(operation._filter, isinstance(operation, DeleteMany)).deleted_count
+            else:
+                raise NotImplementedError(type(operation).__name__)
+        return result
@@ -0,0 +1,252 @@
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Union
+from collections import deque
+import asyncio
+import time
+
+from fastapi import WebSocket
+
+from codec import ENCODINGS, Frame, as_frame, join_batch
+
+# Slow-consumer policies when a connection's send queue is full
+#   drop        - discard the new payload
+#   coalesce    - replace a queued payload with the same key, else drop the oldest
+#   disconnect  - close the connection
+SLOW_CONSUMER_POLICIES = ("drop", "coalesce", "disconnect")
+
+# Upper bounds for what a client may negotiate
+MAX_BATCH_WINDOW_MS = 100
+MAX_BATCH_EVENTS = 64
+
+
+def frame_header_size(length: int) -> int:
+    # Unmasked server-to-client websocket frame header
+    if length < 126:
+        return 2
+    if length < 0x10000:
+        return 4
+    return 10
+
+
+# Wire format for one connection, negotiated from the connect URL, e.g.
+# /agent?encoding=msgpack&batch=20. Without parameters a connection gets
+# one JSON text frame per event, as before.
+class WireProtocol:
+    __slots__ = ("encoding", "batch_window", "max_batch")
+
+    def __init__(self, encoding: str = "json", batch_window: float = 0.0, max_batch: int = 1):
+        self.encoding = encoding
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+
+    @classmethod
+    def negotiate(cls, params: Mapping[str, str]) -> "WireProtocol":
+        encoding = params.get("encoding", "json")
+        if encoding not in ENCODINGS:
+            encoding = "json"
+        try:
+            batch_ms = min(max(float(params.get("batch", 0)), 0.0), MAX_BATCH_WINDOW_MS)
+            max_batch = min(max(int(params.get("maxBatch", 32)), 1), MAX_BATCH_EVENTS)
+        except ValueError:
+            batch_ms, max_batch = 0.0, 32
+        # Without a batch window every event keeps its own frame
+        return cls(encoding, batch_ms / 1000, max_batch if batch_ms else 1)
+
+    @property
+    def is_default(self) -> bool:
+        return self.encoding == "json" and not self.batch_window
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "type": "protocol",
+            "encoding": self.encoding,
+            "batchMs": self.batch_window * 1000,
+            "maxBatch": self.max_batch
+        }
+
+
+# Bounded outgoing queue plus a writer task for one websocket
+class ConnectionSender:
+    def __init__(self, websocket: WebSocket, max_queue: int = 256, policy: str = "coalesce", protocol: WireProtocol = None, on_write: Callable[[float], None] = None):
+        self.websocket = websocket
+        self.on_write = on_write
+        self.max_queue = max_queue
+        self.policy = policy
+        self.protocol = protocol or WireProtocol()
+        self.queue: deque = deque()
+        self.closed = False
+        self.dropped = 0
+
+        # Bytes as one JSON text frame per event vs. bytes actually written,
+        # frame headers included and before permessage-deflate
+        self.events = 0
+        self.frames = 0
+        self.json_bytes = 0
+        self.bytes_sent = 0
+
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def send(self, frame: Frame, key: Optional[str] = None) -> bool:
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                self.dropped += 1
+                asyncio.create_task(self.close(drop_connection=True))
+                return False
+
+            if self.policy == "coalesce":
+                if key is not None:
+                    for entry in self.queue:
+                        if entry[0] == key:
+                            entry[1] = frame
+                            return True
+                self.queue.popleft()
+                self.dropped += 1
+            else:
+                self.dropped += 1
+                return False
+
+        self.queue.append([key, frame])
+        self._ready.set()
+        return True
+
+    async def _run(self):
+        protocol = self.protocol
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready.clear()
+                if protocol.batch_window and len(self.queue) < protocol.max_batch:
+                    # Let a burst accumulate into one frame
+                    await asyncio.sleep(protocol.batch_window)
+                while self.queue:
+                    count = min(len(self.queue), protocol.max_batch)
+                    await self._write([self.queue.popleft()[1] for _ in range(count)])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Dead socket: stop accepting payloads, the receive loop cleans up
+            self.closed = True
+            self.queue.clear()
+
+    async def _write(self, frames: List[Frame]):
+        encoding = self.protocol.encoding
+        payloads = [frame.payload_for(encoding) for frame in frames]
+        payload = payloads[0] if len(payloads) == 1 else join_batch(payloads, encoding)
+
+        started = time.perf_counter() if self.on_write is not None else 0.0
+        if encoding == "json":
+            await self.websocket.send_text(payload)
+        else:
+            await self.websocket.send_bytes(payload)
+        if self.on_write is not None:
+            self.on_write(time.perf_counter() - started)
+
+        self.events += len(frames)
+        self.frames += 1
+        if self.protocol.is_default:
+            size = frames[0].json_size
+            self.json_bytes += size + frame_header_size(size)
+            self.bytes_sent += size + frame_header_size(size)
+            return
+        for frame in frames:
+            self.json_bytes += frame.json_size + frame_header_size(frame.json_size)
+        if encoding == "json":
+            # The batch wrapper is ASCII, so its characters are its bytes
+            size = sum(frame.json_size for frame in frames) + len(payload) - sum(map(len, payloads))
+        else:
+            size = len(payload)
+        self.bytes_sent += size + frame_header_size(size)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "encoding": self.protocol.encoding,
+            "batchMs": self.protocol.batch_window * 1000,
+            "events": self.events,
+            "frames": self.frames,
+            "jsonBytes": self.json_bytes,
+            "bytesSent": self.bytes_sent,
+            "bytesSaved": self.json_bytes - self.bytes_sent,
+            "dropped": self.dropped
+        }
+
+    async def close(self, drop_connection: bool = False):
+        self.closed = True
+        self.queue.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
+        if drop_connection:
+            try:
+                await self.websocket.close(code=1008)
+            except Exception:
+                pass
+
+
+# Serializes each payload once per encoding and fans it out to
+# per-connection queues
+class Broadcaster:
+    def __init__(self, max_queue: int = 256, policy: str = "coalesce", on_write: Callable[[float], None] = None):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+
+        self.max_queue = max_queue
+        self.policy = policy
+        # Called with the seconds each websocket write took, if given
+        self.on_write = on_write
+        self.senders: Dict[WebSocket, ConnectionSender] = {}
+
+        # Totals from connections that have gone away
+        self.closed_stats = {"connections": 0, "events": 0, "frames": 0, "jsonBytes": 0, "bytesSent": 0, "dropped": 0}
+
+    def register(self, websocket: WebSocket, protocol: WireProtocol = None) -> ConnectionSender:
+        sender = self.senders.get(websocket)
+        if sender is None:
+            sender = ConnectionSender(websocket, self.max_queue, self.policy, protocol, self.on_write)
+            self.senders[websocket] = sender
+        return sender
+
+    async def unregister(self, websocket: WebSocket) -> Optional[Dict[str, Any]]:
+        sender = self.senders.pop(websocket, None)
+        if sender is None:
+            return None
+        await sender.close()
+
+        stats = sender.stats()
+        self.closed_stats["connections"] += 1
+        for field in ("events", "frames", "jsonBytes", "bytesSent", "dropped"):
+            self.closed_stats[field] += stats[field]
+        return stats
+
+    def send(self, websocket: WebSocket, message: Union[Dict[str, Any], Frame], key: Optional[str] = None) -> bool:
+        sender = self.senders.get(websocket)
+        if sender is None:
+            return False
+        return sender.send(as_frame(message), key)
+
+    def dropped_total(self) -> int:
+        # Events dropped by slow-consumer policies, over every connection so far
+        return self.closed_stats["dropped"] + sum(sender.dropped for sender in self.senders.values())
+
+    def broadcast(self, websockets: Iterable[WebSocket], message: Union[Dict[str, Any], Frame], key: Optional[str] = None) -> int:
+        frame = as_frame(message)
+        delivered = 0
+        for websocket in websockets:
+            sender = self.senders.get(websocket)
+            if sender is not None and sender.send(frame, key):
+                delivered += 1
+        return delivered
+
+    def stats(self) -> Dict[str, Any]:
+        totals = dict(self.closed_stats)
+        by_encoding: Dict[str, int] = {}
+        for sender in self.senders.values():
+            stats = sender.stats()
+            for field in ("events", "frames", "jsonBytes", "bytesSent", "dropped"):
+                totals[field] += stats[field]
+            by_encoding[stats["encoding"]] = by_encoding.get(stats["encoding"], 0) + 1
+        totals["bytesSaved"] = totals["jsonBytes"] - totals["bytesSent"]
+        totals["open"] = len(self.senders)
+        totals["openByEncoding"] = by_encoding
+        return totals
@@ -0,0 +1,205 @@
+from typing import Any, Dict, Iterable, List, Tuple, Union
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Largest inbound websocket frame, in UTF-8 bytes
+MAX_FRAME_BYTES = 64 * 1024
+
+# Close code for frames over the limit (RFC 6455 "message too big")
+CLOSE_TOO_BIG = 1009
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def encode_bytes(message: Any) -> bytes:
+        return orjson.dumps(message)
+
+    def encode(message: Any) -> str:
+        return orjson.dumps(message).decode()
+
+    loads = orjson.loads
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+    def encode_bytes(message: Any) -> bytes:
+        return _encoder.encode(message).encode()
+
+    def encode(message: Any) -> str:
+        return _encoder.encode(message)
+
+    loads = json.loads
+
+# Wire encodings a connection can ask for; msgpack frames are binary
+ENCODINGS = ("json", "msgpack") if msgpack is not None else ("json",)
+
+if msgpack is not None:
+    def pack(message: Any) -> bytes:
+        return msgpack.packb(message, use_bin_type=True)
+
+    # {"type": "batch", "events": [...]} up to the array header
+    _PACKED_BATCH_PREFIX = b"\x82" + pack("type") + pack("batch") + pack("events")
+
+
+def _packed_array_header(length: int) -> bytes:
+    if length < 16:
+        return bytes([0x90 | length])
+    if length < 0x10000:
+        return b"\xdc" + length.to_bytes(2, "big")
+    return b"\xdd" + length.to_bytes(4, "big")
+
+
+def join_batch(payloads: List[Union[str, bytes]], encoding: str = "json") -> Union[str, bytes]:
+    # Wraps already encoded events in one batch event without re-encoding them
+    if encoding == "msgpack":
+        return _PACKED_BATCH_PREFIX + _packed_array_header(len(payloads)) + b"".join(payloads)
+    return '{"type":"batch","events":[' + ",".join(payloads) + "]}"
+
+
+class FrameError(ValueError):
+    def __init__(self, message: str, close_code: int = None):
+        super().__init__(message)
+        self.close_code = close_code
+
+
+# An outgoing event encoded at most once per encoding, however many
+# sockets it goes to. json_size is its size as a plain JSON text frame.
+class Frame:
+    __slots__ = ("message", "_payload", "_packed", "_json_size")
+
+    def __init__(self, message: Dict[str, Any]):
+        self.message = message
+        self._payload = None
+        self._packed = None
+        self._json_size = None
+
+    @property
+    def payload(self) -> str:
+        if self._payload is None:
+            if orjson is not None:
+                data = orjson.dumps(self.message)
+                self._json_size = len(data)
+                self._payload = data.decode()
+            else:
+                self._payload = encode(self.message)
+        return self._payload
+
+    @property
+    def json_size(self) -> int:
+        if self._json_size is None:
+            self._json_size = len(self.payload.encode())
+        return self._json_size
+
+    def payload_for(self, encoding: str) -> Union[str, bytes]:
+        if encoding == "msgpack":
+            if self._packed is None:
+                self._packed = pack(self.message)
+            return self._packed
+        return self.payload
+
+
+def as_frame(message: Union[Dict[str, Any], Frame]) -> Frame:
+    return message if isinstance(message, Frame) else Frame(message)
+
+
+def _is_instance(value: Any, expected: Union[type, Tuple[type, ...]]) -> bool:
+    # bool is an int subclass; only accept it where bool is expected
+    return isinstance(value, expected) and not (isinstance(value, bool) and expected is int)
+
+
+# Expected field types for one inbound event type. Fields are optional
+# unless listed in required; null counts as absent and is dropped so the
+# handlers' defaults apply. A type in a one-item list, like [str], is a
+# list whose elements all have that type. Unlisted fields pass through
+# untouched.
+class EventSchema:
+    __slots__ = ("fields", "required")
+
+    def __init__(self, fields: Dict[str, Union[type, Tuple[type, ...], List[type]]] = None, required: Iterable[str] = ()):
+        self.fields = fields or {}
+        self.required = tuple(required)
+
+    def validate(self, event: Dict[str, Any]):
+        for name, expected in self.fields.items():
+            if name not in event:
+                continue
+            value = event[name]
+            if value is None:
+                del event[name]
+                continue
+            if isinstance(expected, list):
+                if not isinstance(value, list) or not all(_is_instance(item, expected[0]) for item in value):
+                    raise FrameError(f"invalid field: {name}")
+            elif not _is_instance(value, expected):
+                raise FrameError(f"invalid field: {name}")
+        for name in self.required:
+            if name not in event:
+                raise FrameError(f"missing field: {name}")
+
+
+def decode(data: Union[str, bytes], schemas: Dict[str, EventSchema], max_bytes: int = MAX_FRAME_BYTES) -> Dict[str, Any]:
+    # Size is checked before parsing. A str's length bounds its UTF-8 size
+    # from below, so only long non-ASCII frames pay for encoding.
+    size = len(data)
+    if size > max_bytes or (isinstance(data, str) and size * 4 > max_bytes and len(data.encode()) > max_bytes):
+        raise FrameError("frame too large", CLOSE_TOO_BIG)
+
+    # Binary frames are MessagePack when available, otherwise UTF-8 JSON
+    if isinstance(data, bytes) and msgpack is not None:
+        try:
+            event = msgpack.unpackb(data, raw=False)
+        except Exception:
+            raise FrameError("malformed MessagePack")
+    else:
+        try:
+            event = loads(data)
+        except ValueError:
+            raise FrameError("malformed JSON")
+    if not isinstance(event, dict):
+        raise FrameError("expected a JSON object")
+
+    event_type = event.setdefault("type", "message")
+    schema = schemas.get(event_type) if isinstance(event_type, str) else None
+    if schema is None:
+        raise FrameError(f"unknown event type: {event_type}")
+    schema.validate(event)
+    return event
+
+
+USER_EVENTS = {
+    "join_room": EventSchema({"userName": str, "userEmail": str, "streamTokens": bool}),
+    "message": EventSchema({"roomId": str, "message": str, "sender": str}),
+    "request_human": EventSchema({"roomId": str, "userName": str, "userEmail": str, "issue": str}, required=("roomId",)),
+    "typing": EventSchema({"roomId": str, "isTyping": bool}),
+    "resume": EventSchema({"roomId": str, "token": str, "lastEventSeq": int, "lastMessageSeq": int}, required=("roomId", "token")),
+}
+
+ADMIN_EVENTS = {
+    "admin_auth": EventSchema({"token": str, "since": int, "epoch": str}),
+    "get_chat_list": EventSchema({"limit": int, "offset": int, "status": str}),
+    "get_transcript": EventSchema({"roomId": str, "before": int, "limit": int}, required=("roomId",)),
+    "search": EventSchema({"query": str, "status": str, "start": str, "end": str, "limit": int, "offset": int}, required=("query",)),
+    "invalidate_responses": EventSchema({"terms": [str]}),
+    "delete_chat": EventSchema({"roomId": str}, required=("roomId",)),
+}
+
+AGENT_EVENTS = {
+    "agent_auth": EventSchema({"token": str, "agentName": str}),
+    "get_pending_requests": EventSchema({"limit": int, "offset": int}),
+    "search": EventSchema({"query": str, "status": str, "start": str, "end": str, "limit": int, "offset": int}, required=("query",)),
+    "join_room_agent": EventSchema({"roomId": str, "agentName": str}, required=("roomId",)),
+    "message": EventSchema({"roomId": str, "message": str, "sender": str, "agentName": str}, required=("roomId",)),
+    "get_chat_history": EventSchema({"roomId": str, "before": int, "limit": int}, required=("roomId",)),
+    "typing": EventSchema({"roomId": str, "isTyping": bool}, required=("roomId",)),
+    "end_chat": EventSchema({"roomId": str, "agentName": str}, required=("roomId",)),
+    "resume": EventSchema({"token": str, "agentName": str, "rooms": [dict]}, required=("token",)),
+}
@@ -0,0 +1,167 @@
+from typing import Any, Dict, List, Optional, Tuple
+from collections import deque
+import heapq
+import itertools
+import time
+
+# Lower rank is served first when waits are equal
+PRIORITY_RANKS = {"urgent": 0, "high": 1, "medium": 2, "low": 3}
+
+# Seconds of waiting credited to each priority. Ordering by
+# (created_at - head start) serves higher priorities first while still
+# letting a long-waiting low priority request overtake a fresh urgent one.
+PRIORITY_HEAD_START = {"urgent": 900.0, "high": 300.0, "medium": 0.0, "low": -300.0}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(fraction * (len(values) - 1))))
+    return values[index]
+
+
+# In-memory queue of pending human-agent requests plus agent load tracking.
+# All methods are synchronous, so on the event loop a claim or assignment
+# can never interleave with another one.
+class DispatchScheduler:
+    def __init__(self, agent_capacity: int = 1):
+        self.agent_capacity = agent_capacity
+
+        self._heap: List[Tuple[float, int, int, str]] = []
+        self._order = itertools.count()
+        self._requests: Dict[str, Dict[str, Any]] = {}
+        self._entries: Dict[str, int] = {}
+
+        self.agent_names: Dict[str, str] = {}
+        self.agent_load: Dict[str, int] = {}
+        self.assignments: Dict[str, str] = {}
+
+        self.assigned_waits: deque = deque(maxlen=1000)
+        self.assigned = 0
+
+    # Requests
+    def add(self, request: Dict[str, Any]):
+        room_id = request["roomId"]
+        priority = request.get("priority", "medium")
+        created_at = request.setdefault("createdAt", time.time())
+
+        order = next(self._order)
+        self._requests[room_id] = request
+        self._entries[room_id] = order
+        key = created_at - PRIORITY_HEAD_START.get(priority, 0.0)
+        heapq.heappush(self._heap, (key, PRIORITY_RANKS.get(priority, 2), order, room_id))
+
+    def remove(self, room_id: str) -> Optional[Dict[str, Any]]:
+        # Heap entries are skipped lazily once their request is gone
+        self._entries.pop(room_id, None)
+        return self._requests.pop(room_id, None)
+
+    def _is_live(self, entry: Tuple[float, int, int, str]) -> bool:
+        return self._entries.get(entry[3]) == entry[2]
+
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._requests
+
+    def __len__(self) -> int:
+        return len(self._requests)
+
+    def _pop(self) -> Optional[Dict[str, Any]]:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                return self.remove(entry[3])
+        return None
+
+    def pending(self, limit: int = 100, offset: int = 0) -> List[Dict[str, Any]]:
+        live = [entry for entry in self._heap if self._is_live(entry)]
+        live.sort()
+        return [self._requests[entry[3]] for entry in live[offset:offset + limit]]
+
+    # Agents
+    def register_agent(self, agent_id: str, agent_name: str):
+        self.agent_names[agent_id] = agent_name
+        self.agent_load.setdefault(agent_id, 0)
+
+    def unregister_agent(self, agent_id: str):
+        self.agent_names.pop(agent_id, None)
+        if not self.agent_load.get(agent_id):
+            self.agent_load.pop(agent_id, None)
+
+    def _least_loaded_agent(self) -> Optional[str]:
+        best, best_load = None, self.agent_capacity
+        for agent_id in self.agent_names:
+            load = self.agent_load.get(agent_id, 0)
+            if load < best_load:
+                best, best_load = agent_id, load
+        return best
+
+    # Claims
+    def claim(self, room_id: str, agent_id: str) -> bool:
+        # Fails only if another agent already holds the room
+        holder = self.assignments.get(room_id)
+        if holder is not None:
+            return holder == agent_id
+
+        self._assign(room_id, agent_id, self.remove(room_id))
+        return True
+
+    def _assign(self, room_id: str, agent_id: str, request: Optional[Dict[str, Any]]):
+        # A room handed to a new agent frees its previous agent's slot
+        if self.assignments.get(room_id) not in (None, agent_id):
+            self.release(room_id)
+        elif self.assignments.get(room_id) == agent_id:
+            return
+
+        if request is not None:
+            self.assigned_waits.append(time.time() - request["createdAt"])
+            self.assigned += 1
+
+        self.assignments[room_id] = agent_id
+        self.agent_load[agent_id] = self.agent_load.get(agent_id, 0) + 1
+
+    def release(self, room_id: str):
+        agent_id = self.assignments.pop(room_id, None)
+        if agent_id is not None and self.agent_load.get(agent_id, 0) > 0:
+            self.agent_load[agent_id] -= 1
+
+    def next_assignment(self) -> Optional[Tuple[Dict[str, Any], str]]:
+        # Highest priority request to the least-loaded agent with spare capacity
+        agent_id = self._least_loaded_agent()
+        if agent_id is None:
+            return None
+
+        request = self._pop()
+        if request is None:
+            return None
+
+        self._assign(request["roomId"], agent_id, request)
+        return request, agent_id
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        waits = [now - request["createdAt"] for request in self._requests.values()]
+        by_priority: Dict[str, int] = {}
+        for request in self._requests.values():
+            priority = request.get("priority", "medium")
+            by_priority[priority] = by_priority.get(priority, 0) + 1
+
+        assigned_waits = list(self.assigned_waits)
+        return {
+            "queueDepth": len(self._requests),
+            "byPriority": by_priority,
+            "waitSeconds": {
+                "p50": percentile(waits, 0.5),
+                "p90": percentile(waits, 0.9),
+                "p99": percentile(waits, 0.99),
+                "max": max(waits, default=0.0)
+            },
+            "assigned": self.assigned,
+            "assignedWaitSeconds": {
+                "p50": percentile(assigned_waits, 0.5),
+                "p90": percentile(assigned_waits, 0.9),
+                "p99": percentile(assigned_waits, 0.99)
+            },
+            "agents": len(self.agent_names),
+            "agentLoad": dict(self.agent_load)
+        }
@@ -0,0 +1,53 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+import asyncio
+
+
+# Runs a connection's frames as tasks so the receive loop keeps reading.
+# Frames that share a lane key (e.g. a room ID) run one after another, in
+# arrival order; different lanes run concurrently. At most max_in_flight
+# frames are queued or running; submit() waits for a slot, which stops the
+# receive loop and pushes back on a chatty client.
+class ConnectionDispatcher:
+    def __init__(self, max_in_flight: int = 32):
+        self.max_in_flight = max_in_flight
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._tails: Dict[Hashable, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._tasks)
+
+    async def submit(self, lane: Optional[Hashable], handler: Callable[..., Awaitable[Any]], *args):
+        await self._slots.acquire()
+        previous = self._tails.get(lane)
+        task = asyncio.create_task(self._run(lane, previous, handler, args))
+        self._tails[lane] = task
+        self._tasks.add(task)
+
+    async def _run(self, lane, previous: Optional[asyncio.Task], handler, args):
+        try:
+            if previous is not None:
+                # Only ordering matters here; the previous frame reports its own errors
+                await asyncio.wait([previous])
+            await handler(*args)
+        except Exception as e:
+            print(f"Dispatch error: {e}")
+        finally:
+            self._slots.release()
+            task = asyncio.current_task()
+            self._tasks.discard(task)
+            if self._tails.get(lane) is task:
+                del self._tails[lane]
+
+    async def drain(self, timeout: float = None):
+        # Lets queued and running frames finish, then cancels whatever is
+        # still going after timeout seconds. Returns how many were cancelled.
+        if not self._tasks:
+            return 0
+        _, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        return len(pending)
@@ -0,0 +1,209 @@
+from typing import Callable, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import smtplib
+import time
+from email.mime.text import MIMEText
+
+
+# Async outbox for notification emails. Callers only enqueue; a background
+# worker sends over one reused SMTP connection. A notification arriving
+# while the outbox is idle goes out right away; ones that follow within
+# digest_window of a send are folded into a single digest. Failed sends are
+# rescheduled with backoff instead of holding up the notifications behind
+# them, and a full queue drops new notifications rather than growing.
+class EmailOutbox:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        sender: str,
+        recipient: str,
+        username: str = None,
+        password: str = None,
+        starttls: bool = True,
+        digest_window: float = 2.0,
+        max_digest: int = 20,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        idle_timeout: float = 60.0,
+        max_queue: int = 1000,
+        on_send: Callable[[float], None] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.recipient = recipient
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.digest_window = digest_window
+        self.max_digest = max_digest
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        # Called with the seconds each successful SMTP send took, if given
+        self.on_send = on_send
+
+        self._queue: asyncio.Queue = asyncio.Queue(max_queue)
+        # (due, order, attempts so far, batch) of failed sends, soonest first
+        self._retries: List[Tuple[float, int, int, List[Tuple[str, str]]]] = []
+        self._order = itertools.count()
+        self._task = None
+        self._smtp: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self._last_attempt = float("-inf")
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def enqueue(self, subject: str, body: str):
+        try:
+            self._queue.put_nowait((subject, body))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            print(f"Email outbox full, dropping notification: {subject}")
+
+    def pending_count(self) -> int:
+        return self._queue.qsize() + sum(len(batch) for _, _, _, batch in self._retries)
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # Send whatever is still queued, then drop the connection
+        if self._task is not None:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        await asyncio.to_thread(self._disconnect)
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            item = await self._next()
+            if item is None:
+                break
+            if item is not False:
+                # Idle since the last send: only what is already queued joins.
+                # Otherwise collect until a digest window after that attempt.
+                batch = [item]
+                stopping = await self._collect(batch, self._last_attempt + self.digest_window)
+                await self._attempt(batch, 0)
+            await self._retry_due()
+
+        # One last try for everything left, without waiting for more
+        remaining = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not None:
+                remaining.append(item)
+        if remaining:
+            await self._attempt(remaining, self.max_retries)
+        retries, self._retries = self._retries, []
+        for _, _, _, batch in retries:
+            await self._attempt(batch, self.max_retries)
+
+    async def _next(self):
+        # The next queued notification (None when closing), or False once a
+        # retry is due
+        if not self._retries:
+            return await self._queue.get()
+        timeout = self._retries[0][0] - time.monotonic()
+        if timeout <= 0:
+            return False
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    async def _collect(self, batch: List[Tuple[str, str]], deadline: float) -> bool:
+        # Adds notifications arriving before deadline; True if close() came in
+        while len(batch) < self.max_digest:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0:
+                    item = self._queue.get_nowait()
+                else:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    async def _retry_due(self):
+        while self._retries and self._retries[0][0] <= time.monotonic():
+            _, _, attempts, batch = heapq.heappop(self._retries)
+            await self._attempt(batch, attempts)
+
+    async def _attempt(self, batch: List[Tuple[str, str]], attempts: int):
+        # One send; a failure is rescheduled until max_retries is used up
+        if await self._deliver(self._compose(batch)):
+            self.sent += len(batch)
+            return
+        if attempts >= self.max_retries:
+            self.failed += len(batch)
+            return
+        due = time.monotonic() + self.backoff * 2 ** attempts
+        heapq.heappush(self._retries, (due, next(self._order), attempts + 1, batch))
+
+    def _compose(self, batch: List[Tuple[str, str]]) -> MIMEText:
+        if len(batch) == 1:
+            subject, body = batch[0]
+        else:
+            subject = f"{len(batch)} New Support Requests"
+            body = "\n\n----------------------------------------\n\n".join(b for _, b in batch)
+
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = self.sender
+        msg["To"] = self.recipient
+        return msg
+
+    async def _deliver(self, msg: MIMEText) -> bool:
+        try:
+            started = time.perf_counter()
+            await asyncio.to_thread(self._send_blocking, msg)
+        except Exception as e:
+            print(f"Email send error: {e}")
+            await asyncio.to_thread(self._disconnect)
+            return False
+        finally:
+            self._last_attempt = time.monotonic()
+        if self.on_send is not None:
+            self.on_send(time.perf_counter() - started)
+        return True
+
+    def _connect(self) -> smtplib.SMTP:
+        # Reuse the open connection unless it has been idle too long
+        if self._smtp is not None and time.monotonic() - self._last_used > self.idle_timeout:
+            self._disconnect()
+
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+
+        return self._smtp
+
+    def _send_blocking(self, msg: MIMEText):
+        smtp = self._connect()
+        smtp.sendmail(self.sender, [self.recipient], msg.as_string())
+        self._last_used = time.monotonic()
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except Exception:
+            pass
+        self._smtp = None
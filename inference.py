@@ -0,0 +1,294 @@
+from typing import AsyncIterator, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import time
+
+# Marks the end of a token stream
+_DONE = object()
+
+
+# One prompt waiting for, or taking part in, a batched generation
+class GenerationRequest:
+    def __init__(self, message: str, prompt: str, loop: asyncio.AbstractEventLoop):
+        self.message = message
+        self.prompt = prompt
+        self.loop = loop
+        self.tokens: asyncio.Queue = asyncio.Queue()
+        self.enqueued_at = time.perf_counter()
+        # Set by the worker thread once text, or the end of the stream, is out
+        self.emitted = False
+        self.done = False
+
+    def emit(self, item):
+        # Called from the worker thread
+        if item is _DONE or isinstance(item, Exception):
+            self.done = True
+        else:
+            self.emitted = True
+        self.loop.call_soon_threadsafe(self.tokens.put_nowait, item)
+
+
+# Fallback used when torch/transformers are unavailable or disabled
+class SimulatedEngine:
+    def __init__(self, delay: float = 1.0):
+        self.delay = delay
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def stream(self, message: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.delay)
+        yield f"This is a simulated response to: {message}"
+
+    async def generate(self, message: str) -> str:
+        return "".join([piece async for piece in self.stream(message)])
+
+
+# CPU text generation with dynamic batching. Concurrent prompts are
+# collected for up to max_wait seconds (or until max_batch_size) and
+# decoded together, one forward pass per token for the whole batch, on a
+# thread pool so the event loop never blocks. Tokens are streamed back
+# per request as they are produced. Prompts are cut from the left to leave
+# room for the reply in the model's context, and a batch that fails is
+# retried prompt by prompt so one bad prompt only fails itself.
+class GenerationEngine:
+    def __init__(
+        self,
+        model_name: str = "gpt2",
+        max_batch_size: int = 8,
+        max_wait: float = 0.02,
+        max_new_tokens: int = 60,
+        temperature: float = 0.7,
+        top_k: int = 50,
+        workers: int = 1,
+    ):
+        self.model_name = model_name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.workers = workers
+
+        self.model = None
+        self.tokenizer = None
+        self.max_prompt_tokens = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="generate")
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(workers)
+        self._loaded = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._fallback: Optional[SimulatedEngine] = None
+
+        self.batches = 0
+        self.batched_requests = 0
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._tasks.append(loop.create_task(self._load()))
+        self._tasks.append(loop.create_task(self._schedule()))
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _load(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._load_blocking)
+        except Exception as e:
+            print(f"Model load error: {e}; using simulated responses")
+            self._fallback = SimulatedEngine()
+        self._loaded.set()
+
+    def _load_blocking(self):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        tokenizer.padding_side = "left"
+        # Keep the end of long prompts, where the user's message is
+        tokenizer.truncation_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+        model = AutoModelForCausalLM.from_pretrained(self.model_name)
+        model.eval()
+
+        context = getattr(model.config, "n_positions", None) or getattr(model.config, "max_position_embeddings", None)
+        if context:
+            self.max_prompt_tokens = max(1, context - self.max_new_tokens)
+
+        self.tokenizer = tokenizer
+        self.model = model
+
+    def build_prompt(self, message: str) -> str:
+        return f"The following is a helpful customer support conversation.\nUser: {message}\nAssistant:"
+
+    async def stream(self, message: str) -> AsyncIterator[str]:
+        if self._fallback is not None:
+            async for piece in self._fallback.stream(message):
+                yield piece
+            return
+
+        request = GenerationRequest(message, self.build_prompt(message), asyncio.get_running_loop())
+        await self._queue.put(request)
+
+        while True:
+            item = await request.tokens.get()
+            if item is _DONE:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+    async def generate(self, message: str) -> str:
+        return "".join([piece async for piece in self.stream(message)])
+
+    async def _schedule(self):
+        await self._loaded.wait()
+        if self._fallback is not None:
+            # Hand anything queued during loading to the fallback
+            while not self._queue.empty():
+                request = self._queue.get_nowait()
+                request.emit(await self._fallback.generate(request.message))
+                request.emit(_DONE)
+            return
+        loop = asyncio.get_running_loop()
+
+        while True:
+            # Hold a worker slot before collecting, so waiting prompts keep
+            # accumulating into the next batch while all workers are busy
+            await self._slots.acquire()
+            batch = [await self._queue.get()]
+
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            self.batches += 1
+            self.batched_requests += len(batch)
+            future = loop.run_in_executor(self._executor, self._generate_batch, batch)
+            future.add_done_callback(lambda _: self._slots.release())
+
+    def _generate_batch(self, batch: List[GenerationRequest]):
+        try:
+            self._decode(batch)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"Generation error: {e}")
+                if not batch[0].done:
+                    batch[0].emit(e)
+                return
+
+            # Find the prompt at fault by running the rest on their own;
+            # replies already partly streamed cannot be restarted
+            print(f"Batch generation error: {e}; retrying {len(batch)} prompts one by one")
+            for request in batch:
+                if request.done:
+                    continue
+                if request.emitted:
+                    request.emit(e)
+                else:
+                    self._generate_batch([request])
+
+    def _decode(self, batch: List[GenerationRequest]):
+        import torch
+
+        tokenizer, model = self.tokenizer, self.model
+        encoded = tokenizer(
+            [r.prompt for r in batch],
+            return_tensors="pt",
+            padding=True,
+            truncation=self.max_prompt_tokens is not None,
+            max_length=self.max_prompt_tokens,
+        )
+        input_ids = encoded["input_ids"]
+        attention_mask = encoded["attention_mask"]
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+
+        generated: List[List[int]] = [[] for _ in batch]
+        texts = ["" for _ in batch]
+        finished = [False for _ in batch]
+        past_key_values = None
+        newline_id = tokenizer.encode("\n")[0]
+
+        with torch.no_grad():
+            for _ in range(self.max_new_tokens):
+                outputs = model(
+                    input_ids=input_ids,
+                    attention_mask=attention_mask,
+                    position_ids=position_ids,
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                )
+                past_key_values = outputs.past_key_values
+                next_tokens = self._sample(outputs.logits[:, -1, :])
+
+                for index, request in enumerate(batch):
+                    if finished[index]:
+                        continue
+                    token = int(next_tokens[index])
+                    if token in (tokenizer.eos_token_id, newline_id):
+                        finished[index] = True
+                        request.emit(_DONE)
+                        continue
+
+                    # Decode the whole reply so multi-token characters come out whole
+                    generated[index].append(token)
+                    text = tokenizer.decode(generated[index], skip_special_tokens=True)
+                    piece = text[len(texts[index]):]
+                    texts[index] = text
+                    if piece:
+                        request.emit(piece)
+
+                if all(finished):
+                    break
+
+                # Finished rows keep decoding padding; their output is ignored
+                input_ids = next_tokens.unsqueeze(-1)
+                attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(batch), 1))], dim=-1)
+                position_ids = position_ids[:, -1:] + 1
+
+        for index, request in enumerate(batch):
+            if not finished[index]:
+                request.emit(_DONE)
+
+    def _sample(self, logits):
+        import torch
+
+        if self.temperature <= 0:
+            return torch.argmax(logits, dim=-1)
+
+        logits = logits / self.temperature
+        if self.top_k:
+            values, _ = torch.topk(logits, self.top_k)
+            logits = logits.masked_fill(logits < values[:, -1:], float("-inf"))
+        probabilities = torch.softmax(logits, dim=-1)
+        return torch.multinomial(probabilities, num_samples=1).squeeze(-1)
+
+
+def create_engine(kind: str, **options):
+    if kind == "simulated":
+        return SimulatedEngine()
+
+    try:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+    except ImportError as e:
+        print(f"Bot engine unavailable ({e}); using simulated responses")
+        return SimulatedEngine()
+
+    return GenerationEngine(kind, **options)
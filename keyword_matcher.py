@@ -0,0 +1,168 @@
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+import re
+
+
+# Plural endings still accepted after a keyword when word boundaries are on
+PLURAL_SUFFIXES = ("s", "es")
+
+# Runs of whitespace and hyphens inside a keyword or text match as one
+# separator, so "data breach" also finds "Data-Breach" and "data  breach"
+_SEPARATORS = re.compile(r"[\s-]+")
+_SEPARATOR_RUN = re.compile(r"[\s-]{2,}")
+# Anything in ASCII text other than single spaces that needs rewriting
+_UNUSUAL_SEPARATOR = re.compile(r"[^\S ]|  |-")
+_TO_SPACE = {ord(char): " " for char in "\t\n\r\x0b\x0c\x1c\x1d\x1e\x1f-"}
+
+
+def plural_suffixes(keyword: str, suffixes: Tuple[str, ...] = PLURAL_SUFFIXES) -> Tuple[str, ...]:
+    # The endings of suffixes that make a plural of keyword: "es" after
+    # s, x, z, ch and sh ("address", "tax"), "s" otherwise, "e" included
+    # ("charge"). A keyword ending in a single "s" is already plural
+    # ("charges", "layoffs") and takes neither.
+    if keyword.endswith(("ss", "x", "z", "ch", "sh")):
+        wanted = "es"
+    elif keyword.endswith("s") or not keyword[-1].isalnum():
+        return ()
+    else:
+        wanted = "s"
+    return tuple(suffix for suffix in suffixes if suffix == wanted)
+
+
+# Multi-pattern keyword matcher (Aho-Corasick). Matching is case-insensitive
+# (casefold) and offsets refer to the original text.
+class KeywordMatcher:
+    def __init__(self, categories: Dict[str, List[str]], word_boundaries: bool = True, suffixes: Tuple[str, ...] = PLURAL_SUFFIXES):
+        self.word_boundaries = word_boundaries
+        self.suffixes = suffixes
+        self.categories: List[str] = list(categories.keys())
+        self.keywords: List[Tuple[str, int]] = []  # (keyword, category index)
+        self._plurals: List[Tuple[str, ...]] = []  # endings accepted per keyword
+
+        # Trie transitions, failure links and outputs, one entry per node
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[int]] = [[]]
+
+        for category_index, category in enumerate(self.categories):
+            for keyword in categories[category]:
+                keyword = _SEPARATORS.sub(" ", keyword.casefold()).strip()
+                if not keyword:
+                    continue
+                self._insert(keyword, len(self.keywords))
+                self.keywords.append((keyword, category_index))
+                self._plurals.append(plural_suffixes(keyword, suffixes))
+
+        self._build_failure_links()
+
+    def _insert(self, keyword: str, keyword_index: int):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[node][char] = next_node
+            node = next_node
+        self._out[node].append(keyword_index)
+
+    def _build_failure_links(self):
+        # Breadth-first so every parent's failure link is ready before its children
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                # Inherit the outputs reachable through the failure link
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _word_end(self, text: str, end: int, suffixes: Tuple[str, ...]) -> Optional[int]:
+        # End of the word when the keyword (or its plural) ends one, else None
+        for suffix in ("",) + suffixes:
+            stop = end + len(suffix)
+            if text[end:stop].casefold() != suffix:
+                continue
+            if stop == len(text) or not text[stop].isalnum():
+                return stop
+        return None
+
+    def find_all(self, text: str) -> List[Tuple[str, str, int, int]]:
+        # Returns (category, keyword, start, end) for every match, in text
+        # order, with start/end as offsets into text
+        folded, origin = text.lower(), None
+        if text.isascii():
+            if _UNUSUAL_SEPARATOR.search(folded):
+                # Separator runs become one space, so keep the original
+                # index of every folded character
+                origin = []
+                kept = 0
+                for run in _SEPARATOR_RUN.finditer(folded):
+                    origin.extend(range(kept, run.start() + 1))
+                    kept = run.end()
+                origin.extend(range(kept, len(text)))
+                folded = _SEPARATOR_RUN.sub(" ", folded).translate(_TO_SPACE)
+        else:
+            # Casefolding can change the length as well ("İ" -> "i̇",
+            # "ß" -> "ss"), so every character goes through the index map
+            parts = []
+            separator = False
+            for char in text:
+                if char.isspace() or char == "-":
+                    parts.append("" if separator else " ")
+                    separator = True
+                else:
+                    parts.append(char.casefold())
+                    separator = False
+            folded = "".join(parts)
+            origin = [index for index, part in enumerate(parts) for _ in part]
+
+        goto, fail, out = self._goto, self._fail, self._out
+        matches = []
+        node = 0
+
+        for position, char in enumerate(folded):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            for keyword_index in out[node]:
+                keyword, category_index = self.keywords[keyword_index]
+                first = position + 1 - len(keyword)
+                if origin is None:
+                    start, end = first, position + 1
+                else:
+                    start, end = origin[first], origin[position] + 1
+                if self.word_boundaries:
+                    # Whole characters only, at word boundaries
+                    if origin is not None and ((first > 0 and origin[first - 1] == start) or (position + 1 < len(folded) and origin[position + 1] == end - 1)):
+                        continue
+                    if start > 0 and text[start - 1].isalnum():
+                        continue
+                    end = self._word_end(text, end, self._plurals[keyword_index])
+                    if end is None:
+                        continue
+                matches.append((self.categories[category_index], keyword, start, end))
+
+        return matches
+
+    def match(self, text: str) -> Dict[str, List[Tuple[int, int]]]:
+        # Group match offsets by category
+        result: Dict[str, List[Tuple[int, int]]] = {}
+        for category, _, start, end in self.find_all(text):
+            result.setdefault(category, []).append((start, end))
+        return result
+
+    def first_category(self, text: str) -> Optional[str]:
+        # Earliest category in table order, matching the old nested-loop behaviour
+        matches = self.find_all(text)
+        if not matches:
+            return None
+        category_order = {category: index for index, category in enumerate(self.categories)}
+        return min((m[0] for m in matches), key=category_order.__getitem__)
@@ -0,0 +1,239 @@
+from typing import Any, Dict, List, Tuple
+import asyncio
+from pymongo import UpdateOne
+
+# Durability modes
+#   sync             - await one update per message (no write-behind)
+#   batched          - queue the write and wait until its batch has been flushed
+#   fire_and_forget  - queue the write and return immediately
+WRITE_MODES = ("sync", "batched", "fire_and_forget")
+
+# Messages per bucket document in the messages collection
+MESSAGE_BUCKET_SIZE = 100
+
+
+def bucket_for(seq: int) -> int:
+    return seq // MESSAGE_BUCKET_SIZE
+
+
+def bucket_update(room_id: str, bucket: int, messages: List[Dict[str, Any]]):
+    # Upsert so the first message of a bucket creates it. Every message
+    # carries its seq, so $addToSet makes a retried write a no-op.
+    return UpdateOne(
+        {"roomId": room_id, "bucket": bucket},
+        {"$addToSet": {"messages": {"$each": messages}}},
+        upsert=True
+    )
+
+
+def room_update(room_id: str, message_count: int, last_activity: str):
+    return UpdateOne(
+        {"roomId": room_id},
+        {
+            "$set": {"lastActivity": last_activity},
+            "$max": {"messageCount": message_count}
+        }
+    )
+
+
+# Write-behind queue for message appends, flushed as grouped bulk_write calls.
+# Messages go to fixed-size buckets in the messages collection; the room
+# document only tracks lastActivity and messageCount. Both writes are
+# idempotent, so a failed flush is requeued whole and retried with backoff.
+class MessageWriter:
+    def __init__(self, rooms, messages, mode: str = "sync", max_batch: int = 200, flush_interval: float = 0.05, max_backoff: float = 5.0):
+        if mode not in WRITE_MODES:
+            raise ValueError(f"Unknown write mode: {mode}")
+
+        self.rooms = rooms
+        self.messages = messages
+        self.mode = mode
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.retry_delay = 0.0
+        self.failed_flushes = 0
+
+        self._pending: Dict[Tuple[str, int], List[Dict[str, Any]]] = {}
+        self._room_state: Dict[str, Tuple[int, str]] = {}
+        self._unflushed: Dict[str, int] = {}
+        self._waiters: List[asyncio.Future] = []
+        self._count = 0
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = None
+        self._closed = False
+
+    async def ensure_indexes(self):
+        try:
+            await self.messages.create_index([("roomId", 1), ("bucket", 1)], unique=True)
+        except Exception as e:
+            print(f"Message index error: {e}")
+
+    async def migrate_inline(self, batch_size: int = 100) -> int:
+        # Moves messages that rooms from before bucketing keep inline into
+        # buckets, numbered by their position, then drops the inline array.
+        # Every step is idempotent, so an interrupted run is simply repeated.
+        migrated = 0
+        while True:
+            # Rooms that already took bucketed appends numbered from 0 stay
+            # inline rather than having stored history renumbered
+            cursor = self.rooms.find(
+                {"messages.0": {"$exists": True}, "messageCount": {"$in": [0, None]}},
+                {"_id": 0, "roomId": 1, "messages": 1}
+            ).limit(batch_size)
+            rooms = await cursor.to_list(batch_size)
+            if not rooms:
+                return migrated
+
+            message_operations = []
+            room_operations = []
+            for room in rooms:
+                room_id = room["roomId"]
+                messages = [dict(message, seq=seq) for seq, message in enumerate(room["messages"])]
+                for bucket in range(bucket_for(len(messages) - 1) + 1):
+                    start = bucket * MESSAGE_BUCKET_SIZE
+                    message_operations.append(bucket_update(room_id, bucket, messages[start:start + MESSAGE_BUCKET_SIZE]))
+                room_operations.append(UpdateOne(
+                    {"roomId": room_id},
+                    {"$max": {"messageCount": len(messages)}, "$unset": {"messages": ""}}
+                ))
+                migrated += 1
+
+            # Buckets first, so the inline copy is only dropped once they exist
+            await self.messages.bulk_write(message_operations, ordered=False)
+            await self.rooms.bulk_write(room_operations, ordered=False)
+
+    async def start(self):
+        await self.ensure_indexes()
+        if self.mode != "sync" and self._task is None:
+            self._closed = False
+            self._task = asyncio.create_task(self._run())
+
+    async def append(self, room_id: str, message_data: Dict[str, Any], last_activity: str):
+        # message_data["seq"] is the message's position in the room
+        seq = message_data["seq"]
+        bucket = bucket_for(seq)
+
+        if self.mode == "sync" or self._task is None or self._closed:
+            # Independent documents, so one round trip of latency, not two
+            await asyncio.gather(
+                self.messages.bulk_write([bucket_update(room_id, bucket, [message_data])]),
+                self.rooms.bulk_write([room_update(room_id, seq + 1, last_activity)])
+            )
+            return
+
+        # Group appends by bucket so one flush is one update per bucket
+        self._pending.setdefault((room_id, bucket), []).append(message_data)
+        self._room_state[room_id] = (seq + 1, last_activity)
+        self._unflushed[room_id] = seq + 1
+        self._count += 1
+
+        self._wakeup.set()
+        if self._count >= self.max_batch:
+            self._full.set()
+
+        if self.mode == "batched":
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+
+    def pending_count(self) -> int:
+        # Appends queued for the next flush
+        return self._count
+
+    def unflushed_count(self, room_id: str) -> int:
+        # Message count including appends not yet acknowledged by Mongo
+        return self._unflushed.get(room_id, 0)
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+
+            # Flush on whichever comes first: a full batch or the interval
+            if not self._full.is_set():
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            self._wakeup.clear()
+            self._full.clear()
+            await self.flush()
+
+            if self._closed:
+                return
+            if self.retry_delay:
+                # Mongo is failing; the requeued batch goes again after the backoff
+                await asyncio.sleep(self.retry_delay)
+                self._wakeup.set()
+
+    async def flush(self):
+        # The lock keeps batches for the same room in order
+        async with self._flush_lock:
+            if not self._pending:
+                return
+
+            pending, self._pending = self._pending, {}
+            room_state, self._room_state = self._room_state, {}
+            waiters, self._waiters = self._waiters, []
+            self._count = 0
+
+            message_operations = [
+                bucket_update(room_id, bucket, messages)
+                for (room_id, bucket), messages in pending.items()
+            ]
+            room_operations = [
+                room_update(room_id, message_count, last_activity)
+                for room_id, (message_count, last_activity) in room_state.items()
+            ]
+
+            results = await asyncio.gather(
+                self.messages.bulk_write(message_operations, ordered=False),
+                self.rooms.bulk_write(room_operations, ordered=False),
+                return_exceptions=True
+            )
+            error = next((result for result in results if isinstance(result, BaseException)), None)
+            if error is not None:
+                self._requeue(pending, room_state, waiters)
+                self.failed_flushes += 1
+                self.retry_delay = min(max(self.retry_delay * 2, self.flush_interval), self.max_backoff)
+                print(f"Message flush error (retrying in {self.retry_delay:.2f}s): {error}")
+                return
+            self.retry_delay = 0.0
+
+            for room_id, (message_count, _) in room_state.items():
+                if self._unflushed.get(room_id) == message_count:
+                    del self._unflushed[room_id]
+
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(True)
+
+    def _requeue(self, pending, room_state, waiters):
+        # Put a failed batch back in front of anything queued since
+        for key, messages in pending.items():
+            self._pending[key] = messages + self._pending.get(key, [])
+            self._count += len(messages)
+        for room_id, (message_count, last_activity) in room_state.items():
+            newer = self._room_state.get(room_id)
+            if newer is None or newer[0] < message_count:
+                self._room_state[room_id] = (message_count, last_activity)
+        # Batched callers keep waiting until their messages are stored
+        self._waiters = waiters + self._waiters
+
+    async def close(self):
+        # Stop the flush loop and drain whatever is still queued
+        self._closed = True
+        if self._task is not None:
+            self._wakeup.set()
+            self._full.set()
+            await self._task
+            self._task = None
+        await self.flush()
+        if self._pending:
+            print(f"Message writer closed with {self._count} unsaved messages")
+            for waiter in self._waiters:
+                if not waiter.done():
+                    waiter.set_exception(RuntimeError("message writer closed before the write succeeded"))
@@ -0,0 +1,166 @@
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from bisect import bisect_left
+import asyncio
+import time
+
+# Bucket upper bounds in seconds, from sub-millisecond in-memory work up to
+# slow SMTP round trips
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# One histogram per combination of label values, created on first use
+class HistogramFamily:
+    def __init__(self, name: str, help: str, label_names: Tuple[str, ...] = (), bounds: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.bounds = bounds
+        self.children: Dict[Tuple[str, ...], Histogram] = {}
+
+    def observe(self, value: float, *labels: str):
+        histogram = self.children.get(labels)
+        if histogram is None:
+            histogram = self.children[labels] = Histogram(self.bounds)
+        histogram.observe(value)
+
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} histogram")
+        for labels, histogram in sorted(self.children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds, histogram.counts):
+                cumulative += count
+                bucket = _labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = _labels(self.label_names, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {histogram.count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {histogram.sum}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {histogram.count}")
+
+
+# Hot-path timings plus gauges read at scrape time, rendered in the
+# Prometheus text format. When disabled every hook returns right away and
+# handlers are passed through unwrapped.
+class Metrics:
+    def __init__(self, enabled: bool = True, lag_interval: float = 0.1):
+        self.enabled = enabled
+        self.lag_interval = lag_interval
+
+        self.handler_seconds = HistogramFamily(
+            "chat_handler_seconds", "Time spent handling one websocket frame, by endpoint and message type.", ("endpoint", "type"))
+        self.mongo_seconds = HistogramFamily(
+            "chat_mongo_seconds", "Mongo round trips made by ConnectionManager methods.", ("method", "operation"))
+        self.send_seconds = HistogramFamily(
+            "chat_websocket_send_seconds", "Time to write one frame to a websocket.")
+        self.smtp_seconds = HistogramFamily(
+            "chat_smtp_send_seconds", "Time to send one notification email or digest.")
+        self.loop_lag_seconds = HistogramFamily(
+            "chat_event_loop_lag_seconds", "How late a periodic timer fires on the event loop.")
+
+        # name -> (help, type, read, label) where read returns a number or {label value: number}
+        self.gauges: Dict[str, Tuple[str, str, Callable[[], Any], Optional[str]]] = {}
+        self._timed: Dict[Tuple[str, str], Callable[..., Awaitable[Any]]] = {}
+        self._lag_task: Optional[asyncio.Task] = None
+        self.last_loop_lag = 0.0
+
+    def gauge(self, name: str, help: str, read: Callable[[], Any], label: str = None, kind: str = "gauge"):
+        self.gauges[name] = (help, kind, read, label)
+
+    def clock(self) -> float:
+        return time.perf_counter() if self.enabled else 0.0
+
+    def observe_handler(self, endpoint: str, message_type: str, started: float):
+        if self.enabled:
+            self.handler_seconds.observe(time.perf_counter() - started, endpoint, message_type)
+
+    def observe_mongo(self, method: str, operation: str, started: float):
+        if self.enabled:
+            self.mongo_seconds.observe(time.perf_counter() - started, method, operation)
+
+    def observe_send(self, seconds: float):
+        self.send_seconds.observe(seconds)
+
+    def observe_smtp(self, seconds: float):
+        self.smtp_seconds.observe(seconds)
+
+    async def mongo(self, method: str, operation: str, call: Awaitable[Any]):
+        # await metrics.mongo("end_chat", "update_one", db.chat_rooms.update_one(...))
+        if not self.enabled:
+            return await call
+        started = time.perf_counter()
+        try:
+            return await call
+        finally:
+            self.mongo_seconds.observe(time.perf_counter() - started, method, operation)
+
+    def timed(self, endpoint: str, message_type: str, handler: Callable[..., Awaitable[Any]]):
+        # The handler itself when disabled, else a cached timing wrapper
+        if not self.enabled:
+            return handler
+        wrapper = self._timed.get((endpoint, message_type))
+        if wrapper is None:
+            async def wrapper(*args):
+                started = time.perf_counter()
+                try:
+                    return await handler(*args)
+                finally:
+                    self.handler_seconds.observe(time.perf_counter() - started, endpoint, message_type)
+            self._timed[(endpoint, message_type)] = wrapper
+        return wrapper
+
+    async def start(self):
+        if self.enabled and self._lag_task is None:
+            self._lag_task = asyncio.create_task(self._monitor_loop())
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            self._lag_task = None
+
+    async def _monitor_loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.last_loop_lag = max(0.0, time.perf_counter() - started - self.lag_interval)
+            self.loop_lag_seconds.observe(self.last_loop_lag)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, (help, kind, read, label) in self.gauges.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            value = read()
+            if isinstance(value, dict):
+                for label_value, number in sorted(value.items(), key=lambda item: str(item[0])):
+                    lines.append(f"{name}{_labels((label,), (label_value,))} {number}")
+            else:
+                lines.append(f"{name} {value}")
+        for family in (self.handler_seconds, self.mongo_seconds, self.send_seconds, self.smtp_seconds, self.loop_lag_seconds):
+            family.render(lines)
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,132 @@
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+import sys
+import time
+
+
+def intern(value: Optional[str]) -> Optional[str]:
+    # Senders, statuses and agent names repeat across every room
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def to_iso(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def from_iso(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    if not value:
+        return time.time()
+    return datetime.fromisoformat(value).timestamp()
+
+
+# One chat message. Timestamps are epoch floats; to_dict() gives the shape
+# stored in Mongo and sent to clients.
+class Message:
+    __slots__ = ("seq", "message", "sender", "timestamp", "agent_name")
+
+    def __init__(self, seq: int, message: str, sender: str, timestamp: float = None, agent_name: str = None):
+        self.seq = seq
+        self.message = message
+        self.sender = intern(sender)
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.agent_name = intern(agent_name)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "seq": self.seq,
+            "message": self.message,
+            "sender": self.sender,
+            "timestamp": to_iso(self.timestamp),
+            "agentName": self.agent_name
+        }
+
+
+# Live state of one chat room. Only messages added since the room was
+# created or reloaded are held here; older ones stay in Mongo buckets.
+class Room:
+    __slots__ = (
+        "room_id", "user_id", "user_name", "user_email", "start_time", "last_activity",
+        "status", "agent_id", "agent_name", "message_count", "messages",
+        "resume_token", "event_seq", "replay",
+    )
+
+    def __init__(
+        self,
+        room_id: str,
+        user_id: str,
+        user_name: str,
+        user_email: str = None,
+        start_time: float = None,
+        last_activity: float = None,
+        status: str = "active",
+        agent_id: str = None,
+        agent_name: str = None,
+        message_count: int = 0,
+        resume_token: str = None,
+    ):
+        now = time.time()
+        self.room_id = room_id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.user_email = user_email
+        self.start_time = now if start_time is None else start_time
+        self.last_activity = self.start_time if last_activity is None else last_activity
+        self.status = intern(status)
+        self.agent_id = agent_id
+        self.agent_name = intern(agent_name)
+        self.message_count = message_count
+        self.messages: List[Message] = []
+
+        # Room event sequence and the most recent events (see replay.py). It
+        # starts from the load time in ms, so a room reloaded after eviction
+        # or a restart never reuses numbers a client already saw.
+        self.resume_token = resume_token
+        self.event_seq = int(now * 1000)
+        self.replay = None
+
+    @classmethod
+    def from_document(cls, document: Dict[str, Any]) -> "Room":
+        return cls(
+            document["roomId"],
+            document["userId"],
+            document["userName"],
+            document.get("userEmail"),
+            from_iso(document.get("startTime")),
+            from_iso(document.get("lastActivity")),
+            document.get("status", "active"),
+            document.get("agentId"),
+            document.get("agentName"),
+            document.get("messageCount", 0),
+            document.get("resumeToken"),
+        )
+
+    def to_document(self) -> Dict[str, Any]:
+        # Mongo shape; messages live in db.chat_messages buckets
+        return {
+            "roomId": self.room_id,
+            "userId": self.user_id,
+            "userName": self.user_name,
+            "userEmail": self.user_email,
+            "startTime": to_iso(self.start_time),
+            "lastActivity": to_iso(self.last_activity),
+            "status": self.status,
+            "agentId": self.agent_id,
+            "agentName": self.agent_name,
+            "messageCount": self.message_count,
+            "resumeToken": self.resume_token
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        # Shape used in admin chat lists and deltas
+        return {
+            "roomId": self.room_id,
+            "userId": self.user_id,
+            "userName": self.user_name,
+            "userEmail": self.user_email,
+            "startTime": to_iso(self.start_time),
+            "lastActivity": to_iso(self.last_activity),
+            "status": self.status,
+            "agentName": self.agent_name
+        }
@@ -0,0 +1,28 @@
+from typing import Any, Dict, List, Optional
+from collections import deque
+
+from models import Room
+
+# Who a room event was sent to; a resuming connection only replays its own
+AUDIENCES = ("user", "agent")
+
+
+def record_event(room: Room, audience: str, message: Dict[str, Any], capacity: int) -> Dict[str, Any]:
+    # Stamps the event with the room's next sequence number and keeps the
+    # last `capacity` events for replay
+    room.event_seq += 1
+    message["eventSeq"] = room.event_seq
+    if room.replay is None:
+        room.replay = deque(maxlen=capacity)
+    room.replay.append((room.event_seq, audience, message))
+    return message
+
+
+def events_since(room: Room, audience: str, last_seq: int) -> Optional[List[Dict[str, Any]]]:
+    # Events after last_seq for one audience, or None when the buffer no
+    # longer reaches back that far (or the sequence is from another run)
+    if last_seq == room.event_seq:
+        return []
+    if last_seq > room.event_seq or not room.replay or room.replay[0][0] > last_seq + 1:
+        return None
+    return [message for seq, event_audience, message in room.replay if seq > last_seq and event_audience == audience]
@@ -0,0 +1,189 @@
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from collections import OrderedDict
+import re
+import time
+import zlib
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+# Parameters for the MinHash signatures used by the near-duplicate tier
+_PRIME = (1 << 61) - 1
+_SEEDS = [(2 * i + 1) * 0x9E3779B1 % _PRIME for i in range(1, 17)]
+_OFFSETS = [(i * 0x85EBCA6B + 7) % _PRIME for i in range(1, 17)]
+
+
+def normalize_query(query: str) -> str:
+    query = _PUNCTUATION.sub(" ", query.lower())
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def minhash(text: str, shingle_size: int = 3) -> Tuple[int, ...]:
+    # Character shingles hashed with crc32, then one min per permutation
+    if len(text) < shingle_size:
+        shingles = {zlib.crc32(text.encode())}
+    else:
+        shingles = {zlib.crc32(text[i:i + shingle_size].encode()) for i in range(len(text) - shingle_size + 1)}
+    return tuple(
+        min((seed * h + offset) % _PRIME for h in shingles)
+        for seed, offset in zip(_SEEDS, _OFFSETS)
+    )
+
+
+# Cache of bot replies keyed on the normalized user query. Exact hits come
+# from a bounded LRU with a TTL. The optional near-duplicate tier matches
+# queries whose MinHash signatures agree on at least `similarity` of their
+# slots, using banded lookups so only a few candidates are compared.
+class ResponseCache:
+    def __init__(
+        self,
+        max_entries: int = 5000,
+        ttl: float = 3600.0,
+        near_duplicates: bool = True,
+        similarity: float = 0.8,
+        bands: int = 8,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.near_duplicates = near_duplicates
+        self.similarity = similarity
+        self.bands = bands
+        self.rows = len(_SEEDS) // bands
+
+        # normalized query -> [response, created_at, generation_seconds, signature]
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], Set[str]] = {}
+
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0
+
+    def _bands(self, signature: Tuple[int, ...]):
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None or entry[3] is None:
+            return
+        for band_key in self._bands(entry[3]):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def _live(self, key: str, now: float) -> Optional[list]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if now - entry[1] > self.ttl:
+            self._remove(key)
+            self.expirations += 1
+            return None
+        return entry
+
+    def get(self, query: str) -> Optional[str]:
+        key = normalize_query(query)
+        now = time.monotonic()
+
+        entry = self._live(key, now)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            self.saved_seconds += entry[2]
+            return entry[0]
+
+        if self.near_duplicates and key:
+            signature = minhash(key)
+            candidates = set()
+            for band_key in self._bands(signature):
+                candidates.update(self._buckets.get(band_key, ()))
+
+            best, best_score = None, self.similarity
+            for candidate in candidates:
+                other = self._live(candidate, now)
+                if other is None:
+                    continue
+                score = sum(a == b for a, b in zip(signature, other[3])) / len(signature)
+                if score >= best_score:
+                    best, best_score = candidate, score
+
+            if best is not None:
+                entry = self._entries[best]
+                self._entries.move_to_end(best)
+                self.near_hits += 1
+                self.saved_seconds += entry[2]
+                return entry[0]
+
+        self.misses += 1
+        return None
+
+    def put(self, query: str, response: str, generation_seconds: float = 0.0):
+        key = normalize_query(query)
+        if not key:
+            return
+
+        self._remove(key)
+        signature = minhash(key) if self.near_duplicates else None
+        self._entries[key] = [response, time.monotonic(), generation_seconds, signature]
+        if signature is not None:
+            for band_key in self._bands(signature):
+                self._buckets.setdefault(band_key, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    # Invalidation hooks for when the knowledge behind answers changes
+    def invalidate(self, query: str) -> bool:
+        key = normalize_query(query)
+        if key not in self._entries:
+            return False
+        self._remove(key)
+        self.invalidations += 1
+        return True
+
+    def invalidate_where(self, predicate: Callable[[str, str], bool]) -> int:
+        # predicate(normalized_query, response) -> True to drop the entry
+        keys = [key for key, entry in self._entries.items() if predicate(key, entry[0])]
+        for key in keys:
+            self._remove(key)
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def invalidate_containing(self, terms: List[str]) -> int:
+        # A term that normalizes to nothing would match every entry
+        terms = [term for term in map(normalize_query, terms) if term]
+        if not terms:
+            return 0
+        return self.invalidate_where(
+            lambda key, response: any(term in key or term in response.lower() for term in terms)
+        )
+
+    def clear(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self._buckets.clear()
+        self.invalidations += count
+        return count
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        hits = self.exact_hits + self.near_hits
+        return {
+            "size": len(self._entries),
+            "maxEntries": self.max_entries,
+            "exactHits": self.exact_hits,
+            "nearHits": self.near_hits,
+            "misses": self.misses,
+            "hitRatio": hits / lookups if lookups else 0.0,
+            "savedGenerationSeconds": round(self.saved_seconds, 3),
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
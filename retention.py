@@ -0,0 +1,230 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import json
+import uuid
+import zlib
+
+from pymongo import DeleteOne, ReplaceOne
+
+from codec import encode_bytes
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Transcript blob encodings; zstd needs the zstandard package
+CODECS = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+DEFAULT_CODEC = CODECS[0]
+
+
+def compress(raw: bytes, codec: str = DEFAULT_CODEC) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(raw)
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(raw) + compressor.flush()
+
+
+def decompress_transcript(blob: bytes, codec: str) -> List[Dict[str, Any]]:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read this archived transcript")
+        return json.loads(zstandard.ZstdDecompressor().decompress(blob))
+    return json.loads(zlib.decompress(blob, 47))
+
+
+def archive_document(room: Dict[str, Any], messages: List[Dict[str, Any]], codec: str) -> Dict[str, Any]:
+    # Room metadata without the resume token, plus the compressed messages.
+    # Rooms from before bucketing keep some messages inline.
+    messages = sorted(room.pop("messages", []) + messages, key=lambda m: m["seq"])
+    room.pop("resumeToken", None)
+    room.pop("archiving", None)
+    room.pop("archivingAt", None)
+    raw = encode_bytes(messages)
+    transcript = compress(raw, codec)
+    room.update({
+        "messageCount": max(room.get("messageCount", 0), len(messages)),
+        "archivedAt": datetime.now().isoformat(),
+        "codec": codec,
+        "transcript": transcript,
+        "rawBytes": len(raw),
+        "transcriptBytes": len(transcript)
+    })
+    return room
+
+
+def archive_documents(rooms: List[Dict[str, Any]], stored: Dict[str, List[Dict[str, Any]]], codec: str) -> List[Dict[str, Any]]:
+    return [archive_document(room, stored[room["roomId"]], codec) for room in rooms]
+
+
+# Background move of closed rooms from the hot collections (chat_rooms and
+# their chat_messages buckets) into a compact archive collection, once they
+# have been idle for idle_seconds. Rooms go in small batches, paced to at
+# most max_rate rooms per second, and compression runs off the event loop,
+# so live traffic keeps priority. Every worker runs one against the same
+# database, so each room is first claimed with an archiving marker; only
+# the claimant archives and deletes it, and a marker older than claim_ttl
+# (its worker died mid-batch) may be taken over. Archive documents are
+# upserted before the hot copies are deleted, so a crash in between only
+# repeats work. A room is only deleted if it is unchanged since it was
+# read; one that changed meanwhile stays hot and its archive copy is
+# dropped again.
+class RetentionWorker:
+    def __init__(
+        self,
+        rooms,
+        messages,
+        archive,
+        idle_seconds: float = 7 * 86400,
+        batch_size: int = 100,
+        max_rate: float = 50.0,
+        interval: float = 60.0,
+        codec: str = DEFAULT_CODEC,
+        claim_ttl: float = 600.0,
+        on_archived: Callable[[List[str]], None] = None,
+    ):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown archive codec: {codec}")
+
+        self.rooms = rooms
+        self.messages = messages
+        self.archive = archive
+        self.idle_seconds = idle_seconds
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.interval = interval
+        self.codec = codec
+        self.claim_ttl = claim_ttl
+        self.on_archived = on_archived
+
+        self._task = None
+
+        self.archived = 0
+        self.batches = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self.deleted = 0
+
+    async def ensure_indexes(self):
+        try:
+            await self.archive.create_index("roomId", unique=True)
+            # Transcript exports page through the archive in this order
+            await self.archive.create_index([("startTime", 1), ("roomId", 1)])
+        except Exception as e:
+            print(f"Archive index error: {e}")
+
+    async def start(self):
+        await self.ensure_indexes()
+        if self.idle_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # A batch cut off here is archived again on the next run
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                archived = await self.archive_batch()
+            except Exception as e:
+                print(f"Archive error: {e}")
+                archived = 0
+            if archived < self.batch_size:
+                # Caught up; wait for more rooms to go idle
+                await asyncio.sleep(self.interval)
+            else:
+                await asyncio.sleep(archived / self.max_rate)
+
+    async def archive_batch(self) -> int:
+        # Archives up to batch_size idle closed rooms, oldest first; returns how many
+        now = datetime.now()
+        cutoff = (now - timedelta(seconds=self.idle_seconds)).isoformat()
+        unclaimed = {"$or": [
+            {"archivingAt": {"$exists": False}},
+            {"archivingAt": {"$lt": (now - timedelta(seconds=self.claim_ttl)).isoformat()}}
+        ]}
+        cursor = self.rooms.find(
+            {"status": "closed", "lastActivity": {"$lt": cutoff}, **unclaimed},
+            {"_id": 0, "roomId": 1, "lastActivity": 1},
+            sort=[("lastActivity", 1)]
+        ).limit(self.batch_size)
+        candidates = await cursor.to_list(self.batch_size)
+        if not candidates:
+            return 0
+
+        # Rooms another worker claimed in the meantime are left to it
+        token = uuid.uuid4().hex
+        claimed = await asyncio.gather(*(
+            self.rooms.find_one_and_update(
+                {"roomId": room["roomId"], "status": "closed", "lastActivity": room["lastActivity"], **unclaimed},
+                {"$set": {"archiving": token, "archivingAt": now.isoformat()}},
+                projection={"_id": 0}
+            )
+            for room in candidates
+        ))
+        rooms = [room for room in claimed if room is not None]
+        if not rooms:
+            return 0
+
+        room_ids = [room["roomId"] for room in rooms]
+        stored: Dict[str, List[Dict[str, Any]]] = {room_id: [] for room_id in room_ids}
+        async for bucket in self.messages.find({"roomId": {"$in": room_ids}}, {"_id": 0, "roomId": 1, "messages": 1}):
+            stored[bucket["roomId"]].extend(bucket["messages"])
+
+        last_activity = {room["roomId"]: room["lastActivity"] for room in rooms}
+        documents = await asyncio.to_thread(archive_documents, rooms, stored, self.codec)
+        await self.archive.bulk_write([ReplaceOne({"roomId": d["roomId"]}, d, upsert=True) for d in documents], ordered=False)
+
+        # Rooms first, each only if still ours, closed and with the activity
+        # read above; messages only of the rooms that were actually deleted
+        await self.rooms.bulk_write([
+            DeleteOne({"roomId": room_id, "status": "closed", "lastActivity": last_activity[room_id], "archiving": token})
+            for room_id in room_ids
+        ], ordered=False)
+        kept = {room["roomId"] async for room in self.rooms.find({"roomId": {"$in": room_ids}}, {"_id": 0, "roomId": 1})}
+        if kept:
+            await self.archive.delete_many({"roomId": {"$in": list(kept)}})
+            await self.rooms.update_many(
+                {"roomId": {"$in": list(kept)}, "archiving": token},
+                {"$unset": {"archiving": "", "archivingAt": ""}}
+            )
+        deleted = [room_id for room_id in room_ids if room_id not in kept]
+        if deleted:
+            await self.messages.delete_many({"roomId": {"$in": deleted}})
+
+        documents = [document for document in documents if document["roomId"] not in kept]
+        self.archived += len(documents)
+        self.batches += 1
+        self.raw_bytes += sum(document["rawBytes"] for document in documents)
+        self.stored_bytes += sum(document["transcriptBytes"] for document in documents)
+        if self.on_archived is not None and deleted:
+            self.on_archived(deleted)
+        return len(documents)
+
+    async def load(self, room_id: str) -> Optional[Tuple[Dict[str, Any], List[Dict[str, Any]]]]:
+        # (metadata, messages) of an archived room, or None
+        document = await self.archive.find_one({"roomId": room_id}, {"_id": 0})
+        if document is None:
+            return None
+        blob = document.pop("transcript")
+        messages = await asyncio.to_thread(decompress_transcript, bytes(blob), document["codec"])
+        return document, messages
+
+    async def delete(self, room_id: str) -> bool:
+        result = await self.archive.delete_one({"roomId": room_id})
+        self.deleted += result.deleted_count
+        return result.deleted_count > 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "codec": self.codec,
+            "idleSeconds": self.idle_seconds,
+            "archived": self.archived,
+            "batches": self.batches,
+            "rawBytes": self.raw_bytes,
+            "storedBytes": self.stored_bytes,
+            "deleted": self.deleted
+        }
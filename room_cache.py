@@ -0,0 +1,164 @@
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from collections import OrderedDict
+import time
+
+from models import Room, intern
+from room_index import RoomIndex
+
+
+# Bounded LRU cache of live room state. Closed rooms expire after
+# closed_ttl and idle rooms after idle_ttl. When full, eviction samples the
+# least recently used end and prefers closed rooms, then idle ones.
+# Secondary indexes cover exactly the cached rooms; change indexed fields
+# with update().
+class RoomCache:
+    def __init__(self, max_rooms: int = 10000, idle_ttl: float = 1800.0, closed_ttl: float = 300.0, sample_size: int = 64):
+        self.max_rooms = max_rooms
+        self.idle_ttl = idle_ttl
+        self.closed_ttl = closed_ttl
+        self.sample_size = sample_size
+
+        # room_id -> [room, last access time], least recently used first
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+        self.index = RoomIndex()
+
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def _expired(self, entry: list, now: float) -> bool:
+        age = now - entry[1]
+        if entry[0].status == "closed":
+            return age > self.closed_ttl
+        return age > self.idle_ttl
+
+    def get(self, room_id: str, default: Any = None) -> Optional[Room]:
+        entry = self._entries.get(room_id)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        now = time.monotonic()
+        if self._expired(entry, now):
+            self._discard(room_id)
+            self.expirations += 1
+            self.misses += 1
+            return default
+
+        entry[1] = now
+        self._entries.move_to_end(room_id)
+        self.hits += 1
+        return entry[0]
+
+    def peek(self, room_id: str) -> Optional[Room]:
+        # Lookup without touching LRU order or counters
+        entry = self._entries.get(room_id)
+        return entry[0] if entry is not None else None
+
+    def _discard(self, room_id: str) -> Optional[Room]:
+        entry = self._entries.pop(room_id, None)
+        if entry is None:
+            return None
+        self.index.remove(room_id, entry[0])
+        return entry[0]
+
+    def put(self, room_id: str, room: Room):
+        now = time.monotonic()
+        self._discard(room_id)
+        self._entries[room_id] = [room, now]
+        self.index.add(room_id, room)
+
+        # Drop expired rooms from the cold end, then enforce the bound
+        while self._entries:
+            oldest_id, oldest = next(iter(self._entries.items()))
+            if oldest_id == room_id or not self._expired(oldest, now):
+                break
+            self._discard(oldest_id)
+            self.expirations += 1
+
+        while len(self._entries) > self.max_rooms:
+            self._evict_one(now, keep=room_id)
+
+    def _evict_one(self, now: float, keep: str):
+        closed = idle = fallback = None
+        for index, (room_id, entry) in enumerate(self._entries.items()):
+            if index >= self.sample_size:
+                break
+            if room_id == keep:
+                continue
+            if fallback is None:
+                fallback = room_id
+            if entry[0].status == "closed":
+                closed = room_id
+                break
+            if idle is None and now - entry[1] > self.idle_ttl / 2:
+                idle = room_id
+
+        victim = closed or idle or fallback
+        if victim is not None:
+            self._discard(victim)
+            self.evictions += 1
+
+    def pop(self, room_id: str, default: Any = None):
+        room = self._discard(room_id)
+        return room if room is not None else default
+
+    def update(self, room_id: str, **fields) -> Optional[Room]:
+        # Set room fields, keeping the secondary indexes in step
+        entry = self._entries.get(room_id)
+        if entry is None:
+            return None
+        for field in ("status", "agent_name"):
+            if field in fields:
+                fields[field] = intern(fields[field])
+        self.index.update(room_id, entry[0], fields)
+        return entry[0]
+
+    def rooms_where(self, field: str, value: Any) -> List[Tuple[str, Room]]:
+        # Indexed lookup by user_id, agent_id or status
+        return [(room_id, self._entries[room_id][0]) for room_id in self.index.rooms_where(field, value)]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxRooms": self.max_rooms,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRatio": self.hits / lookups if lookups else 0.0,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "byStatus": self.index.status_counts()
+        }
+
+    # Dict-style access used by the rest of the server
+    def __contains__(self, room_id: str) -> bool:
+        return room_id in self._entries
+
+    def __getitem__(self, room_id: str) -> Room:
+        room = self.get(room_id)
+        if room is None:
+            raise KeyError(room_id)
+        return room
+
+    def __setitem__(self, room_id: str, room: Room):
+        self.put(room_id, room)
+
+    def __delitem__(self, room_id: str):
+        if self._discard(room_id) is None:
+            raise KeyError(room_id)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._entries))
+
+    def items(self):
+        return [(room_id, entry[0]) for room_id, entry in self._entries.items()]
+
+    def values(self):
+        return [entry[0] for entry in self._entries.values()]
@@ -0,0 +1,50 @@
+from typing import List, Optional
+from collections import OrderedDict
+import uuid
+
+from models import Room
+
+
+# Versioned log of room changes for admin dashboards. Every change takes
+# the next sequence number and replaces the room's previous entry, so
+# reading since a cursor yields each changed room once, in its latest
+# state. Only the most recently changed max_rooms rooms are kept; a cursor
+# older than what was dropped gets None and must take a fresh snapshot.
+# Cursors are only meaningful to the log that issued them, so each log has
+# an epoch that clients send back with their cursor.
+class RoomChangeLog:
+    def __init__(self, max_rooms: int = 10000):
+        self.max_rooms = max_rooms
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.floor = 0
+
+        # room_id -> [seq, room], oldest change first
+        self._entries: "OrderedDict[str, list]" = OrderedDict()
+
+    def record(self, room_id: str, room: Room) -> int:
+        self.seq += 1
+        self._entries[room_id] = [self.seq, room]
+        self._entries.move_to_end(room_id)
+
+        while len(self._entries) > self.max_rooms:
+            _, (dropped_seq, _) = self._entries.popitem(last=False)
+            self.floor = dropped_seq
+        return self.seq
+
+    def since(self, cursor: int, epoch: str = None) -> Optional[List[Room]]:
+        # None when the cursor is from another log (another worker, or
+        # before a restart), or too old or too new to continue from
+        if epoch is not None and epoch != self.epoch:
+            return None
+        if cursor < self.floor or cursor > self.seq:
+            return None
+
+        # Walk back from the newest change until reaching the cursor
+        changes = []
+        for seq, room in reversed(self._entries.values()):
+            if seq <= cursor:
+                break
+            changes.append(room)
+        changes.reverse()
+        return changes
@@ -0,0 +1,55 @@
+from typing import Any, Dict, Iterable, Optional, Set
+
+from models import Room
+
+# Room attributes with a secondary index
+INDEXED_FIELDS = ("user_id", "agent_id", "status")
+
+
+# Secondary indexes over live room state: room IDs by user, agent and
+# status. Rooms must be changed through update() so the indexes move with
+# them. Per-agent load is the dispatch scheduler's, which also counts rooms
+# the cache has let go of.
+class RoomIndex:
+    def __init__(self):
+        self._by_field: Dict[str, Dict[Any, Set[str]]] = {field: {} for field in INDEXED_FIELDS}
+
+    def _link(self, field: str, value: Any, room_id: str):
+        if value is not None:
+            self._by_field[field].setdefault(value, set()).add(room_id)
+
+    def _unlink(self, field: str, value: Any, room_id: str):
+        rooms = self._by_field[field].get(value)
+        if rooms is not None:
+            rooms.discard(room_id)
+            if not rooms:
+                del self._by_field[field][value]
+
+    def add(self, room_id: str, room: Room):
+        for field in INDEXED_FIELDS:
+            self._link(field, getattr(room, field), room_id)
+
+    def remove(self, room_id: str, room: Room):
+        for field in INDEXED_FIELDS:
+            self._unlink(field, getattr(room, field), room_id)
+
+    def update(self, room_id: str, room: Room, fields: Dict[str, Any]):
+        # Apply fields to the room and move it between index entries
+        for field, value in fields.items():
+            current = getattr(room, field)
+            if field in self._by_field and current != value:
+                self._unlink(field, current, room_id)
+                self._link(field, value, room_id)
+            setattr(room, field, value)
+
+    def rooms_where(self, field: str, value: Any) -> Set[str]:
+        return self._by_field[field].get(value, set())
+
+    def count(self, field: str, value: Any) -> int:
+        return len(self._by_field[field].get(value, ()))
+
+    def status_counts(self, statuses: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        by_status = self._by_field["status"]
+        if statuses is None:
+            statuses = by_status.keys()
+        return {status: len(by_status.get(status, ())) for status in statuses}
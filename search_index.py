@@ -0,0 +1,510 @@
+from typing import Any, Dict, List, Optional, Tuple
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+import heapq
+import math
+import os
+import pickle
+import re
+import time
+import uuid
+
+from models import Room, to_iso
+
+_TOKEN = re.compile(r"\w+")
+_QUERY_PART = re.compile(r'"([^"]*)"|(\S+)')
+MAX_TOKEN_LENGTH = 64
+MAX_POSITION = 0xFFFF
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SNAPSHOT_VERSION = 2
+
+# Delta snapshots appended after a full one before the next full rewrite
+MAX_SNAPSHOT_DELTAS = 12
+
+# Matching message seqs returned per result
+MAX_MATCHES_PER_RESULT = 5
+
+# Postings of one term scanned, and phrase candidates position-checked, per
+# query. Past these only the most recent documents are considered, which
+# bounds the time one search holds the event loop.
+MAX_SCANNED_POSTINGS = 50000
+MAX_PHRASE_CANDIDATES = 5000
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [token for token in _TOKEN.findall(text.lower()) if len(token) <= MAX_TOKEN_LENGTH]
+
+
+def parse_query(query: str) -> List[List[str]]:
+    # Each part is one term or a phrase: a quoted string, or a word such as
+    # an email address that tokenizes to several terms
+    parts = []
+    for quoted, word in _QUERY_PART.findall(query or ""):
+        tokens = tokenize(quoted or word)
+        if tokens:
+            parts.append(tokens)
+    return parts
+
+
+# What the index keeps per room: filter and display fields, its
+# documents, how many of its messages are indexed, and the document
+# holding its user name, email and agent name
+class IndexedRoom:
+    __slots__ = (
+        "room_id", "user_name", "user_email", "agent_name", "status",
+        "start_time", "last_activity", "docs", "message_count", "field_doc",
+    )
+
+    def __init__(self, room_id: str):
+        self.room_id = room_id
+        self.user_name = None
+        self.user_email = None
+        self.agent_name = None
+        self.status = None
+        self.start_time = 0.0
+        self.last_activity = 0.0
+        self.docs = array("I")
+        self.message_count = 0
+        self.field_doc = -1
+
+    def copy(self) -> "IndexedRoom":
+        room = IndexedRoom(self.room_id)
+        for field in self.__slots__[1:]:
+            setattr(room, field, getattr(self, field))
+        room.docs = array("I", self.docs)
+        return room
+
+    def result(self, score: float, matches: List[int]) -> Dict[str, Any]:
+        return {
+            "roomId": self.room_id,
+            "score": round(score, 4),
+            "userName": self.user_name,
+            "userEmail": self.user_email,
+            "agentName": self.agent_name,
+            "status": self.status,
+            "startTime": to_iso(self.start_time),
+            "lastActivity": to_iso(self.last_activity),
+            "matchingSeqs": sorted(set(matches))[:MAX_MATCHES_PER_RESULT]
+        }
+
+
+# Inverted index over chat messages and room fields, updated as messages
+# are added. A document is one message (or a room's field document);
+# results are rooms that contain every query part, ranked by the BM25
+# scores of their matching documents. Postings are flat arrays in
+# document order, one entry per occurrence, so they stay compact and
+# pickle quickly. Snapshots are a full copy now and then, and in between
+# deltas with only the documents and rooms changed since the last one.
+class SearchIndex:
+    def __init__(self):
+        # term -> (document ids, positions)
+        self.postings: Dict[str, Tuple[array, array]] = {}
+
+        # Per document: room number, message seq (-1 for field documents), length
+        self.doc_room = array("I")
+        self.doc_seq = array("i")
+        self.doc_length = array("H")
+        self.total_length = 0
+        self.occurrences = 0
+        self.dead_docs = set()
+
+        self.rooms: List[IndexedRoom] = []
+        self.room_numbers: Dict[str, int] = {}
+        self.changed = False
+
+        # Snapshot bookkeeping: the full snapshot deltas apply to, how many
+        # have been written since, and what changed since the last one
+        self.generation = None
+        self.deltas = 0
+        self.saved_at = None
+        self._force_full = True
+        self._saved_docs = 0
+        self._dirty_terms = set()
+        self._dirty_rooms = set()
+        self._new_dead: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self.doc_room) - len(self.dead_docs)
+
+    def _add_doc(self, room_number: int, seq: int, text: str) -> int:
+        doc = len(self.doc_room)
+        tokens = tokenize(text)
+        self._dirty_terms.update(tokens)
+        self._dirty_rooms.add(room_number)
+        for position, token in enumerate(tokens):
+            entry = self.postings.get(token)
+            if entry is None:
+                entry = self.postings[token] = (array("I"), array("H"))
+            entry[0].append(doc)
+            entry[1].append(min(position, MAX_POSITION))
+
+        length = min(len(tokens), MAX_POSITION)
+        self.doc_room.append(room_number)
+        self.doc_seq.append(seq)
+        self.doc_length.append(length)
+        self.total_length += length
+        self.occurrences += len(tokens)
+        self.rooms[room_number].docs.append(doc)
+        self.changed = True
+        return doc
+
+    def _room_number(self, room_id: str) -> int:
+        number = self.room_numbers.get(room_id)
+        if number is None:
+            number = self.room_numbers[room_id] = len(self.rooms)
+            self.rooms.append(IndexedRoom(room_id))
+        return number
+
+    def update_room(self, room: Room):
+        number = self._room_number(room.room_id)
+        indexed = self.rooms[number]
+        self._dirty_rooms.add(number)
+        indexed.status = room.status
+        indexed.start_time = room.start_time
+        indexed.last_activity = room.last_activity
+
+        # Names only change when an agent takes the room; the old field
+        # document is superseded rather than rewritten
+        fields = (room.user_name, room.user_email, room.agent_name)
+        if fields != (indexed.user_name, indexed.user_email, indexed.agent_name) or indexed.field_doc < 0:
+            indexed.user_name, indexed.user_email, indexed.agent_name = fields
+            if indexed.field_doc >= 0:
+                self._retire(indexed.field_doc)
+            indexed.field_doc = self._add_doc(number, -1, " ".join(field for field in fields if field))
+
+    def _retire(self, doc: int):
+        self.dead_docs.add(doc)
+        self._new_dead.append(doc)
+        self.total_length -= self.doc_length[doc]
+
+    def add_message(self, room_id: str, seq: int, text: str) -> bool:
+        # Messages are indexed once, in seq order; update_room() comes first
+        number = self.room_numbers.get(room_id)
+        if number is None:
+            return False
+        indexed = self.rooms[number]
+        if seq < indexed.message_count:
+            return False
+        indexed.message_count = seq + 1
+        self._dirty_rooms.add(number)
+        self._add_doc(number, seq, text)
+        return True
+
+    def remove_room(self, room_id: str) -> bool:
+        # Retires the room's documents; its room number stays allocated
+        number = self.room_numbers.get(room_id)
+        if number is None:
+            return False
+        indexed = self.rooms[number]
+        self._dirty_rooms.add(number)
+        for doc in indexed.docs:
+            if doc not in self.dead_docs:
+                self._retire(doc)
+        indexed.docs = array("I")
+        indexed.field_doc = -1
+        indexed.message_count = 0
+        indexed.user_name = indexed.user_email = indexed.agent_name = None
+        self.changed = True
+        return True
+
+    def indexed_count(self, room_id: str) -> int:
+        number = self.room_numbers.get(room_id)
+        return self.rooms[number].message_count if number is not None else 0
+
+    def _term_tf(self, term: str, docs: Optional[array] = None) -> Dict[int, int]:
+        entry = self.postings.get(term)
+        if entry is None:
+            return {}
+        postings = entry[0]
+        if docs is None:
+            if len(postings) > MAX_SCANNED_POSTINGS:
+                postings = postings[-MAX_SCANNED_POSTINGS:]
+            return Counter(postings)
+
+        # Few candidate documents: look each one up instead of scanning
+        tf = {}
+        for doc in docs:
+            low = bisect_left(postings, doc)
+            if low < len(postings) and postings[low] == doc:
+                tf[doc] = bisect_right(postings, doc, low) - low
+        return tf
+
+    def _positions(self, term: str, doc: int) -> set:
+        postings, positions = self.postings[term]
+        low = bisect_left(postings, doc)
+        return set(positions[low:bisect_right(postings, doc, low)])
+
+    def _phrase_tf(self, tokens: List[str], docs: Optional[array] = None) -> Dict[int, int]:
+        # Documents with every term, then checked for consecutive positions
+        candidates = None
+        for token in sorted(set(tokens), key=self.term_occurrences):
+            if candidates is not None and len(candidates) * 8 < self.term_occurrences(token):
+                docs = array("I", sorted(candidates))
+            tf = self._term_tf(token, docs)
+            candidates = set(tf) if candidates is None else candidates & tf.keys()
+            if not candidates:
+                return {}
+
+        if len(candidates) > MAX_PHRASE_CANDIDATES:
+            candidates = heapq.nlargest(MAX_PHRASE_CANDIDATES, candidates)
+
+        result = {}
+        for doc in candidates:
+            positions = [self._positions(token, doc) for token in tokens]
+            count = sum(1 for start in positions[0] if all(start + i in positions[i] for i in range(1, len(tokens))))
+            if count:
+                result[doc] = count
+        return result
+
+    def term_occurrences(self, term: str) -> int:
+        # An upper bound on the term's document frequency, free to look up
+        entry = self.postings.get(term)
+        return len(entry[0]) if entry is not None else 0
+
+    def _allowed(self, room: IndexedRoom, status: Optional[str], start: Optional[float], end: Optional[float]) -> bool:
+        if status is not None and room.status != status:
+            return False
+        if start is not None and room.start_time < start:
+            return False
+        if end is not None and room.start_time >= end:
+            return False
+        return True
+
+    def search(self, query: str, status: str = None, start: float = None, end: float = None, limit: int = 20, offset: int = 0) -> Tuple[int, List[Dict[str, Any]]]:
+        # Returns (total matching rooms, one page of results)
+        parts = parse_query(query)
+        if not parts or not len(self):
+            return 0, []
+
+        # Rarest part first, so later parts only look at its rooms' documents
+        parts.sort(key=lambda tokens: min(self.term_occurrences(token) for token in tokens))
+        documents = len(self)
+        average_length = self.total_length / documents or 1.0
+
+        doc_room = self.doc_room
+        doc_length = self.doc_length
+        dead_docs = self.dead_docs
+        filtered = status is not None or start is not None or end is not None
+        base = K1 * (1 - B)
+        per_token = K1 * B / average_length
+
+        scores: Optional[Dict[int, float]] = None
+        part_tfs = []
+        for tokens in parts:
+            # Rooms that matched so far, when they have few enough documents
+            # to look up one by one
+            candidate_docs = None
+            if scores is not None:
+                rarest = min(self.term_occurrences(token) for token in tokens)
+                if sum(len(self.rooms[number].docs) for number in scores) * 8 < rarest:
+                    candidate_docs = array("I", sorted(doc for number in scores for doc in self.rooms[number].docs))
+
+            tf = self._term_tf(tokens[0], candidate_docs) if len(tokens) == 1 else self._phrase_tf(tokens, candidate_docs)
+            part_tfs.append(tf)
+            frequency = len(tf)
+            gain = math.log(1 + (documents - frequency + 0.5) / (frequency + 0.5)) * (K1 + 1)
+
+            part_scores: Dict[int, float] = {}
+            allowed: Dict[int, bool] = {}
+            for doc, count in tf.items():
+                number = doc_room[doc]
+                if scores is None:
+                    if filtered:
+                        ok = allowed.get(number)
+                        if ok is None:
+                            ok = allowed[number] = self._allowed(self.rooms[number], status, start, end)
+                        if not ok:
+                            continue
+                elif number not in scores:
+                    continue
+                if dead_docs and doc in dead_docs:
+                    continue
+                part_scores[number] = part_scores.get(number, 0.0) + gain * count / (count + base + per_token * doc_length[doc])
+
+            if scores is None:
+                scores = part_scores
+            else:
+                scores = {number: scores[number] + score for number, score in part_scores.items()}
+            if not scores:
+                return 0, []
+
+        ranked = heapq.nlargest(
+            offset + limit,
+            scores.items(),
+            key=lambda item: (item[1], self.rooms[item[0]].last_activity)
+        )
+        results = []
+        for number, score in ranked[offset:offset + limit]:
+            # Matching messages, looked up for this page only
+            matches = [self.doc_seq[doc] for doc in self.rooms[number].docs if self.doc_seq[doc] >= 0 and any(doc in tf for tf in part_tfs)]
+            results.append(self.rooms[number].result(score, matches))
+        return len(scores), results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rooms": len(self.rooms),
+            "documents": len(self),
+            "terms": len(self.postings),
+            "postings": self.occurrences
+        }
+
+    def snapshot(self) -> Dict[str, Any]:
+        # A copy of what changed since the last snapshot (or of the whole
+        # index, every MAX_SNAPSHOT_DELTAS snapshots) that write_snapshot()
+        # can pickle from another thread while this one keeps changing.
+        # Postings are append-only in document order, so a delta is each
+        # changed term's tail past the previous snapshot's last document.
+        full = self._force_full or self.deltas >= MAX_SNAPSHOT_DELTAS
+        start = 0 if full else self._saved_docs
+        if full:
+            self.generation = uuid.uuid4().hex
+            self.deltas = 0
+            terms = self.postings.keys()
+            rooms = range(len(self.rooms))
+        else:
+            self.deltas += 1
+            terms = self._dirty_terms
+            rooms = self._dirty_rooms
+
+        postings = {}
+        for term in terms:
+            docs, positions = self.postings[term]
+            low = bisect_left(docs, start) if start else 0
+            postings[term] = (docs[low:], positions[low:])
+
+        self.saved_at = time.time()
+        state = {
+            "version": SNAPSHOT_VERSION,
+            "kind": "full" if full else "delta",
+            "generation": self.generation,
+            "start": start,
+            "savedAt": self.saved_at,
+            "postings": postings,
+            "doc_room": self.doc_room[start:],
+            "doc_seq": self.doc_seq[start:],
+            "doc_length": self.doc_length[start:],
+            "total_length": self.total_length,
+            "occurrences": self.occurrences,
+            "dead_docs": set(self.dead_docs) if full else list(self._new_dead),
+            "rooms": {number: self.rooms[number].copy() for number in rooms},
+        }
+
+        self.changed = False
+        self._force_full = False
+        self._saved_docs = len(self.doc_room)
+        self._dirty_terms = set()
+        self._dirty_rooms = set()
+        self._new_dead = []
+        return state
+
+    def snapshot_failed(self):
+        # The changes in an unwritten delta are gone from the dirty sets,
+        # so the next snapshot has to be a full one
+        self.changed = True
+        self._force_full = True
+
+    @staticmethod
+    def write_snapshot(state: Dict[str, Any], path: str):
+        # A full snapshot goes to a temporary file first so a crash never
+        # leaves half of one, and starts a new delta file; deltas are
+        # appended, and a torn last one is ignored on load
+        if state["kind"] == "delta":
+            with open(f"{path}.delta", "ab") as deltas:
+                pickle.dump(state, deltas, protocol=pickle.HIGHEST_PROTOCOL)
+                deltas.flush()
+                os.fsync(deltas.fileno())
+            return
+        temporary = f"{path}.tmp"
+        with open(temporary, "wb") as snapshot:
+            pickle.dump(state, snapshot, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+        try:
+            os.unlink(f"{path}.delta")
+        except FileNotFoundError:
+            pass
+
+    def save(self, path: str):
+        self.write_snapshot(self.snapshot(), path)
+
+    def _apply(self, state: Dict[str, Any]) -> bool:
+        # Applies a delta on top of the documents it continues from
+        if state.get("generation") != self.generation or state.get("start") != len(self.doc_room):
+            return False
+        for term, (docs, positions) in state["postings"].items():
+            entry = self.postings.get(term)
+            if entry is None:
+                self.postings[term] = (docs, positions)
+            else:
+                entry[0].extend(docs)
+                entry[1].extend(positions)
+        self.doc_room.extend(state["doc_room"])
+        self.doc_seq.extend(state["doc_seq"])
+        self.doc_length.extend(state["doc_length"])
+        self.total_length = state["total_length"]
+        self.occurrences = state["occurrences"]
+        self.dead_docs.update(state["dead_docs"])
+        for number, room in sorted(state["rooms"].items()):
+            if number == len(self.rooms):
+                self.rooms.append(room)
+            else:
+                self.rooms[number] = room
+        self.saved_at = state["savedAt"]
+        self.deltas += 1
+        return True
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SearchIndex"]:
+        # None when there is no usable snapshot; the caller rebuilds from Mongo
+        try:
+            with open(path, "rb") as snapshot:
+                state = pickle.load(snapshot)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Search index snapshot error: {e}")
+            return None
+        if state.get("version") != SNAPSHOT_VERSION:
+            return None
+
+        index = cls()
+        index.postings = state["postings"]
+        index.doc_room = state["doc_room"]
+        index.doc_seq = state["doc_seq"]
+        index.doc_length = state["doc_length"]
+        index.total_length = state["total_length"]
+        index.occurrences = state["occurrences"]
+        index.dead_docs = state["dead_docs"]
+        index.rooms = [state["rooms"][number] for number in range(len(state["rooms"]))]
+        index.generation = state["generation"]
+        index.saved_at = state["savedAt"]
+
+        # Deltas written since, up to the first one that is torn or from
+        # another full snapshot; after that the next snapshot is full again
+        clean = True
+        try:
+            with open(f"{path}.delta", "rb") as deltas:
+                while True:
+                    try:
+                        delta = pickle.load(deltas)
+                    except EOFError:
+                        break
+                    if not index._apply(delta):
+                        clean = False
+                        break
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"Search index delta error: {e}")
+            clean = False
+
+        index.room_numbers = {room.room_id: number for number, room in enumerate(index.rooms)}
+        index._saved_docs = len(index.doc_room)
+        index._force_full = not clean
+        return index
@@ -2,21 +2,77 @@
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from typing import List, Dict, Any, Optional
-import json
+from contextlib import AsyncExitStack, asynccontextmanager
 import asyncio
 import uvicorn
 import datetime
-import smtplib
-from email.mime.text import MIMEText
 import uuid
 import os
+import time
+import secrets
 from pydantic import BaseModel
 import motor.motor_asyncio
+from pymongo import IndexModel
 from datetime import datetime
+from keyword_matcher import KeywordMatcher
+from message_writer import MessageWriter, bucket_for
+from email_outbox import EmailOutbox
+from broadcaster import Broadcaster, WireProtocol
+from backplane import InProcessBackplane, UnixSocketBackplane
+from room_cache import RoomCache
+from inference import create_engine
+from response_cache import ResponseCache
+from dispatcher import ConnectionDispatcher
+from dispatch_scheduler import DispatchScheduler
+from room_changes import RoomChangeLog
+from models import Message, Room, from_iso, to_iso
+from replay import events_since, record_event
+from typing_relay import TypingRelay
+from transcript_export import after_room, export_query, export_transcripts, find_resume_point
+from search_index import SearchIndex
+from metrics import Metrics
+from retention import DEFAULT_CODEC, RetentionWorker
+from codec import FrameError, decode, MAX_FRAME_BYTES, USER_EVENTS, ADMIN_EVENTS, AGENT_EVENTS
 
-# Initialize FastAPI
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Startup steps run in this order and are undone in reverse. Indexes,
+    # migration and room recovery come before pending requests and the
+    # search index are loaded on top of them; websockets are refused and
+    # /ready answers 503 until the last step.
+    async with AsyncExitStack() as stack:
+        await metrics.start()
+        stack.push_async_callback(metrics.close)
+        await message_writer.start()
+        # Queued message appends are drained after everything else stopped
+        stack.push_async_callback(message_writer.close)
+        await email_outbox.start()
+        stack.push_async_callback(email_outbox.close)
+        await manager.backplane.start(manager.handle_backplane_message)
+        stack.push_async_callback(stop_backplane)
+        await recover_rooms()
+        await manager.load_pending_requests()
+        await manager.load_search_index()
+        search_snapshots = asyncio.create_task(manager.snapshot_search_index())
+        stack.push_async_callback(save_search_index, search_snapshots)
+        retention.on_archived = manager.forget_rooms
+        await retention.start()
+        stack.push_async_callback(retention.close)
+        admin_sync = asyncio.create_task(manager.sync_admins())
+        stack.callback(admin_sync.cancel)
+        await bot_engine.start()
+        stack.push_async_callback(bot_engine.close)
+        
+        app.state.startup["startupSeconds"] = round(time.perf_counter() - app.state.created, 3)
+        manager.ready = True
+        print(f"Ready after {app.state.startup['startupSeconds']:.2f}s")
+        yield
+
+# Initialize FastAPI; startup time is reported from here once the app is ready
+app = FastAPI(lifespan=lifespan)
+app.state.created = time.perf_counter()
 
 # Configure CORS
 app.add_middleware(
@@ -27,11 +83,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Hot-path timings and gauges, served at /metrics. Disabled, each hook is a
+# single flag check and handlers run unwrapped.
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1"
+metrics = Metrics(METRICS_ENABLED, lag_interval=float(os.environ.get("METRICS_LAG_INTERVAL", "0.1")))
+
 # Connect to MongoDB
 MONGO_CONNECTION_STRING = "mongodb://localhost:27017"  # Replace with your MongoDB connection string
 client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_CONNECTION_STRING)
 db = client.chatbot_db
 
+# Message persistence: "sync", "batched" or "fire_and_forget" (write-behind)
+MESSAGE_WRITE_MODE = os.environ.get("MESSAGE_WRITE_MODE", "sync")
+message_writer = MessageWriter(db.chat_rooms, db.chat_messages, mode=MESSAGE_WRITE_MODE)
+
+def use_database(database):
+    # Points the app at another database before startup, e.g. the in-memory
+    # stand-in the load benchmark runs against
+    global db
+    db = database
+    message_writer.rooms = database.chat_rooms
+    message_writer.messages = database.chat_messages
+    retention.rooms = database.chat_rooms
+    retention.messages = database.chat_messages
+    retention.archive = database.chat_archive
+
+# Chat history paging
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
 # Serve static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -39,6 +119,21 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 COMPANY_EMAIL = "ramaharsha804@gmail.com"  # Replace with actual company email
 ALERT_EMAIL = "hh4745525@gmail.com"  # Replace with your email
 ALERT_PASSWORD = "zkgk hjpt jmsf bzsz"  # Replace with your app password
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "1") == "1"  # Set to 0 for a local SMTP stand-in
+
+# Notification emails are queued and sent by a background worker
+email_outbox = EmailOutbox(
+    SMTP_HOST,
+    SMTP_PORT,
+    ALERT_EMAIL,
+    COMPANY_EMAIL,
+    username=ALERT_EMAIL if SMTP_STARTTLS else None,
+    password=ALERT_PASSWORD,
+    starttls=SMTP_STARTTLS,
+    on_send=metrics.observe_smtp if METRICS_ENABLED else None,
+)
 
 # Sensitive categories
 SENSITIVE_CATEGORIES = {
@@ -54,144 +149,641 @@ SENSITIVE_CATEGORIES = {
     "Political & Social Issues": ["government policy", "human rights", "labor rights"],
 }
 
+# Queue priority for human requests by detected category; anything else is "medium"
+CATEGORY_PRIORITIES = {
+    "Security & Data Breach": "urgent",
+    "Fraudulent & Phishing Attempts": "urgent",
+    "Legal & Compliance Issues": "high",
+    "Unethical or Illegal Activities": "high",
+}
+
+# Compiled once; rebuild through reload_sensitive_categories when the table changes
+sensitive_matcher = KeywordMatcher(SENSITIVE_CATEGORIES)
+
+def reload_sensitive_categories(categories: Dict[str, List[str]]):
+    global SENSITIVE_CATEGORIES, sensitive_matcher
+    matcher = KeywordMatcher(categories)
+    SENSITIVE_CATEGORIES = categories
+    sensitive_matcher = matcher
+
+# Outgoing websocket queues: "drop", "coalesce" or "disconnect" for slow consumers
+SEND_QUEUE_SIZE = int(os.environ.get("SEND_QUEUE_SIZE", "256"))
+SLOW_CONSUMER_POLICY = os.environ.get("SLOW_CONSUMER_POLICY", "coalesce")
+
+# permessage-deflate for clients that offer it; the encoding and
+# micro-batching are opted into per connection (see WireProtocol)
+WS_PER_MESSAGE_DEFLATE = os.environ.get("WS_PER_MESSAGE_DEFLATE", "1") == "1"
+
+# Cross-worker routing: "local" for a single worker, "unix" to share a Unix
+# socket backplane between uvicorn workers on one host
+BACKPLANE = os.environ.get("BACKPLANE", "local")
+BACKPLANE_SOCKET = os.environ.get("BACKPLANE_SOCKET", "/tmp/chatbot-backplane.sock")
+
+def create_backplane():
+    if BACKPLANE == "unix":
+        return UnixSocketBackplane(BACKPLANE_SOCKET)
+    return InProcessBackplane()
+
+# Live room cache bounds; evicted rooms are reloaded from Mongo on demand
+ROOM_CACHE_SIZE = int(os.environ.get("ROOM_CACHE_SIZE", "10000"))
+ROOM_IDLE_TTL = float(os.environ.get("ROOM_IDLE_TTL", "1800"))
+CLOSED_ROOM_TTL = float(os.environ.get("CLOSED_ROOM_TTL", "300"))
+
+# Startup recovery of open (active and pending) rooms into the room cache.
+# Off by default with a shared backplane, where another worker may own them.
+ROOM_RECOVERY = os.environ.get("ROOM_RECOVERY", "1" if BACKPLANE == "local" else "0") == "1"
+ROOM_RECOVERY_BATCH = int(os.environ.get("ROOM_RECOVERY_BATCH", "1000"))
+
+# Frames a single connection (or the commands forwarded from other workers)
+# may have queued or running at once
+MAX_IN_FLIGHT_FRAMES = int(os.environ.get("MAX_IN_FLIGHT_FRAMES", "32"))
+# Seconds a closed connection's in-flight frames get to finish before they are cancelled
+DISPATCH_DRAIN_TIMEOUT = float(os.environ.get("DISPATCH_DRAIN_TIMEOUT", "5"))
+
+# Human requests: rooms an agent can hold at once, and whether queued
+# requests are handed to the least-loaded agent automatically
+AGENT_MAX_ROOMS = int(os.environ.get("AGENT_MAX_ROOMS", "1"))
+AUTO_ASSIGN = os.environ.get("AUTO_ASSIGN", "1") == "1"
+
+# Admin dashboards get room changes coalesced once per interval (seconds)
+ADMIN_SYNC_INTERVAL = float(os.environ.get("ADMIN_SYNC_INTERVAL", "0.5"))
+CHAT_LIST_PAGE_SIZE = 100
+CHAT_LIST_MAX_PAGE_SIZE = 500
+
+# Session resume: recent events kept per room for replay, and how long a
+# disconnected user or agent has to resume before their session is dropped
+REPLAY_BUFFER_SIZE = int(os.environ.get("REPLAY_BUFFER_SIZE", "64"))
+RESUME_GRACE = float(os.environ.get("RESUME_GRACE", "30"))
+
+# Typing indicators: at most one change per room and direction per
+# interval, and "typing" clears itself if not refreshed within the timeout
+TYPING_INTERVAL = float(os.environ.get("TYPING_INTERVAL_MS", "500")) / 1000
+TYPING_TIMEOUT = float(os.environ.get("TYPING_TIMEOUT", "6"))
+
+# Transcript search: snapshot file (empty to keep the index in memory only)
+# and how often it is rewritten when messages were added. Workers share the
+# file; the backplane leader writes it and every worker loads it.
+SEARCH_INDEX_PATH = os.environ.get("SEARCH_INDEX_PATH", "search_index.pkl")
+SEARCH_SNAPSHOT_INTERVAL = float(os.environ.get("SEARCH_SNAPSHOT_INTERVAL", "300"))
+# Seconds before a snapshot's time from which rooms are re-read at startup
+SEARCH_CATCH_UP_MARGIN = float(os.environ.get("SEARCH_CATCH_UP_MARGIN", "60"))
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Retention: closed rooms idle this long (seconds, 0 to keep them hot) are
+# moved to db.chat_archive with a compressed transcript, at most
+# ARCHIVE_RATE rooms per second
+ARCHIVE_AFTER = float(os.environ.get("ARCHIVE_AFTER", str(7 * 86400)))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "100"))
+ARCHIVE_RATE = float(os.environ.get("ARCHIVE_RATE", "50"))
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "60"))
+ARCHIVE_CODEC = os.environ.get("ARCHIVE_CODEC", DEFAULT_CODEC)
+
+retention = RetentionWorker(
+    db.chat_rooms,
+    db.chat_messages,
+    db.chat_archive,
+    idle_seconds=ARCHIVE_AFTER,
+    batch_size=ARCHIVE_BATCH_SIZE,
+    max_rate=ARCHIVE_RATE,
+    interval=ARCHIVE_INTERVAL,
+    codec=ARCHIVE_CODEC,
+)
+
 # Connection manager
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, backplane=None):
         self.active_connections: Dict[str, WebSocket] = {}
-        self.chat_rooms: Dict[str, Dict[str, Any]] = {}
+        self.chat_rooms = RoomCache(ROOM_CACHE_SIZE, ROOM_IDLE_TTL, CLOSED_ROOM_TTL)
         self.admin_connections: List[WebSocket] = []
         self.agent_connections: Dict[str, WebSocket] = {}
+        self.broadcaster = Broadcaster(SEND_QUEUE_SIZE, SLOW_CONSUMER_POLICY, metrics.observe_send if METRICS_ENABLED else None)
+        self.backplane = backplane or create_backplane()
+        self.scheduler = DispatchScheduler(AGENT_MAX_ROOMS)
+        self.changes = RoomChangeLog(ROOM_CACHE_SIZE)
+        self.synced_seq = 0
+        self.agent_sessions: Dict[str, tuple] = {}
+        self.expiry_tasks: Dict[str, asyncio.Task] = {}
+        self.typing = TypingRelay(self.forward_typing, TYPING_INTERVAL, TYPING_TIMEOUT)
+        self.search = SearchIndex()
+        self.search_leader = False
+        # User commands forwarded by the worker holding the user's socket,
+        # run one at a time per room like that worker's own frames
+        self.remote_commands = ConnectionDispatcher(MAX_IN_FLIGHT_FRAMES)
+        self.ready = False
     
-    async def connect(self, websocket: WebSocket, client_id: str):
+    async def accept(self, websocket: WebSocket):
+        # Every socket writes through its own queue and writer task, in the
+        # wire format asked for on the connect URL. Returns False, with the
+        # socket refused, until startup recovery has finished.
+        if not self.ready:
+            await websocket.close(code=1013)
+            return False
         await websocket.accept()
+        protocol = WireProtocol.negotiate(websocket.query_params)
+        self.broadcaster.register(websocket, protocol)
+        if not protocol.is_default:
+            self.send(websocket, protocol.describe())
+        return True
+    
+    async def release(self, websocket: WebSocket):
+        stats = await self.broadcaster.unregister(websocket)
+        if stats and stats["bytesSaved"]:
+            print(f"Connection closed: {stats['events']} events in {stats['frames']} frames, {stats['bytesSaved']} bytes saved")
+    
+    def send(self, websocket: WebSocket, message: Dict[str, Any], key: str = None):
+        return self.broadcaster.send(websocket, message, key)
+    
+    def send_to_user(self, user_id: str, message: Dict[str, Any], key: str = None):
+        websocket = self.active_connections.get(user_id)
+        if websocket is None:
+            # The user may be connected to another worker
+            self.backplane.publish({"kind": "user", "userId": user_id, "message": message, "key": key})
+            return False
+        return self.send(websocket, message, key)
+    
+    def send_to_agent(self, agent_id: str, message: Dict[str, Any], key: str = None):
+        websocket = self.agent_connections.get(agent_id)
+        if websocket is None:
+            self.backplane.publish({"kind": "agent", "agentId": agent_id, "message": message, "key": key})
+            return False
+        return self.send(websocket, message, key)
+    
+    def emit_to_user(self, room_id: str, message: Dict[str, Any]):
+        # Room events are stamped and buffered so a resumed session can replay them
+        room = self.chat_rooms.peek(room_id) if room_id else None
+        if room is None:
+            return False
+        record_event(room, "user", message, REPLAY_BUFFER_SIZE)
+        return self.send_to_user(room.user_id, message)
+    
+    def emit_to_agent(self, room_id: str, message: Dict[str, Any]):
+        room = self.chat_rooms.peek(room_id) if room_id else None
+        if room is None or room.agent_id is None:
+            return False
+        record_event(room, "agent", message, REPLAY_BUFFER_SIZE)
+        return self.send_to_agent(room.agent_id, message)
+    
+    def forward_typing(self, room_id: str, sender: str, is_typing: bool):
+        # Called by the typing relay; user typing goes to the agent and vice versa
+        room = self.chat_rooms.peek(room_id)
+        if room is None:
+            return
+        message = {
+            "type": "typing",
+            "isTyping": is_typing,
+            "sender": sender,
+            "roomId": room_id
+        }
+        # A queued indicator for the room is replaced rather than piling up
+        key = f"typing:{room_id}"
+        if sender == "user":
+            if room.agent_id:
+                self.send_to_agent(room.agent_id, message, key)
+        else:
+            self.send_to_user(room.user_id, message, key)
+    
+    def broadcast_agents(self, message: Dict[str, Any], exclude: str = None, publish: bool = True):
+        if publish:
+            self.backplane.publish({"kind": "agents", "message": message, "exclude": exclude})
+        websockets = [ws for aid, ws in self.agent_connections.items() if aid != exclude]
+        return self.broadcaster.broadcast(websockets, message)
+    
+    def broadcast_admins(self, message: Dict[str, Any], publish: bool = True):
+        if publish:
+            self.backplane.publish({"kind": "admins", "message": message})
+        return self.broadcaster.broadcast(self.admin_connections, message)
+    
+    def forward_user_command(self, user_id: str, command: Dict[str, Any], session: Dict[str, Any]):
+        # To the worker owning the command's room
+        self.backplane.publish({
+            "kind": "user_command",
+            "target": self.backplane.room_owner(command["roomId"]),
+            "userId": user_id,
+            "command": command,
+            "session": session
+        })
+    
+    def forward_agent_command(self, agent_id: str, command: Dict[str, Any]):
+        self.backplane.publish({
+            "kind": "room_command",
+            "target": self.backplane.room_owner(command["roomId"]),
+            "agentId": agent_id,
+            "command": command
+        })
+    
+    async def handle_backplane_message(self, message: Dict[str, Any]):
+        kind = message.get("kind")
+        
+        if kind == "user":
+            websocket = self.active_connections.get(message["userId"])
+            if websocket is not None:
+                self.send(websocket, message["message"], message.get("key"))
+        
+        elif kind == "agent":
+            websocket = self.agent_connections.get(message["agentId"])
+            if websocket is not None:
+                self.send(websocket, message["message"], message.get("key"))
+        
+        elif kind == "agents":
+            self.broadcast_agents(message["message"], message.get("exclude"), publish=False)
+        
+        elif kind == "admins":
+            self.broadcast_admins(message["message"], publish=False)
+        
+        elif kind == "search_update":
+            self.search.update_room(Room.from_document(message["room"]))
+            if message.get("message"):
+                seq, text = message["message"]
+                self.search.add_message(message["room"]["roomId"], seq, text)
+        
+        elif kind == "search_remove":
+            self.search.remove_room(message["roomId"])
+        
+        elif kind == "room_command" and message.get("target") == self.backplane.worker_id:
+            command = message["command"]
+            if "agentId" not in message and command.get("type") == "delete_chat":
+                # An admin on another worker deleted the room
+                await self.delete_chat(command["roomId"])
+            else:
+                await handle_agent_command(message["agentId"], command)
+        
+        elif kind == "user_command" and message.get("target") == self.backplane.worker_id:
+            command = message["command"]
+            room_id = command.get("roomId")
+            if command.get("type") == "typing":
+                if self.room_field(room_id, "agent_id"):
+                    self.typing.update(room_id, "user", command.get("isTyping", False))
+            else:
+                # Replies go back through the backplane to the user's worker
+                handler = metrics.timed("ws", command.get("type", "message"), handle_user_command)
+                await self.remote_commands.submit(room_id, handler, None, message["userId"], command, message["session"])
+    
+    async def connect(self, websocket: WebSocket, client_id: str):
+        if not await self.accept(websocket):
+            return False
         self.active_connections[client_id] = websocket
+        return True
     
-    def disconnect(self, client_id: str):
+    async def disconnect(self, client_id: str, websocket: WebSocket = None):
+        # A resumed connection may already have taken over this user
+        if websocket is not None and self.active_connections.get(client_id) is not websocket:
+            return
+        self.active_connections.pop(client_id, None)
+        
+        # Agents in a live chat are told right away
+        for room_id, room in self.chat_rooms.rooms_where("user_id", client_id):
+            if room.status == "active" and room.agent_id:
+                self.emit_to_agent(room_id, {
+                    "type": "user_disconnected",
+                    "roomId": room_id
+                })
+        
+        self.expire_later(client_id, self.expire_user)
+    
+    async def expire_user(self, client_id: str):
         if client_id in self.active_connections:
-            del self.active_connections[client_id]
+            return
+        
+        # Requests nobody has taken yet are withdrawn once the user is gone for good
+        for room_id, room in self.chat_rooms.rooms_where("user_id", client_id):
+            if room.status == "pending":
+                await self.end_chat(room_id)
+                self.broadcast_agents({
+                    "type": "request_canceled",
+                    "roomId": room_id
+                })
+    
+    def expire_later(self, key: str, expire):
+        # Runs expire(key) after the resume grace period unless cancel_expiry(key) comes first
+        self.cancel_expiry(key)
+        self.expiry_tasks[key] = asyncio.create_task(self._expire(key, expire))
+    
+    async def _expire(self, key: str, expire):
+        await asyncio.sleep(RESUME_GRACE)
+        self.expiry_tasks.pop(key, None)
+        await expire(key)
+    
+    def cancel_expiry(self, key: str):
+        task = self.expiry_tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
     
     async def connect_admin(self, websocket: WebSocket):
-        await websocket.accept()
+        if not await self.accept(websocket):
+            return False
         self.admin_connections.append(websocket)
+        return True
     
     def disconnect_admin(self, websocket: WebSocket):
         if websocket in self.admin_connections:
             self.admin_connections.remove(websocket)
     
     async def connect_agent(self, websocket: WebSocket, agent_id: str):
-        await websocket.accept()
+        if not await self.accept(websocket):
+            return False
         self.agent_connections[agent_id] = websocket
+        return True
+    
+    def disconnect_agent(self, agent_id: str, websocket: WebSocket = None):
+        if websocket is not None and self.agent_connections.get(agent_id) is not websocket:
+            return
+        self.agent_connections.pop(agent_id, None)
+        self.scheduler.unregister_agent(agent_id)
+        
+        # Rooms stay assigned for the grace period in case the agent resumes
+        self.expire_later(agent_id, self.expire_agent)
     
-    def disconnect_agent(self, agent_id: str):
+    async def expire_agent(self, agent_id: str):
         if agent_id in self.agent_connections:
-            del self.agent_connections[agent_id]
+            return
+        for token, (session_agent_id, _) in list(self.agent_sessions.items()):
+            if session_agent_id == agent_id:
+                del self.agent_sessions[token]
     
-    async def create_chat_room(self, user_id: str, user_name: str, user_email: str = None):
-        room_id = f"room_{uuid.uuid4().hex[:6]}"
-        
-        self.chat_rooms[room_id] = {
-            "userId": user_id,
-            "userName": user_name,
-            "userEmail": user_email,
-            "startTime": datetime.now().isoformat(),
-            "lastActivity": datetime.now().isoformat(),
-            "status": "active",
-            "agentId": None,
-            "agentName": None,
-            "messages": []
+    async def register_agent(self, websocket: WebSocket, agent_id: str, agent_name: str):
+        self.agent_connections[agent_id] = websocket
+        self.scheduler.register_agent(agent_id, agent_name)
+        await self.dispatch_pending()
+    
+    def open_agent_session(self, websocket: WebSocket, agent_id: str, agent_name: str):
+        # The token lets a reconnecting agent take its identity and rooms back
+        resume_token = secrets.token_urlsafe(16)
+        self.agent_sessions[resume_token] = (agent_id, agent_name)
+        self.send(websocket, {
+            "type": "agent_session",
+            "agentId": agent_id,
+            "resumeToken": resume_token
+        })
+    
+    async def replay_room(self, websocket: WebSocket, room: Room, audience: str, last_event_seq: int = None, last_message_seq: int = None):
+        # Missed events come from the room's buffer while it still covers
+        # them; otherwise the client gets the messages stored after its last
+        resumed = {
+            "type": "resumed",
+            "roomId": room.room_id,
+            "status": room.status,
+            "agentName": room.agent_name
         }
+        events = events_since(room, audience, last_event_seq) if isinstance(last_event_seq, int) else None
         
-        # Store in database
-        await db.chat_rooms.insert_one({
-            "roomId": room_id,
-            "userId": user_id,
-            "userName": user_name,
-            "userEmail": user_email,
-            "startTime": datetime.now().isoformat(),
-            "lastActivity": datetime.now().isoformat(),
-            "status": "active",
-            "agentId": None,
-            "agentName": None,
-            "messages": []
+        if events is not None:
+            for event in events:
+                self.send(websocket, event)
+            resumed["eventSeq"] = room.event_seq
+            resumed["replayed"] = len(events)
+        else:
+            end = room.message_count
+            start = last_message_seq + 1 if isinstance(last_message_seq, int) else 0
+            start = max(0, min(start, end))
+            first = max(start, end - HISTORY_MAX_PAGE_SIZE)
+            resumed["messages"] = await self.messages_between(room, first, end)
+            resumed["nextCursor"] = first if first > start else None
+            resumed["hasMore"] = first > start
+        
+        self.send(websocket, resumed)
+    
+    async def resume_user(self, websocket: WebSocket, client_id: str, message_data: Dict[str, Any]):
+        # Returns the user id this connection acts as from now on
+        room_id = message_data["roomId"]
+        room = await self.get_room(room_id)
+        token = message_data["token"].encode()
+        if room is None or not room.resume_token or not secrets.compare_digest(room.resume_token.encode(), token):
+            self.send(websocket, {
+                "type": "resume_failed",
+                "roomId": room_id
+            })
+            return client_id
+        
+        if client_id != room.user_id and self.active_connections.get(client_id) is websocket:
+            del self.active_connections[client_id]
+        self.cancel_expiry(room.user_id)
+        self.active_connections[room.user_id] = websocket
+        
+        await self.replay_room(websocket, room, "user", message_data.get("lastEventSeq"), message_data.get("lastMessageSeq"))
+        if room.status == "active":
+            self.emit_to_agent(room_id, {
+                "type": "user_resumed",
+                "roomId": room_id
+            })
+        return room.user_id
+    
+    async def resume_agent(self, websocket: WebSocket, agent_id: str, message_data: Dict[str, Any]):
+        # Returns the agent id this connection acts as from now on. Rooms
+        # this worker doesn't own fall back to their stored messages.
+        session = self.agent_sessions.get(message_data["token"])
+        if session is None:
+            self.send(websocket, {"type": "resume_failed"})
+            return agent_id
+        
+        resumed_id, agent_name = session
+        self.cancel_expiry(resumed_id)
+        if resumed_id != agent_id and self.agent_connections.get(agent_id) is websocket:
+            self.agent_connections.pop(agent_id, None)
+            self.scheduler.unregister_agent(agent_id)
+        await self.register_agent(websocket, resumed_id, message_data.get("agentName", agent_name))
+        
+        for entry in message_data.get("rooms", []):
+            room_id = entry.get("roomId") if isinstance(entry, dict) else None
+            if not isinstance(room_id, str):
+                continue
+            room = await self.get_room(room_id)
+            if room is None or room.agent_id != resumed_id:
+                self.send(websocket, {
+                    "type": "resume_failed",
+                    "roomId": room_id
+                })
+                continue
+            await self.replay_room(websocket, room, "agent", entry.get("lastEventSeq"), entry.get("lastMessageSeq"))
+        
+        self.send(websocket, {
+            "type": "agent_session",
+            "agentId": resumed_id,
+            "resumeToken": message_data["token"]
         })
+        return resumed_id
+    
+    def room_field(self, room_id: str, field: str):
+        room = self.chat_rooms.get(room_id)
+        return getattr(room, field) if room is not None else None
+    
+    async def get_room(self, room_id: str):
+        # Rooms owned by another worker are read from Mongo without caching
+        # them here; their live state and replay buffer stay with the owner
+        if self.backplane.is_remote(room_id):
+            self.chat_rooms.pop(room_id, None)
+            document = await metrics.mongo("get_room", "find_one", db.chat_rooms.find_one({"roomId": room_id}, {"_id": 0, "messages": 0}))
+            return Room.from_document(document) if document else None
+        
+        room = self.chat_rooms.get(room_id)
+        if room is not None or not room_id:
+            return room
+        
+        # Cache miss: rehydrate from Mongo without the legacy messages array
+        document = await metrics.mongo("get_room", "find_one", db.chat_rooms.find_one({"roomId": room_id}, {"_id": 0, "messages": 0}))
+        if document is None:
+            return None
+        
+        # Another coroutine may have loaded it while we waited
+        cached = self.chat_rooms.peek(room_id)
+        if cached is not None:
+            return cached
         
-        return room_id
+        # Queued appends may not be in Mongo yet
+        room = Room.from_document(document)
+        room.message_count = max(room.message_count, message_writer.unflushed_count(room_id))
+        self.chat_rooms.put(room_id, room)
+        self.chat_rooms.loads += 1
+        return room
     
-    async def add_message(self, room_id: str, message: str, sender: str, agent_name: str = None):
-        if room_id not in self.chat_rooms:
-            return False
+    async def create_chat_room(self, user_id: str, user_name: str, user_email: str = None):
+        # 64 random bits, so ids don't collide at any realistic room count
+        room_id = f"room_{uuid.uuid4().hex[:16]}"
         
-        message_data = {
-            "message": message,
-            "sender": sender,
-            "timestamp": datetime.now().isoformat(),
-            "agentName": agent_name
-        }
+        room = Room(room_id, user_id, user_name, user_email, resume_token=secrets.token_urlsafe(16))
+        self.chat_rooms[room_id] = room
         
-        self.chat_rooms[room_id]["messages"].append(message_data)
-        self.chat_rooms[room_id]["lastActivity"] = datetime.now().isoformat()
+        # Store in database (messages live in db.chat_messages buckets)
+        await metrics.mongo("create_chat_room", "insert_one", db.chat_rooms.insert_one(room.to_document()))
         
-        # Update in database
-        await db.chat_rooms.update_one(
-            {"roomId": room_id},
-            {
-                "$push": {"messages": message_data},
-                "$set": {"lastActivity": datetime.now().isoformat()}
-            }
-        )
+        # This worker owns the room
+        self.backplane.claim_room(room_id)
+        self.note_room_change(room_id, room)
         
-        return True
+        return room
+    
+    async def add_message(self, room_id: str, message: str, sender: str, agent_name: str = None, event: Dict[str, Any] = None):
+        # Returns the stored Message, or None without a room. An event given
+        # here goes to the user with the message's seq, before the write.
+        room = await self.get_room(room_id)
+        if room is None:
+            return None
+        
+        entry = Message(room.message_count, message, sender, agent_name=agent_name)
+        room.message_count += 1
+        room.messages.append(entry)
+        room.last_activity = entry.timestamp
+        self.note_room_change(room_id, room, entry)
+        
+        if event is not None:
+            event["seq"] = entry.seq
+            self.emit_to_user(room_id, event)
+        
+        # Update in database (queued when write-behind is enabled)
+        message_data = entry.to_dict()
+        await metrics.mongo("add_message", "append", message_writer.append(room_id, message_data, message_data["timestamp"]))
+        
+        return entry
     
     async def request_human_agent(self, room_id: str, user_name: str, user_email: str, issue: str):
-        if room_id not in self.chat_rooms:
+        room = await self.get_room(room_id)
+        if room is None:
+            return False
+        
+        # A repeat while the room is queued or has an agent is ignored
+        if room_id in self.scheduler or room.status == "pending" or (room.status == "active" and room.agent_id):
             return False
         
         # Update room status
-        self.chat_rooms[room_id]["status"] = "pending"
+        self.chat_rooms.update(room_id, status="pending")
+        self.note_room_change(room_id, room)
+        
+        # Priority follows the sensitive category of the issue, or of the
+        # user's latest messages when the issue text has none
+        category = await self.detect_sensitive_query(issue)
+        if category is None:
+            for message in reversed(room.messages[-10:]):
+                if message.sender == "user":
+                    category = await self.detect_sensitive_query(message.message)
+                    if category:
+                        break
         
         # Create a human request
         request_data = {
             "roomId": room_id,
-            "userId": self.chat_rooms[room_id]["userId"],
+            "userId": room.user_id,
             "userName": user_name,
             "userEmail": user_email,
             "issue": issue,
             "timestamp": datetime.now().isoformat(),
-            "priority": "medium"  # Default priority
+            "createdAt": time.time(),
+            "category": category,
+            "priority": CATEGORY_PRIORITIES.get(category, "medium")
         }
         
         # Update in database
-        await db.chat_rooms.update_one(
+        await metrics.mongo("request_human_agent", "update_one", db.chat_rooms.update_one(
             {"roomId": room_id},
             {"$set": {"status": "pending"}}
-        )
+        ))
         
-        # Store request in database
-        await db.human_requests.insert_one(request_data)
+        # Store request in database (a copy, so the inserted _id stays out of the broadcast)
+        await metrics.mongo("request_human_agent", "insert_one", db.human_requests.insert_one(dict(request_data)))
+        self.scheduler.add(request_data)
         
-        # Send email notification
+        # Queue email notification
         await self.send_email_notification(user_name, user_email, issue, room_id)
         
         # Notify all agents
-        for agent_id, websocket in self.agent_connections.items():
-            await websocket.send_text(json.dumps({
-                "type": "new_request",
-                "data": request_data
-            }))
+        self.broadcast_agents({
+            "type": "new_request",
+            "data": request_data
+        })
         
         return True
     
+    async def dispatch_pending(self):
+        # Hand queued requests to the least-loaded agents with spare capacity
+        if not AUTO_ASSIGN:
+            return
+        
+        while True:
+            assignment = self.scheduler.next_assignment()
+            if assignment is None:
+                return
+            request, agent_id = assignment
+            room_id = request["roomId"]
+            agent_name = self.scheduler.agent_names.get(agent_id, "Agent")
+            
+            # Every worker loads the stored requests at startup, so the
+            # room's owner serves it, and only after taking the stored
+            # request; a worker that finds it gone lost the race
+            if self.backplane.is_remote(room_id):
+                self.scheduler.release(room_id)
+                continue
+            taken = await metrics.mongo("dispatch_pending", "find_one_and_delete", db.human_requests.find_one_and_delete(
+                {"roomId": room_id}, {"_id": 1}
+            ))
+            if taken is None or not await self.join_room_agent(room_id, agent_id, agent_name):
+                # Served elsewhere, or the room no longer exists
+                self.scheduler.release(room_id)
+                continue
+            
+            self.emit_to_agent(room_id, {
+                "type": "request_assigned",
+                "data": request
+            })
+            self.broadcast_agents({
+                "type": "request_taken",
+                "roomId": room_id,
+                "agentName": agent_name
+            }, exclude=agent_id)
+    
     async def join_room_agent(self, room_id: str, agent_id: str, agent_name: str):
-        if room_id not in self.chat_rooms:
+        room = await self.get_room(room_id)
+        if room is None:
+            return False
+        
+        # Checked and taken without awaiting, so two agents can't both win
+        if not self.scheduler.claim(room_id, agent_id):
             return False
         
         # Update room with agent info
-        self.chat_rooms[room_id]["agentId"] = agent_id
-        self.chat_rooms[room_id]["agentName"] = agent_name
-        self.chat_rooms[room_id]["status"] = "active"
+        self.chat_rooms.update(room_id, agent_id=agent_id, agent_name=agent_name, status="active")
+        self.note_room_change(room_id, room)
         
         # Update in database
-        await db.chat_rooms.update_one(
+        await metrics.mongo("join_room_agent", "update_one", db.chat_rooms.update_one(
             {"roomId": room_id},
             {
                 "$set": {
@@ -200,86 +792,314 @@ class ConnectionManager:
                     "status": "active"
                 }
             }
-        )
+        ))
         
         # Delete from human requests
-        await db.human_requests.delete_one({"roomId": room_id})
+        await metrics.mongo("join_room_agent", "delete_one", db.human_requests.delete_one({"roomId": room_id}))
         
         # Notify user
-        user_id = self.chat_rooms[room_id]["userId"]
-        if user_id in self.active_connections:
-            await self.active_connections[user_id].send_text(json.dumps({
-                "type": "human_joined",
-                "agentName": agent_name,
-                "roomId": room_id
-            }))
+        self.emit_to_user(room_id, {
+            "type": "human_joined",
+            "agentName": agent_name,
+            "roomId": room_id
+        })
         
         return True
     
-    async def get_chat_history(self, room_id: str):
-        if room_id not in self.chat_rooms:
+    async def get_chat_history(self, room_id: str, before: int = None, limit: int = HISTORY_PAGE_SIZE):
+        # Returns the page of messages ending just before the `before` cursor
+        # (the tail when no cursor is given); nextCursor pages further back
+        room = await self.get_room(room_id)
+        if room is None:
+            return await self.get_archived_history(room_id, before, limit)
+        
+        message_count = room.message_count
+        limit = max(1, min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE))
+        end = message_count if before is None else max(0, min(before, message_count))
+        start = max(0, end - limit)
+        messages = await self.messages_between(room, start, end)
+        
+        return {
+            "roomId": room_id,
+            "userName": room.user_name,
+            "userEmail": room.user_email,
+            "startTime": to_iso(room.start_time),
+            "messages": messages,
+            "messageCount": message_count,
+            "nextCursor": start if start > 0 else None,
+            "hasMore": start > 0
+        }
+    
+    async def get_archived_history(self, room_id: str, before: int = None, limit: int = HISTORY_PAGE_SIZE):
+        # Same page shape as get_chat_history, read from the archive tier
+        archived = await metrics.mongo("get_archived_history", "load_archive", retention.load(room_id))
+        if archived is None:
             return None
+        document, messages = archived
+        
+        message_count = len(messages)
+        limit = max(1, min(limit or HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE))
+        end = message_count if before is None else max(0, min(before, message_count))
+        start = max(0, end - limit)
         
         return {
             "roomId": room_id,
-            "userName": self.chat_rooms[room_id]["userName"],
-            "userEmail": self.chat_rooms[room_id]["userEmail"],
-            "startTime": self.chat_rooms[room_id]["startTime"],
-            "messages": self.chat_rooms[room_id]["messages"]
+            "userName": document.get("userName"),
+            "userEmail": document.get("userEmail"),
+            "startTime": document.get("startTime"),
+            "messages": messages[start:end],
+            "messageCount": message_count,
+            "nextCursor": start if start > 0 else None,
+            "hasMore": start > 0,
+            "archived": True
         }
     
-    async def get_pending_requests(self):
-        # Get from database
-        requests = await db.human_requests.find().to_list(length=100)
+    async def messages_between(self, room: Room, start: int, end: int):
+        # room.messages holds the tail added since the room was loaded
+        loaded_from = room.message_count - len(room.messages)
+        if start >= loaded_from:
+            return [message.to_dict() for message in room.messages[start - loaded_from:end - loaded_from]]
+        return await self.load_messages(room.room_id, start, end)
+    
+    async def load_messages(self, room_id: str, start: int, end: int):
+        # Fetch messages [start, end) from the buckets covering that range
+        if start >= end:
+            return []
         
-        # Convert ObjectId to string
-        for request in requests:
-            if "_id" in request:
-                request["_id"] = str(request["_id"])
+        started = metrics.clock()
+        cursor = db.chat_messages.find(
+            {"roomId": room_id, "bucket": {"$gte": bucket_for(start), "$lte": bucket_for(end - 1)}},
+            {"_id": 0, "messages": 1}
+        )
+        messages = []
+        async for bucket in cursor:
+            messages.extend(m for m in bucket["messages"] if start <= m["seq"] < end)
+        metrics.observe_mongo("load_messages", "find", started)
         
-        return requests
+        messages.sort(key=lambda m: m["seq"])
+        return messages
     
-    async def get_chat_rooms(self):
-        rooms = []
+    async def get_pending_requests(self, limit: int = 100, offset: int = 0):
+        # Highest priority and longest waiting first
+        return self.scheduler.pending(limit, offset)
+    
+    async def ensure_indexes(self):
+        # Every roomId lookup, and the recovery query below, stays off a
+        # collection scan. The unique index goes on its own: duplicate ids
+        # already stored make it fail, and that must not cost the others.
+        try:
+            await db.chat_rooms.create_index("roomId", unique=True)
+        except Exception as e:
+            print(f"Room id index error (duplicate room ids stored?): {e}")
+        try:
+            await db.chat_rooms.create_indexes([
+                IndexModel([("status", 1), ("lastActivity", -1)]),
+                IndexModel([("lastActivity", -1)]),
+                IndexModel([("agentId", 1)]),
+                # Transcript exports stream rooms in this order
+                IndexModel([("startTime", 1), ("roomId", 1)])
+            ])
+            await db.human_requests.create_index("roomId")
+        except Exception as e:
+            print(f"Room index error: {e}")
+    
+    async def recover_rooms(self):
+        # Loads the most recently active open rooms, up to the cache size,
+        # through one batched cursor without message bodies. Returns the count.
+        cursor = db.chat_rooms.find(
+            {"status": {"$in": ["active", "pending"]}},
+            {"_id": 0, "messages": 0}
+        ).sort("lastActivity", -1).limit(ROOM_CACHE_SIZE).batch_size(ROOM_RECOVERY_BATCH)
+        rooms = [Room.from_document(document) async for document in cursor]
         
-        for room_id, room in self.chat_rooms.items():
-            rooms.append({
-                "roomId": room_id,
-                "userId": room["userId"],
-                "userName": room["userName"],
-                "userEmail": room["userEmail"],
-                "startTime": room["startTime"],
-                "lastActivity": room["lastActivity"],
-                "status": room["status"],
-                "agentName": room["agentName"]
-            })
+        # Oldest first, so the most recent rooms end up hottest in the cache
+        restored = 0
+        for room in reversed(rooms):
+            if self.chat_rooms.peek(room.room_id) is None:
+                self.chat_rooms.put(room.room_id, room)
+                self.backplane.claim_room(room.room_id)
+                restored += 1
+        return restored
+    
+    async def load_pending_requests(self):
+        # Rebuild the dispatch queue from requests persisted before a restart
+        async for request in db.human_requests.find({}, {"_id": 0}):
+            request.setdefault("priority", "medium")
+            self.scheduler.add(request)
+    
+    def note_room_change(self, room_id: str, room: Room, entry: Message = None):
+        # Summaries are built when the change is sent, once per tick
+        self.changes.record(room_id, room)
+        self.index_room(room, entry)
+    
+    def index_room(self, room: Room, entry: Message = None):
+        # Every worker indexes every room, so a search sees the same rooms
+        # whichever worker runs it; the owner passes its changes on
+        self.search.update_room(room)
+        if entry is not None:
+            self.search.add_message(room.room_id, entry.seq, entry.message)
+        document = room.to_document()
+        document.pop("resumeToken", None)
+        self.backplane.publish({
+            "kind": "search_update",
+            "room": document,
+            "message": [entry.seq, entry.message] if entry is not None else None
+        })
+    
+    async def load_search_index(self):
+        query = {}
+        if SEARCH_INDEX_PATH:
+            index = await asyncio.to_thread(SearchIndex.load, SEARCH_INDEX_PATH)
+            if index is not None:
+                self.search = index
+                # Only rooms active since the snapshot can have new messages;
+                # the margin covers clock skew between workers
+                query = {"lastActivity": {"$gte": to_iso(index.saved_at - SEARCH_CATCH_UP_MARGIN)}}
         
+        # Rooms and messages stored since the snapshot (everything without one)
+        added = 0
+        async for document in db.chat_rooms.find(query, {"_id": 0, "messages": 0}):
+            room = self.chat_rooms.peek(document["roomId"]) or Room.from_document(document)
+            self.search.update_room(room)
+            start = self.search.indexed_count(room.room_id)
+            if room.message_count > start:
+                for message in await self.load_messages(room.room_id, start, room.message_count):
+                    added += self.search.add_message(room.room_id, message["seq"], message["message"])
+        print(f"Search index: {len(self.search)} documents, {added} added from the database")
+    
+    async def save_search_index(self):
+        # Copied here, pickled and written off the event loop. Every worker
+        # holds the same index, so only the leader writes the shared file,
+        # and a worker that just became leader starts with a full snapshot.
+        if not SEARCH_INDEX_PATH:
+            return
+        if not self.backplane.is_leader:
+            self.search_leader = False
+            return
+        if not self.search_leader:
+            self.search_leader = True
+            self.search.snapshot_failed()
+        if not self.search.changed:
+            return
+        state = self.search.snapshot()
+        try:
+            await asyncio.to_thread(SearchIndex.write_snapshot, state, SEARCH_INDEX_PATH)
+        except OSError as e:
+            self.search.snapshot_failed()
+            print(f"Search index snapshot error: {e}")
+    
+    async def snapshot_search_index(self):
+        while True:
+            await asyncio.sleep(SEARCH_SNAPSHOT_INTERVAL)
+            await self.save_search_index()
+    
+    async def count_rooms(self, status: str = None):
+        query = {"status": status} if status else {}
+        return await metrics.mongo("count_rooms", "count_documents", db.chat_rooms.count_documents(query))
+    
+    async def get_chat_rooms(self, limit: int = CHAT_LIST_PAGE_SIZE, offset: int = 0, status: str = None):
+        # One page of rooms, most recently active first, optionally of one
+        # status. Paged from Mongo so rooms the cache let go of (closed ones
+        # after CLOSED_ROOM_TTL) stay listed; cached rooms are the fresher copy.
+        limit = max(1, min(limit or CHAT_LIST_PAGE_SIZE, CHAT_LIST_MAX_PAGE_SIZE))
+        offset = max(0, offset or 0)
+        query = {"status": status} if status else {}
+        
+        started = metrics.clock()
+        cursor = db.chat_rooms.find(query, {"_id": 0, "messages": 0}).sort("lastActivity", -1).skip(offset).limit(limit)
+        rooms = []
+        async for document in cursor:
+            room = self.chat_rooms.peek(document["roomId"]) or Room.from_document(document)
+            rooms.append(room.summary())
+        metrics.observe_mongo("get_chat_rooms", "find", started)
         return rooms
     
+    def changes_since(self, cursor: int, epoch: str = None):
+        changes = self.changes.since(cursor, epoch)
+        if changes is None:
+            return None
+        return {
+            "type": "chat_delta",
+            "worker": self.backplane.worker_id,
+            "epoch": self.changes.epoch,
+            "since": cursor,
+            "cursor": self.changes.seq,
+            "changes": [room.summary() for room in changes]
+        }
+    
+    async def sync_admins(self):
+        # Push room changes to admins, at most one update per room per tick
+        while True:
+            await asyncio.sleep(ADMIN_SYNC_INTERVAL)
+            if self.changes.seq == self.synced_seq:
+                continue
+            delta = self.changes_since(self.synced_seq)
+            self.synced_seq = self.changes.seq
+            if delta is not None:
+                self.broadcast_admins(delta)
+    
     async def end_chat(self, room_id: str):
-        if room_id not in self.chat_rooms:
+        room = await self.get_room(room_id)
+        if room is None:
             return False
         
-        # Update room status
-        self.chat_rooms[room_id]["status"] = "closed"
+        # Update room status (closed rooms are evicted first)
+        self.chat_rooms.update(room_id, status="closed")
+        self.note_room_change(room_id, room)
         
         # Update in database
-        await db.chat_rooms.update_one(
+        await metrics.mongo("end_chat", "update_one", db.chat_rooms.update_one(
             {"roomId": room_id},
             {"$set": {"status": "closed"}}
-        )
+        ))
+        
+        # Free the agent's slot (or drop the request if nobody took it yet)
+        self.typing.drop(room_id)
+        self.scheduler.release(room_id)
+        if self.scheduler.remove(room_id) is not None:
+            await metrics.mongo("end_chat", "delete_one", db.human_requests.delete_one({"roomId": room_id}))
+        await self.dispatch_pending()
         
         return True
     
-    async def detect_sensitive_query(self, query: str):
-        query_lower = query.lower()
+    async def delete_chat(self, room_id: str):
+        # Removes a closed or archived room everywhere: hot collections,
+        # archive, room cache and search index. Open rooms are refused.
+        room = await self.get_room(room_id)
+        if room is not None and room.status != "closed":
+            return False
         
-        for category, keywords in SENSITIVE_CATEGORIES.items():
-            for keyword in keywords:
-                if keyword in query_lower:
-                    return category
+        result = await metrics.mongo("delete_chat", "delete_one", db.chat_rooms.delete_one({"roomId": room_id}))
+        await metrics.mongo("delete_chat", "delete_many", db.chat_messages.delete_many({"roomId": room_id}))
+        archived = await metrics.mongo("delete_chat", "delete_archive", retention.delete(room_id))
         
-        return None
+        self.chat_rooms.pop(room_id, None)
+        self.search.remove_room(room_id)
+        self.backplane.publish({"kind": "search_remove", "roomId": room_id})
+        if self.backplane.is_remote(room_id):
+            # The owner drops its live copy and gives the room up
+            self.backplane.publish({
+                "kind": "room_command",
+                "target": self.backplane.room_owner(room_id),
+                "command": {"type": "delete_chat", "roomId": room_id}
+            })
+        else:
+            self.backplane.release_room(room_id)
+        return result.deleted_count > 0 or archived
+    
+    def forget_rooms(self, room_ids: List[str]):
+        # Archived rooms leave the cache; history is read from the archive
+        for room_id in room_ids:
+            self.chat_rooms.pop(room_id, None)
+            if not self.backplane.is_remote(room_id):
+                self.backplane.release_room(room_id)
+    
+    async def detect_sensitive_query(self, query: str):
+        return sensitive_matcher.first_category(query)
+    
+    async def match_sensitive_query(self, query: str):
+        # Every matching category with its (start, end) offsets
+        return sensitive_matcher.match(query)
     
     async def send_email_notification(self, user_name: str, user_email: str, issue: str, room_id: str):
         subject = f"New Support Request: {user_name}"
@@ -295,211 +1115,520 @@ class ConnectionManager:
         Please log in to the agent portal to assist this user.
         """
         
-        msg = MIMEText(body)
-        msg["Subject"] = subject
-        msg["From"] = ALERT_EMAIL
-        msg["To"] = COMPANY_EMAIL
-        
-        try:
-            with smtplib.SMTP("smtp.gmail.com", 587) as server:
-                server.starttls()
-                server.login(ALERT_EMAIL, ALERT_PASSWORD)
-                server.sendmail(ALERT_EMAIL, COMPANY_EMAIL, msg.as_string())
-                return True
-        except Exception as e:
-            print(f"Email send error: {e}")
-            return False
+        # Queue only; the outbox worker does the SMTP round trips
+        email_outbox.enqueue(subject, body)
+        return True
 
 # Create connection manager instance
 manager = ConnectionManager()
 
+# Gauges are read when /metrics is scraped, so they cost nothing in between
+metrics.gauge("chat_connections", "Open websocket connections by role.", lambda: {
+    "user": len(manager.active_connections),
+    "agent": len(manager.agent_connections),
+    "admin": len(manager.admin_connections)
+}, label="role")
+metrics.gauge("chat_rooms", "Rooms held in memory by status.", lambda: manager.chat_rooms.index.status_counts(), label="status")
+metrics.gauge("chat_pending_requests", "Human requests waiting for an agent.", lambda: len(manager.scheduler))
+metrics.gauge("chat_send_queue_dropped_total", "Outgoing events dropped by slow-consumer policies.",
+              manager.broadcaster.dropped_total, kind="counter")
+metrics.gauge("chat_email_outbox_depth", "Notification emails waiting to be sent.", email_outbox.pending_count)
+metrics.gauge("chat_emails_total", "Notification emails by outcome.", lambda: {
+    "sent": email_outbox.sent,
+    "failed": email_outbox.failed,
+    "dropped": email_outbox.dropped
+}, label="outcome", kind="counter")
+metrics.gauge("chat_message_writes_unflushed", "Message appends queued by the write-behind writer.", message_writer.pending_count)
+metrics.gauge("chat_rooms_archived_total", "Closed rooms moved to the archive tier.", lambda: retention.archived, kind="counter")
+metrics.gauge("chat_event_loop_lag_last_seconds", "Most recent event-loop lag sample.", lambda: metrics.last_loop_lag)
+
+async def stop_backplane():
+    await manager.remote_commands.drain(DISPATCH_DRAIN_TIMEOUT)
+    await manager.backplane.close()
+
+async def recover_rooms():
+    # Indexes first, then inline messages of pre-bucketing rooms moved to
+    # buckets, then open rooms
+    started = time.perf_counter()
+    await manager.ensure_indexes()
+    migrated = await message_writer.migrate_inline()
+    if migrated:
+        print(f"Moved inline messages of {migrated} rooms into buckets")
+    indexed = time.perf_counter()
+    restored = await manager.recover_rooms() if ROOM_RECOVERY else 0
+    app.state.startup = {
+        "indexSeconds": round(indexed - started, 3),
+        "recoverySeconds": round(time.perf_counter() - indexed, 3),
+        "roomsRestored": restored,
+        "roomsMigrated": migrated
+    }
+    print(f"Recovered {restored} open rooms in {time.perf_counter() - indexed:.2f}s (indexes {indexed - started:.2f}s)")
+
+async def save_search_index(search_snapshots: asyncio.Task):
+    search_snapshots.cancel()
+    await manager.save_search_index()
+
+# Bot replies: "gpt2" (or another causal LM name) for server-side
+# generation, "simulated" for the canned response
+BOT_ENGINE = os.environ.get("BOT_ENGINE", "gpt2")
+bot_engine = create_engine(
+    BOT_ENGINE,
+    max_batch_size=int(os.environ.get("BOT_MAX_BATCH_SIZE", "8")),
+    max_wait=float(os.environ.get("BOT_MAX_WAIT_MS", "20")) / 1000,
+    max_new_tokens=int(os.environ.get("BOT_MAX_NEW_TOKENS", "60")),
+    workers=int(os.environ.get("BOT_WORKERS", "1")),
+)
+
+# Bot replies keyed on the normalized query; the near-duplicate tier is opt-in
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("RESPONSE_CACHE_SIZE", "5000")),
+    ttl=float(os.environ.get("RESPONSE_CACHE_TTL", "3600")),
+    near_duplicates=os.environ.get("RESPONSE_CACHE_NEAR_DUPLICATES", "0") == "1",
+)
+
+def reply_to_user(websocket: Optional[WebSocket], client_id: str, message: Dict[str, Any]):
+    # Commands forwarded from another worker have no local socket; their
+    # replies go back through the backplane
+    if websocket is None:
+        return manager.send_to_user(client_id, message)
+    return manager.send(websocket, message)
+
+async def generate_bot_reply(websocket: Optional[WebSocket], client_id: str, room_id: str, message: str, stream_tokens: bool = False):
+    # Streaming clients get each token as a partial message event; the
+    # caller sends the complete reply, under the same messageId, once stored
+    message_id = uuid.uuid4().hex[:8]
+    parts = []
+    
+    response = response_cache.get(message)
+    if response is not None:
+        return response, message_id
+    
+    started = time.perf_counter()
+    try:
+        async for piece in bot_engine.stream(message):
+            parts.append(piece)
+            if stream_tokens:
+                reply_to_user(websocket, client_id, {
+                    "type": "message",
+                    "message": piece,
+                    "sender": "bot",
+                    "partial": True,
+                    "messageId": message_id,
+                    "roomId": room_id
+                })
+        response = "".join(parts).strip()
+    except Exception as e:
+        print(f"Bot reply error: {e}")
+        response = ""
+    
+    if response:
+        response_cache.put(message, response, time.perf_counter() - started)
+    else:
+        response = "I'm not able to generate a response right now. Please try again later."
+    
+    return response, message_id
+
+# User frames other than typing. They run on the connection's dispatcher,
+# one at a time per room, or on the room owner's worker without a websocket.
+async def handle_user_command(websocket: Optional[WebSocket], client_id: str, message_data: Dict[str, Any], session: Dict[str, Any]):
+    message_type = message_data.get("type", "message")
+    
+    if message_type == "join_room":
+        user_name = message_data.get("userName", "Anonymous")
+        user_email = message_data.get("userEmail")
+        session["streamTokens"] = bool(message_data.get("streamTokens", False))
+        
+        # Create a new chat room
+        room = await manager.create_chat_room(client_id, user_name, user_email)
+        
+        # Add user to the room
+        manager.active_connections[client_id] = websocket
+        
+        # Send room ID to the client (admins see the room in the next chat_delta),
+        # with what it needs to resume the room after a dropped connection
+        manager.send(websocket, {
+            "type": "room_created",
+            "roomId": room.room_id,
+            "resumeToken": room.resume_token,
+            "eventSeq": room.event_seq
+        })
+    
+    elif message_type == "message":
+        room_id = message_data.get("roomId")
+        message = message_data.get("message", "")
+        sender = message_data.get("sender", "user")
+        manager.typing.clear(room_id, "user")
+        
+        # Check for sensitive content
+        category = await manager.detect_sensitive_query(message)
+        
+        if category and sender == "user":
+            # Add message to the room
+            await manager.add_message(room_id, message, sender)
+            
+            # Send response to the client
+            response = "I can't provide a response. I will connect you with a human agent regarding the query."
+            refusal = {
+                "type": "message",
+                "message": response,
+                "sender": "bot",
+                "timestamp": datetime.now().isoformat(),
+                "roomId": room_id
+            }
+            if not manager.emit_to_user(room_id, refusal):
+                reply_to_user(websocket, client_id, refusal)
+        elif sender == "user":
+            # Store the message while the reply is generated; its seq is
+            # taken before the bot reply is added
+            stored = asyncio.create_task(manager.add_message(room_id, message, sender))
+            response, message_id = await generate_bot_reply(websocket, client_id, room_id, message, session["streamTokens"])
+            await stored
+            reply = {
+                "type": "message",
+                "message": response,
+                "sender": "bot",
+                "timestamp": datetime.now().isoformat(),
+                "messageId": message_id,
+                "roomId": room_id
+            }
+            if await manager.add_message(room_id, response, "bot", event=reply) is None:
+                reply_to_user(websocket, client_id, reply)
+        else:
+            # Add message to the room
+            await manager.add_message(room_id, message, sender)
+    
+    elif message_type == "request_human":
+        room_id = message_data.get("roomId")
+        user_name = message_data.get("userName", "Anonymous")
+        user_email = message_data.get("userEmail", "")
+        issue = message_data.get("issue", "No issue specified")
+        
+        # Request a human agent
+        success = await manager.request_human_agent(room_id, user_name, user_email, issue)
+        
+        if success:
+            # Notify the client
+            manager.emit_to_user(room_id, {
+                "type": "human_requested",
+                "roomId": room_id
+            })
+            
+            # Add system message
+            await manager.add_message(room_id, "Human agent requested", "system")
+            
+            # Assign an available agent, if any
+            await manager.dispatch_pending()
+
+async def receive_frame(websocket: WebSocket):
+    # Text frames are JSON; binary frames are MessagePack
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    text = message.get("text")
+    return text if text is not None else message.get("bytes")
+
+async def reject_frame(websocket: WebSocket, error: FrameError):
+    # Oversized frames close the socket; other bad frames get an error event
+    if error.close_code is not None:
+        await websocket.close(code=error.close_code)
+        raise WebSocketDisconnect(error.close_code)
+    manager.send(websocket, {
+        "type": "error",
+        "message": str(error)
+    })
+
 # WebSocket route for users
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+    if not await manager.accept(websocket):
+        return
     client_id = str(uuid.uuid4())
+    session = {"streamTokens": False}
+    dispatcher = ConnectionDispatcher(MAX_IN_FLIGHT_FRAMES)
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            message_type = message_data.get("type", "message")
+            data = await receive_frame(websocket)
+            try:
+                message_data = decode(data, USER_EVENTS)
+            except FrameError as e:
+                await reject_frame(websocket, e)
+                continue
+            message_type = message_data["type"]
+            started = metrics.clock()
             
-            if message_type == "join_room":
-                user_name = message_data.get("userName", "Anonymous")
-                user_email = message_data.get("userEmail")
-                
-                # Create a new chat room
-                room_id = await manager.create_chat_room(client_id, user_name, user_email)
-                
-                # Add user to the room
-                manager.active_connections[client_id] = websocket
-                
-                # Send room ID to the client
-                await websocket.send_text(json.dumps({
-                    "type": "room_created",
-                    "roomId": room_id
-                }))
-                
-                # Notify admin about new chat room
-                for admin in manager.admin_connections:
-                    try:
-                        await admin.send_text(json.dumps({
-                            "type": "new_chat_room",
-                            "data": {
-                                "roomId": room_id,
-                                "userId": client_id,
-                                "userName": user_name,
-                                "userEmail": user_email,
-                                "startTime": datetime.now().isoformat(),
-                                "lastActivity": datetime.now().isoformat(),
-                                "status": "active"
-                            }
-                        }))
-                    except:
-                        pass
+            if message_type == "resume":
+                # Handled inline so later frames act as the resumed user
+                client_id = await manager.resume_user(websocket, client_id, message_data)
             
-            elif message_type == "message":
-                room_id = message_data.get("roomId")
-                message = message_data.get("message", "")
-                sender = message_data.get("sender", "user")
-                
-                # Check for sensitive content
-                category = await manager.detect_sensitive_query(message)
-                
-                if category and sender == "user":
-                    # Add message to the room
-                    await manager.add_message(room_id, message, sender)
-                    
-                    # Send response to the client
-                    response = "I can't provide a response. I will connect you with a human agent regarding the query."
-                    await websocket.send_text(json.dumps({
-                        "type": "message",
-                        "message": response,
-                        "sender": "bot",
-                        "timestamp": datetime.now().isoformat(),
-                        "roomId": room_id
-                    }))
-                else:
-                    # Add message to the room
-                    await manager.add_message(room_id, message, sender)
-                    
-                    if sender == "user":
-                        # Simulate bot response (this would be replaced with actual chatbot logic)
-                        response = f"This is a simulated response to: {message}"
-                        
-                        # Add bot response to the room
-                        await manager.add_message(room_id, response, "bot")
-                        
-                        # Send response to the client with a delay to simulate typing
-                        await asyncio.sleep(1)
-                        await websocket.send_text(json.dumps({
-                            "type": "message",
-                            "message": response,
-                            "sender": "bot",
-                            "timestamp": datetime.now().isoformat(),
-                            "roomId": room_id
-                        }))
+            elif manager.backplane.is_remote(message_data.get("roomId")):
+                # Rooms owned by another worker are handled there, in order,
+                # so message seqs come from the one live copy of the room
+                manager.forward_user_command(client_id, message_data, session)
             
             elif message_type == "typing":
                 room_id = message_data.get("roomId")
                 is_typing = message_data.get("isTyping", False)
                 
-                # Forward typing indicator to agents
-                agent_id = manager.chat_rooms.get(room_id, {}).get("agentId")
-                if agent_id and agent_id in manager.agent_connections:
-                    await manager.agent_connections[agent_id].send_text(json.dumps({
-                        "type": "typing",
-                        "isTyping": is_typing,
-                        "sender": "user",
-                        "roomId": room_id
-                    }))
+                # Forward typing indicator to agents through the relay (no I/O, so handled inline)
+                if manager.room_field(room_id, "agent_id"):
+                    manager.typing.update(room_id, "user", is_typing)
             
-            elif message_type == "request_human":
-                room_id = message_data.get("roomId")
-                user_name = message_data.get("userName", "Anonymous")
-                user_email = message_data.get("userEmail", "")
-                issue = message_data.get("issue", "No issue specified")
-                
-                # Request a human agent
-                success = await manager.request_human_agent(room_id, user_name, user_email, issue)
-                
-                if success:
-                    # Notify the client
-                    await websocket.send_text(json.dumps({
-                        "type": "human_requested",
-                        "roomId": room_id
-                    }))
-                    
-                    # Add system message
-                    await manager.add_message(room_id, "Human agent requested", "system")
+            else:
+                # Timed when the dispatcher runs it, not while it is queued
+                handler = metrics.timed("ws", message_type, handle_user_command)
+                await dispatcher.submit(message_data.get("roomId"), handler, websocket, client_id, message_data, session)
+                continue
+            
+            metrics.observe_handler("ws", message_type, started)
     
     except WebSocketDisconnect:
         # Handle disconnection
-        manager.disconnect(client_id)
+        await manager.disconnect(client_id, websocket)
         print(f"Client #{client_id} disconnected")
+    finally:
+        # Frames already received still run, so a sent message is not lost
+        await dispatcher.drain(DISPATCH_DRAIN_TIMEOUT)
+        await manager.release(websocket)
+
+async def send_search_results(websocket: WebSocket, message_data: Dict[str, Any]):
+    # Ranked rooms matching the query's terms and "quoted phrases"
+    query = message_data["query"]
+    limit = max(1, min(message_data.get("limit", SEARCH_PAGE_SIZE), SEARCH_MAX_PAGE_SIZE))
+    offset = max(0, message_data.get("offset", 0))
+    try:
+        start = from_iso(message_data["start"]) if "start" in message_data else None
+        end = from_iso(message_data["end"]) if "end" in message_data else None
+    except ValueError:
+        manager.send(websocket, {
+            "type": "error",
+            "message": "invalid date"
+        })
+        return
+    
+    total, results = manager.search.search(query, message_data.get("status"), start, end, limit, offset)
+    manager.send(websocket, {
+        "type": "search_results",
+        "query": query,
+        "results": results,
+        "offset": offset,
+        "total": total
+    })
+
+async def send_chat_list(websocket: WebSocket, limit: int = CHAT_LIST_PAGE_SIZE, offset: int = 0, status: str = None):
+    # Snapshot page; chat_delta events with a later cursor apply on top of it
+    cursor = manager.changes.seq
+    chat_rooms = await manager.get_chat_rooms(limit, offset, status)
+    manager.send(websocket, {
+        "type": "chat_list",
+        "chats": chat_rooms,
+        "offset": offset or 0,
+        "status": status,
+        "total": await manager.count_rooms(status),
+        "worker": manager.backplane.worker_id,
+        "epoch": manager.changes.epoch,
+        "cursor": cursor
+    })
 
 # WebSocket route for admin
 @app.websocket("/admin")
 async def admin_websocket(websocket: WebSocket):
-    await manager.connect_admin(websocket)
+    if not await manager.connect_admin(websocket):
+        return
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            message_type = message_data.get("type", "message")
+            data = await receive_frame(websocket)
+            try:
+                message_data = decode(data, ADMIN_EVENTS)
+            except FrameError as e:
+                await reject_frame(websocket, e)
+                continue
+            message_type = message_data["type"]
+            started = metrics.clock()
             
             if message_type == "admin_auth":
                 token = message_data.get("token")
                 
                 # In a real application, validate the token
                 
-                # Send chat list to admin
-                chat_rooms = await manager.get_chat_rooms()
-                await websocket.send_text(json.dumps({
-                    "type": "chat_list",
-                    "chats": chat_rooms
-                }))
+                # A reconnecting admin with a recent cursor from this worker's
+                # change log only needs the changes
+                since = message_data.get("since")
+                epoch = message_data.get("epoch")
+                delta = manager.changes_since(since, epoch) if isinstance(since, int) and epoch else None
+                if delta is not None:
+                    manager.send(websocket, delta)
+                else:
+                    await send_chat_list(websocket)
+            
+            elif message_type == "get_chat_list":
+                await send_chat_list(websocket, message_data.get("limit"), message_data.get("offset"), message_data.get("status"))
             
             elif message_type == "get_transcript":
                 room_id = message_data.get("roomId")
+                before = message_data.get("before")
+                limit = message_data.get("limit", HISTORY_PAGE_SIZE)
                 
-                # Get chat history
-                chat_history = await manager.get_chat_history(room_id)
+                # Get one page of chat history
+                chat_history = await manager.get_chat_history(room_id, before, limit)
                 
                 if chat_history:
-                    await websocket.send_text(json.dumps({
+                    manager.send(websocket, {
                         "type": "chat_transcript",
                         "data": chat_history
-                    }))
+                    })
+            
+            elif message_type == "search":
+                await send_search_results(websocket, message_data)
+            
+            elif message_type == "invalidate_responses":
+                terms = message_data.get("terms")
+                
+                # Drop cached bot replies mentioning any of the terms, or all of them
+                if terms:
+                    invalidated = response_cache.invalidate_containing(terms)
+                else:
+                    invalidated = response_cache.clear()
+                
+                manager.send(websocket, {
+                    "type": "responses_invalidated",
+                    "count": invalidated
+                })
             
             elif message_type == "delete_chat":
                 room_id = message_data.get("roomId")
                 
-                # In a real application, delete the chat from database
-                
-                # Notify admin
-                await websocket.send_text(json.dumps({
-                    "type": "chat_deleted",
-                    "roomId": room_id
-                }))
+                # Delete the chat from the database and archive
+                if await manager.delete_chat(room_id):
+                    # Notify every admin dashboard
+                    manager.broadcast_admins({
+                        "type": "chat_deleted",
+                        "roomId": room_id
+                    })
+                else:
+                    manager.send(websocket, {
+                        "type": "error",
+                        "message": "Only closed chats can be deleted"
+                    })
+            
+            metrics.observe_handler("admin", message_type, started)
     
     except WebSocketDisconnect:
         manager.disconnect_admin(websocket)
         print("Admin disconnected")
+    finally:
+        await manager.release(websocket)
+
+# Agent commands that act on a room. They run on the worker that owns the
+# room; replies go through send_to_agent so they reach the agent's worker.
+async def handle_agent_command(agent_id: str, message_data: Dict[str, Any]):
+    message_type = message_data.get("type", "message")
+    
+    if message_type == "join_room_agent":
+        room_id = message_data.get("roomId")
+        agent_name = message_data.get("agentName", "Agent")
+        
+        # Agent joins the room
+        success = await manager.join_room_agent(room_id, agent_id, agent_name)
+        
+        if success:
+            # Notify other agents
+            manager.broadcast_agents({
+                "type": "request_taken",
+                "roomId": room_id,
+                "agentName": agent_name
+            }, exclude=agent_id)
+        else:
+            # Another agent claimed it first
+            manager.send_to_agent(agent_id, {
+                "type": "request_unavailable",
+                "roomId": room_id
+            })
+    
+    elif message_type == "message":
+        room_id = message_data.get("roomId")
+        message = message_data.get("message", "")
+        sender = message_data.get("sender", "human")
+        agent_name = message_data.get("agentName", "Agent")
+        manager.typing.clear(room_id, "human")
+        
+        # Add message to the room and forward it to the user
+        await manager.add_message(room_id, message, sender, agent_name, event={
+            "type": "message",
+            "message": message,
+            "sender": "human",
+            "timestamp": datetime.now().isoformat(),
+            "roomId": room_id
+        })
+    
+    elif message_type == "get_chat_history":
+        room_id = message_data.get("roomId")
+        before = message_data.get("before")
+        limit = message_data.get("limit", HISTORY_PAGE_SIZE)
+        
+        # Get one page of chat history
+        chat_history = await manager.get_chat_history(room_id, before, limit)
+        
+        if chat_history:
+            manager.send_to_agent(agent_id, {
+                "type": "chat_history",
+                "data": chat_history
+            })
+    
+    elif message_type == "typing":
+        room_id = message_data.get("roomId")
+        is_typing = message_data.get("isTyping", False)
+        
+        # Forward typing indicator to user through the relay
+        if manager.room_field(room_id, "user_id"):
+            manager.typing.update(room_id, "human", is_typing)
+    
+    elif message_type == "end_chat":
+        room_id = message_data.get("roomId")
+        agent_name = message_data.get("agentName", "Agent")
+        
+        # End the chat
+        success = await manager.end_chat(room_id)
+        
+        if success:
+            # Notify user
+            manager.emit_to_user(room_id, {
+                "type": "chat_ended",
+                "agentName": agent_name,
+                "roomId": room_id
+            })
+            
+            # Add system message
+            await manager.add_message(room_id, f"Chat ended by {agent_name}", "system")
+
+async def send_pending_requests(websocket: WebSocket, limit: int = 100, offset: int = 0):
+    pending_requests = await manager.get_pending_requests(limit, offset)
+    manager.send(websocket, {
+        "type": "pending_requests",
+        "requests": pending_requests,
+        "offset": offset,
+        "total": len(manager.scheduler)
+    })
 
 # WebSocket route for agent
 @app.websocket("/agent")
 async def agent_websocket(websocket: WebSocket):
-    await websocket.accept()
+    if not await manager.accept(websocket):
+        return
     agent_id = str(uuid.uuid4())
+    dispatcher = ConnectionDispatcher(MAX_IN_FLIGHT_FRAMES)
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            message_type = message_data.get("type", "message")
+            data = await receive_frame(websocket)
+            try:
+                message_data = decode(data, AGENT_EVENTS)
+            except FrameError as e:
+                await reject_frame(websocket, e)
+                continue
+            message_type = message_data["type"]
+            started = metrics.clock()
             
             if message_type == "agent_auth":
                 token = message_data.get("token")
@@ -507,110 +1636,108 @@ async def agent_websocket(websocket: WebSocket):
                 
                 # In a real application, validate the token
                 
-                # Add agent to connections
-                manager.agent_connections[agent_id] = websocket
+                # Add agent to connections; queued requests may be assigned right away
+                manager.open_agent_session(websocket, agent_id, agent_name)
+                await dispatcher.submit(None, metrics.timed("agent", message_type, manager.register_agent), websocket, agent_id, agent_name)
                 
                 # Send pending requests to agent
-                pending_requests = await manager.get_pending_requests()
-                await websocket.send_text(json.dumps({
-                    "type": "pending_requests",
-                    "requests": pending_requests
-                }))
+                await dispatcher.submit(None, send_pending_requests, websocket)
+                continue
             
-            elif message_type == "join_room_agent":
-                room_id = message_data.get("roomId")
-                agent_name = message_data.get("agentName", "Agent")
-                
-                # Agent joins the room
-                success = await manager.join_room_agent(room_id, agent_id, agent_name)
-                
-                if success:
-                    # Notify other agents
-                    for aid, ws in manager.agent_connections.items():
-                        if aid != agent_id:
-                            try:
-                                await ws.send_text(json.dumps({
-                                    "type": "request_taken",
-                                    "roomId": room_id,
-                                    "agentName": agent_name
-                                }))
-                            except:
-                                pass
+            elif message_type == "resume":
+                # Handled inline so later frames act as the resumed agent
+                agent_id = await manager.resume_agent(websocket, agent_id, message_data)
             
-            elif message_type == "message":
-                room_id = message_data.get("roomId")
-                message = message_data.get("message", "")
-                sender = message_data.get("sender", "human")
-                agent_name = message_data.get("agentName", "Agent")
-                
-                # Add message to the room
-                await manager.add_message(room_id, message, sender, agent_name)
-                
-                # Forward message to user
-                user_id = manager.chat_rooms.get(room_id, {}).get("userId")
-                if user_id and user_id in manager.active_connections:
-                    await manager.active_connections[user_id].send_text(json.dumps({
-                        "type": "message",
-                        "message": message,
-                        "sender": "human",
-                        "timestamp": datetime.now().isoformat(),
-                        "roomId": room_id
-                    }))
+            elif message_type == "get_pending_requests":
+                limit = max(1, min(message_data.get("limit", 100), 500))
+                offset = max(0, message_data.get("offset", 0))
+                await dispatcher.submit(None, metrics.timed("agent", message_type, send_pending_requests), websocket, limit, offset)
+                continue
             
-            elif message_type == "get_chat_history":
-                room_id = message_data.get("roomId")
-                
-                # Get chat history
-                chat_history = await manager.get_chat_history(room_id)
-                
-                if chat_history:
-                    await websocket.send_text(json.dumps({
-                        "type": "chat_history",
-                        "data": chat_history
-                    }))
+            elif message_type == "search":
+                await dispatcher.submit(None, metrics.timed("agent", message_type, send_search_results), websocket, message_data)
+                continue
             
-            elif message_type == "typing":
+            else:
+                # Rooms owned by another worker are handled there
                 room_id = message_data.get("roomId")
-                is_typing = message_data.get("isTyping", False)
-                
-                # Forward typing indicator to user
-                user_id = manager.chat_rooms.get(room_id, {}).get("userId")
-                if user_id and user_id in manager.active_connections:
-                    await manager.active_connections[user_id].send_text(json.dumps({
-                        "type": "typing",
-                        "isTyping": is_typing,
-                        "sender": "human",
-                        "roomId": room_id
-                    }))
+                if manager.backplane.is_remote(room_id):
+                    manager.forward_agent_command(agent_id, message_data)
+                elif message_type == "typing":
+                    # No I/O, so handled inline
+                    await handle_agent_command(agent_id, message_data)
+                else:
+                    await dispatcher.submit(room_id, metrics.timed("agent", message_type, handle_agent_command), agent_id, message_data)
+                    continue
             
-            elif message_type == "end_chat":
-                room_id = message_data.get("roomId")
-                agent_name = message_data.get("agentName", "Agent")
-                
-                # End the chat
-                success = await manager.end_chat(room_id)
-                
-                if success:
-                    # Notify user
-                    user_id = manager.chat_rooms.get(room_id, {}).get("userId")
-                    if user_id and user_id in manager.active_connections:
-                        await manager.active_connections[user_id].send_text(json.dumps({
-                            "type": "chat_ended",
-                            "agentName": agent_name,
-                            "roomId": room_id
-                        }))
-                    
-                    # Add system message
-                    await manager.add_message(room_id, f"Chat ended by {agent_name}", "system")
+            metrics.observe_handler("agent", message_type, started)
     
     except WebSocketDisconnect:
-        manager.disconnect_agent(agent_id)
+        manager.disconnect_agent(agent_id, websocket)
         print(f"Agent #{agent_id} disconnected")
+    finally:
+        await dispatcher.drain(DISPATCH_DRAIN_TIMEOUT)
+        await manager.release(websocket)
 
 # Route to serve the main HTML page
 @app.get("/")
 async def get_index():
     return {"message": "Welcome to the Chatbot API. Please connect via WebSocket."}
 
+# Prometheus scrape endpoint (404 when METRICS_ENABLED=0)
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Bulk transcript export, one JSON line per room in (startTime, roomId)
+# order, archived rooms included. start/end are ISO timestamps bounding startTime. To resume a cut-off
+# export, pass the roomId of the last line received as `after`.
+@app.get("/export/transcripts")
+async def export_transcript_file(start: str = None, end: str = None, status: str = None, agent: str = None, after: str = None, gzip: bool = False):
+    # In a real application, check the admin's token
+    for value in (start, end):
+        if value:
+            try:
+                datetime.fromisoformat(value)
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Invalid timestamp: {value}")
+    
+    query = export_query(start, end, status, agent)
+    if after:
+        start_time = await find_resume_point(db.chat_rooms, after, retention.archive)
+        if start_time is None:
+            raise HTTPException(status_code=400, detail=f"Unknown room: {after}")
+        query = after_room(query, start_time, after)
+    
+    filename = "transcripts.ndjson.gz" if gzip else "transcripts.ndjson"
+    return StreamingResponse(
+        export_transcripts(db.chat_rooms, db.chat_messages, query, compress=gzip, archive=retention.archive),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Cache statistics for sizing and hit-ratio checks
+@app.get("/stats")
+async def get_stats():
+    return {
+        "responseCache": response_cache.stats(),
+        "roomCache": manager.chat_rooms.stats(),
+        "connections": manager.broadcaster.stats(),
+        "dispatch": manager.scheduler.stats(),
+        "typing": manager.typing.stats(),
+        "search": manager.search.stats(),
+        "startup": getattr(app.state, "startup", None),
+        "retention": retention.stats()
+    }
+
+# Readiness probe: 503 until indexes exist and open rooms are recovered
+@app.get("/ready")
+async def get_ready():
+    if not manager.ready:
+        raise HTTPException(status_code=503, detail="Starting up")
+    return app.state.startup
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=5000)
+    uvicorn.run(app, host="0.0.0.0", port=5000, ws_max_size=MAX_FRAME_BYTES, ws_per_message_deflate=WS_PER_MESSAGE_DEFLATE)
@@ -1,5 +1,5 @@
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { toast } from '@/hooks/use-toast';
 
 interface Message {
@@ -7,6 +7,7 @@ interface Message {
   sender: 'user' | 'bot' | 'human' | 'system';
   timestamp: string;
   agentName?: string;
+  messageId?: string;
 }
 
 interface ChatWebSocketReturn {
@@ -25,34 +26,99 @@ export const useChatWebSocket = (): ChatWebSocketReturn => {
   const [isTyping, setIsTyping] = useState(false);
   const [roomId, setRoomId] = useState<string | null>(null);
   const [socket, setSocket] = useState<WebSocket | null>(null);
+  const [reconnects, setReconnects] = useState(0);
+  
+  // What a reconnecting socket needs to resume the room without a reload
+  const session = useRef<{ token?: string; lastEventSeq?: number; lastMessageSeq?: number }>({});
 
   // Initialize WebSocket connection
   useEffect(() => {
     if (roomId) {
-      const ws = new WebSocket('ws://localhost:5000/ws');
+      // Streamed tokens arrive in bursts; let the server batch them per frame
+      const ws = new WebSocket('ws://localhost:5000/ws?batch=25');
+      
+      let closing = false;
       
       ws.onopen = () => {
         console.log('Connected to WebSocket server');
+        
+        // Only the events missed while disconnected are sent again
+        if (session.current.token) {
+          ws.send(JSON.stringify({
+            type: 'resume',
+            roomId,
+            token: session.current.token,
+            lastEventSeq: session.current.lastEventSeq,
+            lastMessageSeq: session.current.lastMessageSeq
+          }));
+        }
       };
       
-      ws.onmessage = (event) => {
-        const data = JSON.parse(event.data);
+      const addStoredMessages = (stored: any[]) => {
+        setMessages((prevMessages) => [
+          ...prevMessages,
+          ...stored.map((m) => ({
+            message: m.message,
+            sender: m.sender,
+            timestamp: m.timestamp,
+            agentName: m.agentName ?? undefined
+          }))
+        ]);
+      };
+      
+      const handleEvent = (data: any) => {
+        if (typeof data.eventSeq === 'number') {
+          session.current.lastEventSeq = data.eventSeq;
+        }
+        if (typeof data.seq === 'number') {
+          session.current.lastMessageSeq = data.seq;
+        }
         
         if (data.type === 'message') {
-          setMessages((prevMessages) => [
-            ...prevMessages,
-            {
-              message: data.message,
-              sender: data.sender,
-              timestamp: data.timestamp,
-              agentName: data.agentName
+          setMessages((prevMessages) => {
+            const last = prevMessages[prevMessages.length - 1];
+            
+            // Streamed bot tokens extend the current reply; the final event replaces it
+            if (data.messageId && last && last.messageId === data.messageId) {
+              return [
+                ...prevMessages.slice(0, -1),
+                {
+                  ...last,
+                  message: data.partial ? last.message + data.message : data.message,
+                  timestamp: data.timestamp ?? last.timestamp
+                }
+              ];
             }
-          ]);
-          setIsTyping(false);
+            
+            return [
+              ...prevMessages,
+              {
+                message: data.message,
+                sender: data.sender,
+                timestamp: data.timestamp ?? new Date().toISOString(),
+                agentName: data.agentName,
+                messageId: data.messageId
+              }
+            ];
+          });
+          if (!data.partial) {
+            setIsTyping(false);
+          }
         } else if (data.type === 'typing') {
           setIsTyping(data.isTyping);
         } else if (data.type === 'room_created') {
+          session.current = { token: data.resumeToken, lastEventSeq: data.eventSeq };
           setRoomId(data.roomId);
+        } else if (data.type === 'resumed') {
+          // Older than the server's replay buffer: the stored messages instead
+          if (data.messages) {
+            addStoredMessages(data.messages);
+            if (data.messages.length) {
+              session.current.lastMessageSeq = data.messages[data.messages.length - 1].seq;
+            }
+          }
+        } else if (data.type === 'resume_failed') {
+          session.current = {};
         } else if (data.type === 'human_requested') {
           toast({
             title: 'Human Agent Requested',
@@ -68,17 +134,28 @@ export const useChatWebSocket = (): ChatWebSocketReturn => {
         }
       };
       
+      ws.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        
+        // A batch frame carries several events in order
+        (data.type === 'batch' ? data.events : [data]).forEach(handleEvent);
+      };
+      
       ws.onclose = () => {
         console.log('Disconnected from WebSocket server');
+        if (!closing) {
+          setTimeout(() => setReconnects((n) => n + 1), 1000);
+        }
       };
       
       setSocket(ws);
       
       return () => {
+        closing = true;
         ws.close();
       };
     }
-  }, [roomId]);
+  }, [roomId, reconnects]);
 
   const sendMessage = (message: string, sender: 'user') => {
     if (socket && socket.readyState === WebSocket.OPEN && roomId) {
@@ -96,7 +173,8 @@ export const useChatWebSocket = (): ChatWebSocketReturn => {
       socket.send(JSON.stringify({
         type: 'join_room',
         userName,
-        userEmail
+        userEmail,
+        streamTokens: true
       }));
     }
   };
@@ -0,0 +1,111 @@
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import backplane
+from backplane import UnixSocketBackplane
+
+
+# A worker's backplane with everything delivered to it recorded
+class Worker:
+    def __init__(self, path: str, worker_id: str):
+        self.backplane = UnixSocketBackplane(path, worker_id, reconnect_delay=0.05)
+        self.received = []
+
+    async def start(self):
+        await self.backplane.start(self.handle)
+
+    async def handle(self, message):
+        self.received.append(message)
+
+
+async def eventually(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+async def start_workers(count: int):
+    path = tempfile.mkdtemp(prefix="bp", dir="/tmp") + "/hub.sock"
+    workers = [Worker(path, f"w{index}") for index in range(count)]
+    for worker in workers:
+        await worker.start()
+    return workers
+
+
+async def close_workers(workers):
+    for worker in workers:
+        await worker.backplane.close()
+
+
+def test_departed_worker_releases_its_rooms():
+    async def scenario():
+        workers = await start_workers(3)
+        try:
+            hub_worker, leaving, staying = workers
+            leaving.backplane.claim_room("room_2")
+            staying.backplane.claim_room("room_3")
+            await eventually(lambda: hub_worker.backplane.room_owner("room_2") == "w1")
+            assert hub_worker.backplane.hub.rooms == {"room_2": "w1", "room_3": "w2"}
+
+            await leaving.backplane.close()
+            await eventually(lambda: hub_worker.backplane.room_owner("room_2") is None)
+            await eventually(lambda: staying.backplane.room_owner("room_2") is None)
+            assert hub_worker.backplane.hub.rooms == {"room_3": "w2"}
+            assert not staying.backplane.is_remote("room_2")
+        finally:
+            await close_workers([hub_worker, staying])
+
+    asyncio.run(scenario())
+
+
+def test_hub_worker_exit_drops_its_rooms_after_reelection():
+    async def scenario():
+        workers = await start_workers(3)
+        try:
+            hub_worker, first, second = workers
+            hub_worker.backplane.claim_room("room_4")
+            second.backplane.claim_room("room_5")
+            await eventually(lambda: first.backplane.room_owner("room_4") == "w0" and first.backplane.room_owner("room_5") == "w2")
+
+            await hub_worker.backplane.close()
+            await eventually(lambda: any(w.backplane.hub is not None for w in (first, second)))
+            await eventually(lambda: first.backplane.room_owner("room_4") is None and second.backplane.room_owner("room_4") is None)
+            # Survivors' own rooms are re-announced to the new hub
+            await eventually(lambda: first.backplane.room_owner("room_5") == "w2")
+        finally:
+            await close_workers([first, second])
+
+    asyncio.run(scenario())
+
+
+def test_oversized_frame_is_dropped_without_losing_the_connection(monkeypatch):
+    monkeypatch.setattr(backplane, "MAX_FRAME_BYTES", 100_000)
+
+    async def scenario():
+        workers = await start_workers(3)
+        try:
+            hub_worker, sender, receiver = workers
+            sender.backplane.claim_room("room_6")
+            await eventually(lambda: receiver.backplane.room_owner("room_6") == "w1")
+
+            # Past the StreamReader default, under the cap: delivered
+            sender.backplane.publish({"kind": "user", "text": "x" * 80_000})
+            await eventually(lambda: receiver.received)
+            # Over the cap, written raw as a misbehaving peer would
+            sender.backplane._writer.write(b'{"kind": "user", "text": "' + b"x" * 200_000 + b'"}\n')
+            sender.backplane.publish({"kind": "user", "text": "after"})
+            await eventually(lambda: len(receiver.received) == 2)
+
+            assert [len(message["text"]) for message in receiver.received] == [80_000, 5]
+            assert hub_worker.backplane.hub.rooms == {"room_6": "w1"}
+            assert receiver.backplane.room_owner("room_6") == "w1"
+        finally:
+            await close_workers(workers)
+
+    asyncio.run(scenario())
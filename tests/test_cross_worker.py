@@ -0,0 +1,206 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("motor")
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from backplane import UnixSocketBackplane
+from memory_db import MemoryDatabase
+
+
+def load_server():
+    # server.py mounts ./static at import time
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="srv", dir="/tmp"))
+    os.mkdir("static")
+    try:
+        import server
+    finally:
+        os.chdir(cwd)
+    return server
+
+
+server = load_server()
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.query_params = {}
+        self.received = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, payload):
+        self.received.append(json.loads(payload))
+
+    async def close(self, code: int = 1000):
+        pass
+
+    def of_type(self, message_type):
+        return [message for message in self.received if message.get("type") == message_type]
+
+
+async def eventually(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    # Two real ConnectionManagers sharing one database and a Unix socket
+    # hub. Module-level command handlers act on server.manager, so that is
+    # the first worker, which owns the rooms in these tests.
+    monkeypatch.setattr(server, "AUTO_ASSIGN", False)
+    server.use_database(MemoryDatabase())
+    path = tempfile.mkdtemp(prefix="bp", dir="/tmp") + "/hub.sock"
+    managers = [
+        server.ConnectionManager(UnixSocketBackplane(path, worker_id, reconnect_delay=0.05))
+        for worker_id in ("owner", "other")
+    ]
+    for manager in managers:
+        manager.ready = True
+    monkeypatch.setattr(server, "manager", managers[0])
+    return managers
+
+
+def run(managers, scenario):
+    async def main():
+        for manager in managers:
+            await manager.backplane.start(manager.handle_backplane_message)
+        try:
+            await scenario(*managers)
+        finally:
+            for manager in managers:
+                await manager.remote_commands.drain(1.0)
+                await manager.backplane.close()
+
+    asyncio.run(main())
+
+
+async def open_room(owner, other, user_id: str):
+    user_socket = FakeWebSocket()
+    await owner.connect(user_socket, user_id)
+    room = await owner.create_chat_room(user_id, "Ann")
+    await eventually(lambda: other.backplane.room_owner(room.room_id) == "owner")
+    return user_socket, room.room_id
+
+
+def test_agent_on_another_worker_joins_and_chats(workers):
+    async def scenario(owner, other):
+        user_socket, room_id = await open_room(owner, other, "user_1")
+        agent_socket = FakeWebSocket()
+        await other.connect_agent(agent_socket, "agent_1")
+
+        other.forward_agent_command("agent_1", {"type": "join_room_agent", "roomId": room_id, "agentName": "Bo"})
+        await eventually(lambda: user_socket.of_type("human_joined"))
+        other.forward_agent_command("agent_1", {"type": "message", "roomId": room_id, "message": "Hi, how can I help?", "agentName": "Bo"})
+        await eventually(lambda: user_socket.of_type("message"))
+
+        assert user_socket.of_type("message")[0]["message"] == "Hi, how can I help?"
+        room = owner.chat_rooms.peek(room_id)
+        assert room.agent_id == "agent_1" and room.message_count == 1
+        # The other worker never took a copy of the room
+        assert other.chat_rooms.peek(room_id) is None
+
+    run(workers, scenario)
+
+
+def test_user_command_is_answered_through_the_users_worker(workers):
+    async def scenario(owner, other):
+        _, room_id = await open_room(owner, other, "user_1")
+        # The user's connection moved to the other worker
+        user_socket = FakeWebSocket()
+        await other.connect(user_socket, "user_1")
+        owner.active_connections.pop("user_1")
+
+        other.forward_user_command("user_1", {"type": "message", "roomId": room_id, "message": "Where is my order?", "sender": "user"}, {"streamTokens": False})
+        await eventually(lambda: user_socket.of_type("message"), timeout=10.0)
+
+        assert user_socket.of_type("message")[0]["sender"] == "bot"
+        assert owner.chat_rooms.peek(room_id).message_count == 2
+
+    run(workers, scenario)
+
+
+def test_history_larger_than_64k_reaches_a_remote_agent(workers):
+    async def scenario(owner, other):
+        _, room_id = await open_room(owner, other, "user_1")
+        for index in range(200):
+            await owner.add_message(room_id, f"{index} " + "x" * 1000, "user")
+        agent_socket = FakeWebSocket()
+        await other.connect_agent(agent_socket, "agent_1")
+
+        other.forward_agent_command("agent_1", {"type": "get_chat_history", "roomId": room_id, "limit": 200})
+        await eventually(lambda: agent_socket.of_type("chat_history"))
+
+        history = agent_socket.of_type("chat_history")[0]["data"]
+        assert len(history["messages"]) == 200
+        # The hub kept the owner's connection, and with it the room
+        assert other.backplane.room_owner(room_id) == "owner"
+        assert owner.backplane.hub.rooms[room_id] == "owner"
+
+    run(workers, scenario)
+
+
+def test_remote_room_reads_are_not_cached(workers):
+    async def scenario(owner, other):
+        _, room_id = await open_room(owner, other, "user_1")
+        await owner.add_message(room_id, "first", "user")
+        assert (await other.get_chat_history(room_id))["messageCount"] == 1
+
+        await owner.add_message(room_id, "second", "user")
+        history = await other.get_chat_history(room_id)
+        assert history["messageCount"] == 2
+        assert [message["message"] for message in history["messages"]] == ["first", "second"]
+        assert other.chat_rooms.peek(room_id) is None
+
+    run(workers, scenario)
+
+
+def test_delete_on_another_worker_reaches_the_owner(workers):
+    async def scenario(owner, other):
+        _, room_id = await open_room(owner, other, "user_1")
+        await owner.end_chat(room_id)
+
+        assert await other.delete_chat(room_id)
+        await eventually(lambda: owner.chat_rooms.peek(room_id) is None)
+        await eventually(lambda: other.backplane.room_owner(room_id) is None)
+        assert await server.db.chat_rooms.find_one({"roomId": room_id}) is None
+
+    run(workers, scenario)
+
+
+def test_every_worker_searches_every_room(workers, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "SEARCH_INDEX_PATH", str(tmp_path / "search_index.pkl"))
+
+    async def scenario(owner, other):
+        _, room_id = await open_room(owner, other, "user_1")
+        await owner.add_message(room_id, "my parcel never arrived", "user")
+        await eventually(lambda: other.search.search("parcel", None, None, None, 10, 0)[0] == 1)
+
+        # Only the leader writes the shared snapshot
+        await other.save_search_index()
+        assert not (tmp_path / "search_index.pkl").exists()
+        await owner.save_search_index()
+        assert (tmp_path / "search_index.pkl").exists()
+
+        await owner.end_chat(room_id)
+        assert await other.delete_chat(room_id)
+        await eventually(lambda: owner.search.search("parcel", None, None, None, 10, 0)[0] == 0)
+        assert other.search.search("parcel", None, None, None, 10, 0)[0] == 0
+
+    run(workers, scenario)
@@ -0,0 +1,153 @@
+import asyncio
+import socket
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+aiosmtpd = pytest.importorskip("aiosmtpd.controller")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from email_outbox import EmailOutbox
+
+
+class Inbox:
+    def __init__(self):
+        self.received = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.received.append((time.monotonic(), envelope.content.decode()))
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def smtp_server():
+    inbox = Inbox()
+    controller = aiosmtpd.Controller(inbox, hostname="127.0.0.1", port=free_port())
+    controller.start()
+    yield inbox, controller.port
+    controller.stop()
+
+
+def outbox_for(port: int, **options) -> EmailOutbox:
+    return EmailOutbox("127.0.0.1", port, "alerts@example.com", "support@example.com", starttls=False, **options)
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_idle_notification_is_sent_right_away(smtp_server):
+    inbox, port = smtp_server
+
+    async def scenario():
+        outbox = outbox_for(port, digest_window=5.0)
+        await outbox.start()
+        started = time.monotonic()
+        outbox.enqueue("New Support Request", "room_1 needs help")
+        await wait_for(lambda: inbox.received)
+        await outbox.close()
+        return started, outbox
+
+    started, outbox = asyncio.run(scenario())
+    received_at, content = inbox.received[0]
+    assert received_at - started < 2.0
+    assert "Subject: New Support Request" in content
+    assert "room_1 needs help" in content
+    assert outbox.sent == 1 and outbox.failed == 0
+
+
+def test_burst_after_a_send_is_folded_into_one_digest(smtp_server):
+    inbox, port = smtp_server
+
+    async def scenario():
+        outbox = outbox_for(port, digest_window=0.5)
+        await outbox.start()
+        outbox.enqueue("New Support Request", "first")
+        await wait_for(lambda: inbox.received)
+        for index in range(3):
+            outbox.enqueue("New Support Request", f"burst {index}")
+        await wait_for(lambda: len(inbox.received) == 2)
+        await outbox.close()
+        return outbox
+
+    outbox = asyncio.run(scenario())
+    assert len(inbox.received) == 2
+    digest = inbox.received[1][1]
+    assert "Subject: 3 New Support Requests" in digest
+    assert all(f"burst {index}" in digest for index in range(3))
+    assert outbox.sent == 4
+
+
+def test_close_delivers_queued_notifications(smtp_server):
+    inbox, port = smtp_server
+
+    async def scenario():
+        outbox = outbox_for(port, digest_window=60.0)
+        await outbox.start()
+        outbox.enqueue("New Support Request", "first")
+        await wait_for(lambda: inbox.received)
+        outbox.enqueue("New Support Request", "second")
+        await outbox.close()
+
+    asyncio.run(scenario())
+    assert len(inbox.received) == 2
+    assert "second" in inbox.received[1][1]
+
+
+def test_full_queue_drops_new_notifications(smtp_server):
+    inbox, port = smtp_server
+
+    async def scenario():
+        outbox = outbox_for(port, max_queue=2)
+        for index in range(3):
+            outbox.enqueue("New Support Request", f"request {index}")
+        assert outbox.dropped == 1
+        await outbox.start()
+        await outbox.close()
+        return outbox
+
+    outbox = asyncio.run(scenario())
+    assert outbox.sent == 2
+    assert "request 2" not in "".join(content for _, content in inbox.received)
+
+
+def test_failed_send_does_not_hold_up_later_notifications(smtp_server):
+    inbox, port = smtp_server
+
+    async def scenario():
+        outbox = outbox_for(port, digest_window=0.0, backoff=0.3)
+        real_send = outbox._send_blocking
+        failures = []
+
+        def flaky_send(msg):
+            if "first" in msg.get_payload() and not failures:
+                failures.append(msg)
+                raise OSError("connection refused")
+            real_send(msg)
+
+        outbox._send_blocking = flaky_send
+        await outbox.start()
+        outbox.enqueue("New Support Request", "first")
+        await wait_for(lambda: failures)
+        outbox.enqueue("New Support Request", "second")
+        await wait_for(lambda: len(inbox.received) == 2)
+        await outbox.close()
+        return outbox
+
+    outbox = asyncio.run(scenario())
+    # The second notification is not stuck behind the first one's backoff
+    assert "second" in inbox.received[0][1]
+    assert "first" in inbox.received[1][1]
+    assert outbox.sent == 2 and outbox.failed == 0
@@ -0,0 +1,134 @@
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import zlib
+
+from codec import encode_bytes
+from retention import decompress_transcript
+
+# Rooms per batch; their message buckets are fetched with one query
+EXPORT_BATCH_SIZE = 200
+
+# Export order. Resuming after a room continues from its (startTime, roomId).
+EXPORT_SORT = [("startTime", 1), ("roomId", 1)]
+
+
+def export_query(start: str = None, end: str = None, status: str = None, agent: str = None) -> Dict[str, Any]:
+    # start/end bound startTime (ISO strings compare in time order);
+    # agent matches the agent's name or id
+    query: Dict[str, Any] = {}
+    if start or end:
+        query["startTime"] = {}
+        if start:
+            query["startTime"]["$gte"] = start
+        if end:
+            query["startTime"]["$lt"] = end
+    if status:
+        query["status"] = status
+    if agent:
+        query["$or"] = [{"agentName": agent}, {"agentId": agent}]
+    return query
+
+
+def after_room(query: Dict[str, Any], start_time: str, room_id: str) -> Dict[str, Any]:
+    # Narrows query to the rooms sorted after the given one
+    keyset = {"$or": [
+        {"startTime": {"$gt": start_time}},
+        {"startTime": start_time, "roomId": {"$gt": room_id}}
+    ]}
+    return {"$and": [query, keyset]} if query else keyset
+
+
+def _unpack_archived(rooms: List[Dict[str, Any]]):
+    # Archive documents in the export shape: their transcript as messages
+    for room in rooms:
+        blob = room.pop("transcript")
+        room["messages"] = decompress_transcript(bytes(blob), room.pop("codec"))
+        room.pop("rawBytes", None)
+        room.pop("transcriptBytes", None)
+
+
+async def _export_batch(messages, rooms: List[Dict[str, Any]]) -> bytes:
+    archived = [room for room in rooms if "transcript" in room]
+    if archived:
+        await asyncio.to_thread(_unpack_archived, archived)
+
+    stored: Dict[str, List[Dict[str, Any]]] = {room["roomId"]: [] for room in rooms if "archivedAt" not in room}
+    if stored:
+        cursor = messages.find({"roomId": {"$in": list(stored)}}, {"_id": 0, "roomId": 1, "messages": 1})
+        async for bucket in cursor:
+            stored[bucket["roomId"]].extend(bucket["messages"])
+
+    lines = []
+    for room in rooms:
+        room_messages = stored.get(room["roomId"])
+        if room_messages is not None:
+            room_messages.sort(key=lambda m: m["seq"])
+            # Rooms from before bucketing keep their messages inline
+            room["messages"] = room.get("messages", []) + room_messages
+        lines.append(encode_bytes(room))
+    return b"\n".join(lines) + b"\n"
+
+
+def _sort_key(room: Dict[str, Any]) -> Tuple[str, str]:
+    return room.get("startTime") or "", room["roomId"]
+
+
+async def _next(cursor) -> Optional[Dict[str, Any]]:
+    try:
+        return await cursor.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _rooms_in_order(hot, archived) -> AsyncIterator[Dict[str, Any]]:
+    # Merges two cursors that are both in EXPORT_SORT order. A room caught
+    # between being archived and deleted is in both; the archive copy wins.
+    room, old = await _next(hot), await _next(archived)
+    while room is not None or old is not None:
+        if old is None or (room is not None and _sort_key(room) < _sort_key(old)):
+            yield room
+            room = await _next(hot)
+            continue
+        if room is not None and room["roomId"] == old["roomId"]:
+            room = await _next(hot)
+        yield old
+        old = await _next(archived)
+
+
+async def export_transcripts(rooms, messages, query: Dict[str, Any], compress: bool = False, batch_size: int = EXPORT_BATCH_SIZE, archive=None) -> AsyncIterator[bytes]:
+    # One JSON line per room with its messages, streamed from Mongo cursors
+    # over the hot rooms and, if given, the archive, with the same filters.
+    # Only one batch of rooms and their transcripts is held at a time. Gzip
+    # output is flushed per batch so a cut-off download still decodes to
+    # whole lines.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    cursor = rooms.find(query, {"_id": 0, "resumeToken": 0}, sort=EXPORT_SORT, batch_size=batch_size)
+    if archive is not None:
+        archived = archive.find(query, {"_id": 0}, sort=EXPORT_SORT, batch_size=batch_size)
+        cursor = _rooms_in_order(cursor, archived)
+
+    batch: List[Dict[str, Any]] = []
+    async for room in cursor:
+        batch.append(room)
+        if len(batch) < batch_size:
+            continue
+        chunk = await _export_batch(messages, batch)
+        batch = []
+        yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH) if compressor else chunk
+
+    if batch:
+        chunk = await _export_batch(messages, batch)
+        yield compressor.compress(chunk) if compressor else chunk
+    if compressor:
+        yield compressor.flush()
+
+
+async def find_resume_point(rooms, room_id: str, archive=None) -> Optional[str]:
+    # startTime of the room an export should continue after, hot or archived
+    for collection in (rooms, archive):
+        if collection is None:
+            continue
+        room = await collection.find_one({"roomId": room_id}, {"_id": 0, "startTime": 1})
+        if room:
+            return room.get("startTime")
+    return None
@@ -0,0 +1,147 @@
+from typing import Any, Callable, Dict, Optional, Tuple
+import asyncio
+import time
+
+
+class _TypingState:
+    __slots__ = ("shown", "sent_at", "pending", "flush", "timer")
+
+    def __init__(self):
+        self.shown = False
+        self.sent_at = 0.0
+        self.pending: Optional[bool] = None
+        self.flush: Optional[asyncio.TimerHandle] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+# Typing indicators for each room and sender. A state the other side
+# already has is dropped, changes go out at most once per interval (the
+# latest one wins), and "typing" clears itself after the timeout unless
+# the sender keeps refreshing it. Nothing here awaits, so receive loops
+# can call update() inline.
+class TypingRelay:
+    def __init__(self, forward: Callable[[str, str, bool], Any], interval: float = 0.5, timeout: float = 6.0):
+        self.forward = forward
+        self.interval = interval
+        self.timeout = timeout
+        self._states: Dict[Tuple[str, str], _TypingState] = {}
+
+        self.received = 0
+        self.forwarded = 0
+        self.suppressed = 0
+        self.throttled = 0
+        self.expired = 0
+
+    def update(self, room_id: str, sender: str, is_typing: bool):
+        self.received += 1
+        key = (room_id, sender)
+        state = self._states.get(key)
+        if state is None:
+            if not is_typing:
+                # Nothing is shown, so there is nothing to clear
+                self.suppressed += 1
+                return
+            state = self._states[key] = _TypingState()
+
+        if state.flush is not None:
+            # A change is already waiting out the interval
+            state.pending = is_typing
+            self.throttled += 1
+            if is_typing and state.shown:
+                self._arm(key, state, self.timeout, self._expire)
+            return
+
+        if is_typing == state.shown:
+            self.suppressed += 1
+            if is_typing:
+                self._arm(key, state, self.timeout, self._expire)
+            return
+
+        wait = state.sent_at + self.interval - time.monotonic()
+        if wait > 0:
+            state.pending = is_typing
+            state.flush = asyncio.get_running_loop().call_later(wait, self._flush, key)
+            self.throttled += 1
+            return
+
+        self._send(key, state, is_typing)
+
+    def clear(self, room_id: str, sender: str):
+        # A message from the sender already ends its indicator on the other side
+        key = (room_id, sender)
+        state = self._states.get(key)
+        if state is None:
+            return
+        if state.flush is not None:
+            state.flush.cancel()
+            state.flush = None
+            state.pending = None
+        state.shown = False
+        self._arm(key, state, self.interval, self._forget)
+
+    def drop(self, room_id: str):
+        # The room is gone; forget both directions without sending anything
+        for sender in [sender for rid, sender in self._states if rid == room_id]:
+            state = self._states.pop((room_id, sender))
+            for handle in (state.flush, state.timer):
+                if handle is not None:
+                    handle.cancel()
+
+    def _send(self, key: Tuple[str, str], state: _TypingState, is_typing: bool):
+        state.shown = is_typing
+        state.sent_at = time.monotonic()
+        self.forwarded += 1
+        if is_typing:
+            self._arm(key, state, self.timeout, self._expire)
+        else:
+            # Kept for one interval so a quick restart is still throttled
+            self._arm(key, state, self.interval, self._forget)
+        self.forward(key[0], key[1], is_typing)
+
+    def _arm(self, key: Tuple[str, str], state: _TypingState, delay: float, callback: Callable):
+        if state.timer is not None:
+            state.timer.cancel()
+        state.timer = asyncio.get_running_loop().call_later(delay, callback, key)
+
+    def _flush(self, key: Tuple[str, str]):
+        state = self._states.get(key)
+        if state is None:
+            return
+        state.flush = None
+        pending, state.pending = state.pending, None
+        if pending is not None and pending != state.shown:
+            self._send(key, state, pending)
+        elif not state.shown:
+            self._forget(key)
+
+    def _expire(self, key: Tuple[str, str]):
+        state = self._states.get(key)
+        if state is None or not state.shown:
+            return
+        state.timer = None
+        self.expired += 1
+        if state.flush is not None:
+            state.flush.cancel()
+            state.flush = None
+            state.pending = None
+        self._send(key, state, False)
+
+    def _forget(self, key: Tuple[str, str]):
+        state = self._states.get(key)
+        if state is not None and not state.shown and state.flush is None:
+            if state.timer is not None:
+                state.timer.cancel()
+            del self._states[key]
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "suppressed": self.suppressed,
+            "throttled": self.throttled,
+            "expired": self.expired,
+            "active": len(self._states)
+        }